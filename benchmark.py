@@ -0,0 +1,340 @@
+# ✅ benchmark.py
+# --- 离线基准测试：不连接 Telegram，用本地模拟的 Bot API 驱动投稿处理流程 ---
+# 用法：python benchmark.py --concurrency 1,8,32 --users 10,1000 --updates 2000
+# 可选：--latency 0.05（模拟 API 延迟秒数） --error-rate 0.01（模拟 502） --retry-after-rate 0.005（模拟 429）
+#       --limits（保留真实的出站限流） --trace-alloc（统计内存分配，会明显变慢）
+#       --album-memory 1000（比较收集中媒体组保存完整消息与紧凑记录的内存占用）
+# 在临时目录中运行，不会读写当前目录下的 config.json、blacklist.json 和数据库
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from telegram import Message, Update
+from telegram.request import BaseRequest
+
+ADMIN_ID = 999
+# 模拟转发消息的 ID 从这里开始，与预先登记的管理员回复目标不重叠
+FAKE_MESSAGE_ID_START = 10 ** 6
+
+
+class FakeRequest(BaseRequest):
+    """
+    模拟的 Bot API：
+    - 每次请求等待 latency 秒（可加 ±jitter 随机抖动）
+    - 按 error_rate 返回 502（NetworkError，可重试），按 retry_after_rate 返回 429（RetryAfter）
+    - 返回格式与 Telegram 一致，由真实的 telegram.Bot 解析
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, retry_after_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.calls = 0
+        self._message_ids = itertools.count(FAKE_MESSAGE_ID_START)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    @property
+    def read_timeout(self):
+        return 5
+
+    def _message(self, chat_id):
+        return {"message_id": next(self._message_ids), "date": int(time.time()), "chat": {"id": chat_id, "type": "private"}}
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None, connect_timeout=None, pool_timeout=None):
+        self.calls += 1
+        name = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data else {}
+        delay = self.latency + random.uniform(-self.jitter, self.jitter) if self.latency else 0
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if name.startswith(("send", "copy")):
+            roll = random.random()
+            if roll < self.retry_after_rate:
+                body = {"ok": False, "error_code": 429, "description": "Too Many Requests", "parameters": {"retry_after": self.retry_after}}
+                return 429, json.dumps(body).encode()
+            if roll < self.retry_after_rate + self.error_rate:
+                return 502, json.dumps({"ok": False, "error_code": 502, "description": "Bad Gateway"}).encode()
+        chat_id = int(params.get("chat_id") or 1)
+        if name == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        elif name == "sendMediaGroup":
+            media = params["media"]
+            count = len(json.loads(media) if isinstance(media, str) else media)
+            result = [self._message(chat_id) for _ in range(count)]
+        elif name == "copyMessage":
+            result = {"message_id": next(self._message_ids)}
+        elif name.startswith("send"):
+            result = self._message(chat_id)
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+# 构造各类投稿的 Update 数据（tag 区分不同场景的文件 ID 和文字，避免被去重拦截）
+class UpdateFactory:
+    def __init__(self, users, seed=0, tag=""):
+        self.users = users
+        self.tag = tag
+        self.random = random.Random(seed)
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.unique_ids = itertools.count(1)
+        self.group_ids = itertools.count(1)
+
+    def _message(self, user_id, **fields):
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"},
+        }
+        message.update(fields)
+        return {"update_id": next(self.update_ids), "message": message}
+
+    def _file(self, **extra):
+        unique = next(self.unique_ids)
+        return dict(file_id=f"file{self.tag}{unique}", file_unique_id=f"uniq{self.tag}{unique}", **extra)
+
+    def _user(self):
+        return 1000 + self.random.randrange(self.users)
+
+    def text(self):
+        user_id = self._user()
+        return [self._message(user_id, text=f"benchmark text {self.tag}{next(self.unique_ids)} from {user_id}")]
+
+    def photo(self):
+        return [self._message(self._user(), photo=[self._file(width=90, height=90), self._file(width=1280, height=1280)], caption="photo")]
+
+    def video(self):
+        return [self._message(self._user(), video=self._file(width=1280, height=720, duration=10), caption="video")]
+
+    def document(self):
+        return [self._message(self._user(), document=self._file(file_name="bench.zip"), caption="document")]
+
+    def media_group(self):
+        user_id = self._user()
+        group_id = f"bench{next(self.group_ids)}"
+        size = self.random.randint(2, 10)
+        # 与真实图片消息一样带有多个尺寸
+        parts = [
+            self._message(user_id, media_group_id=group_id, photo=[self._file(width=w, height=w) for w in (90, 320, 800, 1280)])
+            for _ in range(size)
+        ]
+        parts[0]["message"]["caption"] = "album"
+        return parts
+
+    # 管理员回复一条转发消息（目标消息 ID 预先登记在 MESSAGE_INDEX 中）
+    def admin_reply(self):
+        target = self.random.randrange(1, self.users + 1)
+        reply_to = {"message_id": target, "date": int(time.time()), "chat": {"id": ADMIN_ID, "type": "private"}, "text": "forwarded"}
+        return [self._message(ADMIN_ID, text="admin reply", reply_to_message=reply_to)]
+
+
+# 投稿类型及其占比
+MIX = {"text": 40, "photo": 25, "video": 8, "document": 7, "media_group": 10, "admin_reply": 10}
+
+
+def build_updates(factory, count):
+    kinds = list(MIX)
+    weights = [MIX[k] for k in kinds]
+    updates = []
+    while len(updates) < count:
+        updates.extend(getattr(factory, factory.random.choices(kinds, weights)[0])())
+    return updates
+
+
+def percentiles(histogram, *labels):
+    if not histogram.count(*labels):
+        return "-"
+    return "/".join(f"{histogram.quantile(q, *labels) * 1000:.1f}" for q in (0.5, 0.95, 0.99))
+
+
+# 运行一个场景：concurrency 个并发处理槽位、users 个投稿用户
+async def run_scenario(b, state, args, concurrency, users):
+    from metrics import METRICS, HANDLER_LATENCY
+    from outbound_limiter import OutboundLimiter
+    from safe_send import SEND_RETRIES, SEND_FAILURES
+    from telegram.ext import Application
+    from update_processor import KeyedUpdateProcessor
+
+    if not args.limits:
+        # 关闭出站限流，只测量处理流程本身
+        state.outbound_limiter = OutboundLimiter(global_rate=1e9, global_burst=1e9, chat_rate=1e9, chat_burst=1e9)
+    METRICS.reset()
+    request = FakeRequest(args.latency, args.jitter, args.error_rate, args.retry_after_rate, args.retry_after)
+    application = (
+        Application.builder()
+        .token("123456:BENCHMARK")
+        .request(request)
+        .get_updates_request(FakeRequest())
+        .concurrent_updates(KeyedUpdateProcessor(concurrency))
+        .build()
+    )
+    b.register_handlers(application, state)
+    factory = UpdateFactory(users, seed=concurrency * 100003 + users, tag=f"c{concurrency}u{users}-")
+    # 预先登记管理员回复的目标消息
+    for message_id in range(1, users + 1):
+        state.message_index.record(ADMIN_ID, [message_id], 1000 + message_id - 1)
+    updates = [Update.de_json(data, application.bot) for data in build_updates(factory, args.updates)]
+
+    await application.initialize()
+    await application.start()
+    await b.on_startup(application)
+    if args.trace_alloc:
+        tracemalloc.start()
+        tracemalloc.reset_peak()
+    mem_before = tracemalloc.get_traced_memory()[0] if args.trace_alloc else 0
+    started = time.perf_counter()
+    for update in updates:
+        application.update_queue.put_nowait(update)
+    # 等待：所有更新处理完毕、媒体组全部转发、发送队列清空
+    deadline = started + args.timeout
+    while time.perf_counter() < deadline:
+        handled = HANDLER_LATENCY.count("handle_post") + HANDLER_LATENCY.count("handle_admin_reply")
+        outbox = state.outbox.stats()
+        if (
+            handled >= len(updates)
+            and not state.media_groups
+            and not outbox.get("pending")
+            and not outbox.get("running")
+        ):
+            break
+        await asyncio.sleep(0.01)
+    elapsed = time.perf_counter() - started
+    if args.trace_alloc:
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    await state.outbox.stop_workers()
+    await application.stop()
+    await application.shutdown()
+
+    retries = sum(SEND_RETRIES.value(m) for (m,) in b.SEND_LATENCY.series())
+    failures = sum(
+        SEND_FAILURES.value(m, reason) for (m,) in b.SEND_LATENCY.series() for reason in ("terminal", "exhausted")
+    )
+    row = {
+        "concurrency": concurrency,
+        "users": users,
+        "updates": len(updates),
+        "seconds": elapsed,
+        "updates_per_sec": len(updates) / elapsed if elapsed else 0,
+        "handle_post_ms": percentiles(HANDLER_LATENCY, "handle_post"),
+        "media_group_ms": percentiles(HANDLER_LATENCY, "process_media_group"),
+        "admin_reply_ms": percentiles(HANDLER_LATENCY, "handle_admin_reply"),
+        "api_calls": request.calls,
+        "retries": retries,
+        "failures": failures,
+        "timed_out": elapsed >= args.timeout,
+    }
+    if args.trace_alloc:
+        row["alloc_peak_kb"] = (peak - mem_before) / 1024
+        row["alloc_retained_kb"] = (current - mem_before) / 1024
+    return row
+
+
+# 比较 count 个收集中媒体组的内存占用：保留完整的 Message 对象（旧做法） / 只保留 MediaItem 记录
+def measure_album_memory(count):
+    from media_group_buffer import MediaGroup, MediaGroupBuffer, MediaItem
+
+    factory = UpdateFactory(count, seed=count, tag="mem-")
+    albums = [[part["message"] for part in factory.media_group()] for _ in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    full = [[Message.de_json(data, None) for data in album] for album in albums]
+    full_bytes = tracemalloc.get_traced_memory()[0] - before
+    del full
+    before = tracemalloc.get_traced_memory()[0]
+    buffer = MediaGroupBuffer(max_groups=count, max_items=count * 10)
+    for group_id, album in enumerate(albums):
+        buffer.add_group(group_id, MediaGroup(album[0]["from"]["id"], album[0]["chat"]["id"], "caption_info", time.time()))
+        for data in album:
+            buffer.add_item(group_id, MediaItem.from_message(Message.de_json(data, None)))
+    compact_bytes = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    items = sum(len(album) for album in albums)
+    print(
+        f"{count} 个媒体组（{items} 条）：完整消息 {full_bytes / count / 1024:.1f} KB/组，"
+        f"紧凑记录 {compact_bytes / count / 1024:.1f} KB/组（约 {full_bytes / compact_bytes:.0f} 倍）"
+    )
+
+
+def print_table(rows):
+    columns = list(rows[0])
+    cells = [[f"{v:.1f}" if isinstance(v, float) else str(v) for v in row.values()] for row in rows]
+    widths = [max(len(c), *(len(r[i]) for r in cells)) for i, c in enumerate(columns)]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in cells:
+        print("  ".join(v.ljust(w) for v, w in zip(r, widths)))
+    print("（延迟列为 p50/p95/p99 毫秒）")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="imneko_bot 离线基准测试")
+    parser.add_argument("--concurrency", default="1,8,32", help="并发处理数，逗号分隔")
+    parser.add_argument("--users", default="10,1000", help="投稿用户数，逗号分隔")
+    parser.add_argument("--updates", type=int, default=2000, help="每个场景的更新数")
+    parser.add_argument("--latency", type=float, default=0.0, help="模拟 Bot API 延迟（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="延迟随机抖动（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 502 的概率")
+    parser.add_argument("--retry-after-rate", type=float, default=0.0, help="返回 429 的概率")
+    parser.add_argument("--retry-after", type=int, default=1, help="429 的 retry_after 秒数")
+    parser.add_argument("--album-idle", type=float, default=0.05, help="媒体组静默等待时间（秒）")
+    parser.add_argument("--workers", type=int, default=4, help="发送队列工作协程数")
+    parser.add_argument("--limits", action="store_true", help="保留真实的出站限流")
+    parser.add_argument("--trace-alloc", action="store_true", help="用 tracemalloc 统计内存分配")
+    parser.add_argument("--album-memory", type=int, default=0, help="只比较该数量的收集中媒体组的内存占用")
+    parser.add_argument("--timeout", type=float, default=300, help="单个场景最长等待（秒）")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出结果")
+    return parser.parse_args()
+
+
+async def run(args):
+    if args.album_memory:
+        sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+        measure_album_memory(args.album_memory)
+        return
+    # 在临时目录中创建配置并导入机器人模块
+    workdir = tempfile.mkdtemp(prefix="imneko-bench-")
+    with open(os.path.join(workdir, "config.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "token": "123456:BENCHMARK",
+            "admin_id": str(ADMIN_ID),
+            "media_group": {"idle": args.album_idle, "max_wait": max(args.album_idle * 5, 0.5)},
+            "outbox_workers": args.workers,
+            "dedup": {"enabled": True, "persist": True},
+        }, f)
+    os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import imneko_bot as b
+    state, = b.init()
+
+    rows = []
+    for concurrency in (int(c) for c in args.concurrency.split(",")):
+        for users in (int(u) for u in args.users.split(",")):
+            rows.append(await run_scenario(b, state, args, concurrency, users))
+    await state.storage.close()
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    else:
+        print_table(rows)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(parse_args()))
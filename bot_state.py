@@ -0,0 +1,164 @@
+# ✅ bot_state.py
+# --- 单个机器人的运行状态 ---
+# 配置、禁言名单与可修改配置的存储后端、限流器、媒体组缓存、错误通知聚合器、发送队列等都属于某一个机器人，
+# 统一保存在 BotState 中。处理函数通过 context.bot_data["state"] 取得当前机器人的状态，
+# 因此同一进程内可以同时运行多个机器人，彼此互不影响。
+
+import json
+import logging
+import os
+
+from checkpoint import Checkpoint
+from config_snapshot import ConfigSnapshot, ConfigError
+from dedup import DuplicateDetector
+from media_group_buffer import MediaGroupBuffer
+from message_index import MessageIndex
+from outbound_limiter import OutboundLimiter
+from outbox import Outbox
+from profile_cache import ProfileCache
+from rate_limit import SlidingWindowLimiter, SharedWindowLimiter
+from safe_send import ErrorNotifier
+from shared_state import create_shared_state
+from storage import create_storage
+
+# 每个机器人目录下的文件名（单机器人模式下即当前目录）
+CONFIG_PATH = "config.json"
+BLACKLIST_PATH = "blacklist.json"
+WELCOME_IMG_PATH = "welcome.jpg"  # 欢迎图默认路径
+REPLY_IMG_PATH = "reply_banner.jpg"  # 自动回复图像储存路径
+PENDING_ACTION_TTL = 600  # 共享模式下管理员等待中的操作的有效期（秒）
+
+
+# 通用 JSON 文件读取函数
+# 文件不存在时返回默认值；文件损坏时记录错误日志再返回默认值
+def load_json(path, default=None):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.error(f"读取 {path} 失败: {e}")
+    return {} if default is None else default
+
+
+class BotState:
+    """
+    一个机器人的全部状态：
+    - 启动参数：token、admin_id、运行模式、webhook、并发数、数据库路径等（修改后需重启）
+    - config: 当前配置快照（管理员指令或手动编辑配置文件后整体替换）
+    - storage / outbox / message_index / duplicates / checkpoint: 存储后端与数据库（同一机器人共用一个数据库文件）
+    - post_limiter / outbound_limiter / error_notifier / profiles: 投稿限制、出站限流、错误通知、用户资料缓存
+    - media_groups / flushed_groups / media_group_stats / pending_action: 只存在于内存中的运行状态
+    - shared: 多进程共享状态（可选），启用后投稿计数、收集中的媒体组、等待中的操作改为保存在共享状态中
+    所有文件路径都相对于 base_dir（单机器人模式下为当前目录）
+    """
+
+    def __init__(self, base_dir="", config_path=CONFIG_PATH, config=None, timer=None):
+        self.base_dir = base_dir
+        self.config_path = self.path(config_path)
+        startup_config = load_json(self.config_path) if config is None else config
+        self.startup_config = startup_config
+        self.token = startup_config.get("token")
+        self.admin_id = startup_config.get("admin_id")
+        if not self.token or not self.admin_id:
+            raise ConfigError(f"{self.config_path} 缺少 token 或 admin_id")
+        # 媒体组收集参数：最后一条到达后静默 idle 秒即转发，从第一条起最多等待 max_wait 秒
+        # 最多同时收集 max_groups 个媒体组、共 max_items 条消息，超出时最早的媒体组提前转发
+        self.media_group_cfg = startup_config.get("media_group", {"idle": 1.0, "max_wait": 5})
+        # 运行模式："polling"（默认，长轮询） 或 "webhook"（由 Telegram 主动推送更新）
+        self.run_mode = startup_config.get("mode", "polling")
+        self.webhook_cfg = startup_config.get("webhook", {})
+        # 未配置公网地址时 PTB 会向 Telegram 登记 http://listen:port，setWebhook 必然失败
+        if self.run_mode == "webhook" and not self.webhook_cfg.get("url"):
+            raise ConfigError(f"{self.config_path}: webhook 模式需要配置 webhook.url（Telegram 推送更新的公网 HTTPS 地址）")
+        # 同时处理的更新数上限（不同用户并发处理，同一用户仍按顺序处理）
+        self.concurrent_updates = startup_config.get("concurrent_updates", 32)
+        # 本地 SQLite 数据库路径（持久化发送队列等）与转发工作协程数量
+        self.db_path = self.path(startup_config.get("db_path", "imneko.db"))
+        self.outbox_workers = startup_config.get("outbox_workers", 4)
+        self.welcome_img_path = self.path(WELCOME_IMG_PATH)
+        self.reply_img_path = self.path(REPLY_IMG_PATH)
+        self._mark(timer, "config")
+
+        blacklist_path = self.path(BLACKLIST_PATH)
+        self.storage = create_storage(startup_config, self.config_path, blacklist_path, load_json(blacklist_path), self.db_path)
+        self.config = ConfigSnapshot.build(self.storage.settings(), strict=False)
+        self._mark(timer, "storage")
+
+        outbound_limit = startup_config.get("outbound_limit", {})
+        self.outbound_limiter = OutboundLimiter(
+            global_rate=outbound_limit.get("global_rate", 30),
+            global_burst=outbound_limit.get("global_burst", 30),
+            chat_rate=outbound_limit.get("chat_rate", 1),
+            chat_burst=outbound_limit.get("chat_burst", 3)
+        )
+        error_notify = startup_config.get("error_notify", {})
+        self.error_notifier = ErrorNotifier(
+            delay=error_notify.get("delay", 5),
+            max_delay=error_notify.get("max_delay", 300),
+            max_entries=error_notify.get("max_entries", 50),
+            overflow_path=self.path(error_notify.get("overflow_log", "error_overflow.log"))
+        )
+        # 多个工作进程服务同一个机器人时启用共享状态（默认与机器人共用数据库文件）
+        shared_cfg = startup_config.get("shared_state")
+        self.shared = None
+        if isinstance(shared_cfg, dict):
+            shared_path = self.path(shared_cfg["path"]) if "path" in shared_cfg else self.db_path
+            self.shared = create_shared_state(shared_cfg, shared_path)
+            if startup_config.get("storage", "json") != "sqlite":
+                logging.warning(f"{self.config_path}: 启用 shared_state 时应使用 \"storage\": \"sqlite\"，否则禁言名单与配置不会在进程之间同步")
+            if self.run_mode == "webhook" and not self.webhook_cfg.get("secret_token"):
+                logging.warning(f"{self.config_path}: 多个进程共用 webhook 时需要配置固定的 secret_token，否则后启动的进程会使其他进程的校验失败")
+        # 用于记录用户投稿的时间戳，用于频率限制
+        if self.shared:
+            self.post_limiter = SharedWindowLimiter(self.shared, window=3600)
+        else:
+            self.post_limiter = SlidingWindowLimiter(window=3600)
+        self.profiles = ProfileCache()
+
+        self.outbox = Outbox(self.db_path)
+        self.message_index = MessageIndex(self.db_path, capacity=startup_config.get("message_index_cache", 10000))
+        self.duplicates = DuplicateDetector(
+            window=self.config.dedup["window_hours"] * 3600,
+            capacity=self.config.dedup["capacity"],
+            path=self.db_path if self.config.dedup["persist"] else None,
+            preload=False  # 指纹在 warm_up() 中载入
+        )
+        self.checkpoint = Checkpoint(self.db_path)
+        self._mark(timer, "database")
+
+        # 收集中的媒体组：{group_id: MediaGroup}
+        self.media_groups = MediaGroupBuffer(
+            max_groups=self.media_group_cfg.get("max_groups", 1000),
+            max_items=self.media_group_cfg.get("max_items", 5000)
+        )
+        self.flushed_groups = {}  # 最近已转发的媒体组：{group_id: 转发时间}，用于发现迟到被拆分的媒体组
+        # 已转发 / 满 10 条立即转发 / 迟到被拆分 / 超出缓存上限提前转发
+        self.media_group_stats = {"flushed": 0, "full": 0, "late": 0, "overflow": 0}
+        self.pending_action = {"type": None, "user_id": None}  # 管理员等待中的操作（如 "welcome_image"）及触发者
+        self.application = None  # register_handlers() 中绑定
+
+    # 管理员等待中的操作：{"type": 操作类型或 None, "user_id": 触发者}，共享模式下所有进程可见
+    def get_pending_action(self):
+        if self.shared is None:
+            return self.pending_action
+        return self.shared.get("pending_action") or {"type": None, "user_id": None}
+
+    # 设置（或以默认参数清除）管理员等待中的操作
+    def set_pending_action(self, action_type=None, user_id=None):
+        if self.shared is None:
+            self.pending_action.update(type=action_type, user_id=user_id)
+        elif action_type is None:
+            self.shared.delete("pending_action")
+        else:
+            self.shared.set("pending_action", {"type": action_type, "user_id": user_id}, ttl=PENDING_ACTION_TTL)
+
+    # 机器人目录下的文件路径
+    def path(self, name):
+        return os.path.join(self.base_dir, name)
+
+    @staticmethod
+    def _mark(timer, phase):
+        if timer is not None:
+            timer.mark(phase)
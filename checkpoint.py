@@ -0,0 +1,70 @@
+# ✅ checkpoint.py
+# --- 重启检查点 ---
+# 停止时把只存在于内存中的状态（收集中的媒体组、投稿限制计数、管理员等待中的操作）
+# 压缩写入数据库，下次启动时读出并恢复；检查点只恢复一次，读出后即删除。
+# 另有一张小表保存跨重启的启动信息（如已发布命令菜单的哈希），启动时据此跳过不必要的请求。
+
+import json
+import logging
+import time
+import zlib
+
+from outbox import open_database
+
+
+class Checkpoint:
+    """
+    单行检查点存储：
+    - save(): 保存状态字典（JSON + zlib 压缩），覆盖上一次的检查点
+    - take(): 读出并删除检查点，返回 (保存时间, 状态) 或 None
+    - get_meta() / set_meta(): 读写启动信息（长期保留）
+    """
+
+    def __init__(self, path):
+        self.conn = open_database(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS checkpoint (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                saved_at REAL NOT NULL,
+                data BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS startup_meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            ) WITHOUT ROWID;
+        """)
+
+    # 保存检查点，返回压缩后的字节数
+    def save(self, state):
+        data = zlib.compress(json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        self.conn.execute(
+            "INSERT OR REPLACE INTO checkpoint (id, saved_at, data) VALUES (1, ?, ?)",
+            (time.time(), data)
+        )
+        return len(data)
+
+    def take(self):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            row = self.conn.execute("SELECT saved_at, data FROM checkpoint WHERE id = 1").fetchone()
+            self.conn.execute("DELETE FROM checkpoint")
+        if row is None:
+            return None
+        try:
+            return row["saved_at"], json.loads(zlib.decompress(row["data"]).decode("utf-8"))
+        except (zlib.error, ValueError) as e:
+            logging.error(f"检查点已损坏，忽略: {e}")
+            return None
+
+    def get_meta(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM startup_meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def set_meta(self, key, value):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO startup_meta (key, value) VALUES (?, ?)",
+            (key, json.dumps(value, ensure_ascii=False))
+        )
+
+    def close(self):
+        self.conn.close()
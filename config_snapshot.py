@@ -0,0 +1,153 @@
+# ✅ config_snapshot.py
+# --- 不可变配置快照 ---
+# 管理员可修改的配置（欢迎语、自动回复、按钮、投稿限制、重复投稿检测）在加载时统一校验，生成只读快照；
+# 欢迎按钮键盘等派生内容随快照一起预先生成。修改配置时生成新快照并整体替换引用，
+# 处理函数读到的始终是一份完整、一致的配置。
+
+import logging
+from collections import namedtuple
+from types import MappingProxyType
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.constants import ParseMode
+
+# 各配置项默认值
+DEFAULTS = {
+    "welcome_message": "欢迎加入频道！",
+    "auto_reply": "🎉投递成功，感谢投稿！管理员会尽快进行审核。",
+    "welcome_buttons": [],
+    "button_layout": {"row": 2, "col": 2},
+    "post_limit": {"enabled": False, "count": 30},
+    "dedup": {"enabled": True, "window_hours": 72, "capacity": 50000, "persist": True},
+}
+
+# 投稿限制：是否启用、每小时总次数、分类别次数（只读字典）
+PostLimit = namedtuple("PostLimit", ("enabled", "count", "types"))
+
+
+class ConfigError(ValueError):
+    pass
+
+
+def _require(condition, message):
+    if not condition:
+        raise ValueError(message)
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _validate_text(value):
+    _require(isinstance(value, str) and value.strip(), "必须是非空文字")
+    return value
+
+
+def _validate_buttons(value):
+    _require(isinstance(value, list), "必须是按钮列表")
+    buttons = []
+    for btn in value:
+        _require(isinstance(btn, dict) and isinstance(btn.get("text"), str) and isinstance(btn.get("url"), str), "每个按钮需要 text 和 url")
+        buttons.append((btn["text"], btn["url"]))
+    return tuple(buttons)
+
+
+def _validate_layout(value):
+    _require(isinstance(value, dict) and _is_int(value.get("row")) and _is_int(value.get("col")), "需要整数 row 和 col")
+    _require(value["row"] >= 0 and value["col"] >= 0, "row 和 col 不能为负数")
+    return value["row"], value["col"]
+
+
+def _validate_post_limit(value):
+    _require(isinstance(value, dict) and _is_int(value.get("count", 30)), "需要整数 count")
+    types = value.get("types", {})
+    _require(isinstance(types, dict) and all(_is_int(v) and v > 0 for v in types.values()), "types 的次数必须是正整数")
+    return PostLimit(bool(value.get("enabled", False)), value.get("count", 30), MappingProxyType(dict(types)))
+
+
+def _validate_dedup(value):
+    _require(isinstance(value, dict), "必须是对象")
+    merged = dict(DEFAULTS["dedup"], **value)
+    _require(_is_int(merged["capacity"]) and merged["capacity"] > 0, "capacity 必须是正整数")
+    _require(isinstance(merged["window_hours"], (int, float)) and merged["window_hours"] > 0, "window_hours 必须是正数")
+    return MappingProxyType(merged)
+
+
+VALIDATORS = {
+    "welcome_message": _validate_text,
+    "auto_reply": _validate_text,
+    "welcome_buttons": _validate_buttons,
+    "button_layout": _validate_layout,
+    "post_limit": _validate_post_limit,
+    "dedup": _validate_dedup,
+}
+
+
+# 构建带按钮的 InlineKeyboard
+def build_inline_keyboard(buttons, row_size=2):
+    keyboard = []
+    for i in range(0, len(buttons), row_size):
+        row = [InlineKeyboardButton(text=text, url=url) for text, url in buttons[i:i + row_size]]
+        keyboard.append(row)
+    return InlineKeyboardMarkup(keyboard)
+
+
+class ConfigSnapshot:
+    """
+    只读配置快照：
+    - build(): 校验配置并生成快照；strict=False 时无效的配置项改用默认值（启动时使用）
+    - replace(): 在当前快照基础上修改若干项，生成版本号 +1 的新快照
+    - setting(): 取某一项的可保存（JSON）形式
+    - markup / reply_kwargs: 预先生成的按钮键盘与发送参数
+    """
+
+    __slots__ = ("version", "welcome_message", "auto_reply", "welcome_buttons", "button_layout",
+                 "post_limit", "dedup", "markup", "reply_kwargs")
+
+    def __init__(self, values, version=1):
+        set_attr = object.__setattr__
+        set_attr(self, "version", version)
+        for key, value in values.items():
+            set_attr(self, key, value)
+        markup = build_inline_keyboard(self.welcome_buttons, row_size=max(1, self.button_layout[1]))
+        set_attr(self, "markup", markup)
+        set_attr(self, "reply_kwargs", MappingProxyType({"parse_mode": ParseMode.HTML, "reply_markup": markup}))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("配置快照为只读，请通过 replace() 生成新快照")
+
+    @classmethod
+    def build(cls, settings, version=1, strict=True):
+        values, errors = {}, []
+        for key, validate in VALIDATORS.items():
+            try:
+                values[key] = validate(settings.get(key, DEFAULTS[key]))
+            except (TypeError, ValueError) as e:
+                if strict:
+                    errors.append(f"{key}: {e}")
+                else:
+                    logging.error(f"配置项 {key} 无效（{e}），使用默认值")
+                    values[key] = validate(DEFAULTS[key])
+        if errors:
+            raise ConfigError("；".join(errors))
+        return cls(values, version)
+
+    def setting(self, key):
+        if key == "welcome_buttons":
+            return [{"text": text, "url": url} for text, url in self.welcome_buttons]
+        if key == "button_layout":
+            return {"row": self.button_layout[0], "col": self.button_layout[1]}
+        if key == "post_limit":
+            value = {"enabled": self.post_limit.enabled, "count": self.post_limit.count}
+            if self.post_limit.types:
+                value["types"] = dict(self.post_limit.types)
+            return value
+        if key == "dedup":
+            return dict(self.dedup)
+        return getattr(self, key)
+
+    def settings(self):
+        return {key: self.setting(key) for key in VALIDATORS}
+
+    def replace(self, **changes):
+        return ConfigSnapshot.build(dict(self.settings(), **changes), self.version + 1)
@@ -0,0 +1,174 @@
+# ✅ dedup.py
+# --- 重复投稿检测 ---
+# 图片 / 视频 / 文件按 file_unique_id、文字按规范化后的内容计算指纹，
+# 在时间窗口内再次出现的相同指纹视为重复投稿，不再转发给管理员。
+
+import hashlib
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+from outbox import open_database
+
+DEFAULT_WINDOW = 72 * 3600  # 默认去重时间窗口（秒）
+DEFAULT_CAPACITY = 50000  # 默认最多记录的指纹数量
+
+
+# 文字规范化：全角半角统一、忽略大小写、合并空白，避免仅因格式差异漏判
+def normalize_text(text):
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def _digest(value):
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=16).hexdigest()
+
+
+# 计算单条消息的指纹，无法识别内容时返回 None（不参与去重）
+def message_fingerprint(message):
+    if message.text:
+        text = normalize_text(message.text)
+        return _digest(f"t:{text}") if text else None
+    attachment = message.effective_attachment
+    if isinstance(attachment, (list, tuple)):
+        # 图片有多个尺寸，取最大尺寸
+        attachment = attachment[-1] if attachment else None
+    return file_fingerprint(getattr(attachment, "file_unique_id", None))
+
+
+# 按 file_unique_id 计算媒体的指纹（与 message_fingerprint() 对同一文件的结果相同）
+def file_fingerprint(unique_id):
+    return _digest(f"f:{unique_id}") if unique_id else None
+
+
+# 计算媒体组的指纹：组内所有媒体 file_unique_id 排序后合并
+def group_fingerprint(unique_ids):
+    unique_ids = [uid for uid in unique_ids if uid]
+    if not unique_ids:
+        return None
+    return _digest("g:" + ",".join(sorted(unique_ids)))
+
+
+class DuplicateDetector:
+    """
+    有时间窗口、有容量上限的去重表：
+    - 内存层为 OrderedDict（按最近出现排序），超出容量时淘汰最久未出现的指纹
+    - 超出时间窗口的指纹视为新内容
+    - 传入 path 时同时写入 SQLite，重启后恢复窗口内的指纹
+      （preload=False 时推迟到调用 load()，加载前 seen() 逐条查询数据库）
+    - seen() 只查询；is_duplicate() 查询并累计重复次数
+    - add() 在投稿成功入队后记录；forget() 在转发最终失败时撤销
+    - configure() 在配置热更新时修改时间窗口与容量（是否写入 SQLite 需要重启后生效）
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, capacity=DEFAULT_CAPACITY, path=None, preload=True):
+        self.window = window
+        self.capacity = capacity
+        self._seen = OrderedDict()  # {指纹: [首次出现时间, 重复次数]}
+        self.hits = 0  # 判定为重复的次数
+        self.misses = 0  # 判定为新内容的次数
+        self.conn = None
+        self.loaded = True  # 数据库中的指纹是否已全部载入内存
+        if path:
+            self.conn = open_database(path)
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS dedup (
+                    fingerprint TEXT PRIMARY KEY,
+                    first_seen REAL NOT NULL,
+                    duplicates INTEGER NOT NULL DEFAULT 0
+                ) WITHOUT ROWID;
+                CREATE INDEX IF NOT EXISTS idx_dedup_first_seen ON dedup(first_seen);
+            """)
+            self.loaded = False
+            if preload:
+                self.load()
+
+    # 从数据库恢复时间窗口内最近的指纹（加载前已记录的新指纹保持在最近一端），返回载入数量
+    def load(self):
+        if self.loaded:
+            return 0
+        rows = self.conn.execute(
+            "SELECT fingerprint, first_seen, duplicates FROM dedup WHERE first_seen >= ? ORDER BY first_seen DESC LIMIT ?",
+            (time.time() - self.window, self.capacity)
+        ).fetchall()
+        merged = OrderedDict((fingerprint, [first_seen, duplicates]) for fingerprint, first_seen, duplicates in reversed(rows))
+        for fingerprint, entry in self._seen.items():
+            merged.pop(fingerprint, None)
+            merged[fingerprint] = entry
+        while len(merged) > self.capacity:
+            merged.popitem(last=False)
+        self._seen = merged
+        self.loaded = True
+        return len(rows)
+
+    # 修改时间窗口与容量，容量缩小时立即淘汰最久未出现的指纹
+    def configure(self, window, capacity):
+        self.window = window
+        self.capacity = capacity
+        while len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+
+    # 指纹是否在时间窗口内出现过（只查询，不计数）
+    def seen(self, fingerprint):
+        if not fingerprint:
+            return False
+        entry = self._seen.get(fingerprint)
+        if entry is None and not self.loaded:
+            row = self.conn.execute("SELECT first_seen, duplicates FROM dedup WHERE fingerprint = ?", (fingerprint,)).fetchone()
+            if row is not None:
+                entry = self._seen[fingerprint] = [row[0], row[1]]
+        return entry is not None and time.time() - entry[0] <= self.window
+
+    # 判断是否为重复投稿；重复时累加该指纹的重复次数
+    def is_duplicate(self, fingerprint):
+        if fingerprint is None:
+            return False
+        if not self.seen(fingerprint):
+            self.misses += 1
+            return False
+        entry = self._seen[fingerprint]
+        entry[1] += 1
+        self._seen.move_to_end(fingerprint)
+        self.hits += 1
+        if self.conn:
+            self.conn.execute("UPDATE dedup SET duplicates = ? WHERE fingerprint = ?", (entry[1], fingerprint))
+        return True
+
+    # 记录新指纹
+    def add(self, fingerprint):
+        if fingerprint is None:
+            return
+        now = time.time()
+        self._seen[fingerprint] = [now, 0]
+        self._seen.move_to_end(fingerprint)
+        while len(self._seen) > self.capacity:
+            self._seen.popitem(last=False)
+        if self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dedup (fingerprint, first_seen, duplicates) VALUES (?, ?, 0)",
+                (fingerprint, now)
+            )
+
+    # 撤销记录（投稿最终没有送达时调用，允许用户重新投稿）
+    def forget(self, fingerprint):
+        if fingerprint is None:
+            return
+        self._seen.pop(fingerprint, None)
+        if self.conn:
+            self.conn.execute("DELETE FROM dedup WHERE fingerprint = ?", (fingerprint,))
+
+    # 清理数据库中超出时间窗口的指纹
+    def purge(self):
+        if self.conn:
+            return self.conn.execute("DELETE FROM dedup WHERE first_seen < ?", (time.time() - self.window,)).rowcount
+        return 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "tracked": len(self._seen),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -5,10 +5,17 @@ import os  # 用于文件路径和文件是否存在判断
 import time  # 用于时间戳获取和比较
 from datetime import datetime  # 用于处理禁言时间显示
 from pathlib import Path  # 目前未用上，可用于文件路径处理
-from collections import defaultdict  # 用于记录用户投稿时间统计
 from functools import partial  # 用于向 job_queue 调度传参
+# ✅ 启动耗时分阶段记录（导入 / 读取配置 / 打开数据库 / post_init / 开始接收更新 / 预热），在日志与 /stats 中显示
+from metrics import PhaseTimer
+STARTUP = PhaseTimer()
 from telegram import BotCommand, BotCommandScopeChat, BotCommandScopeDefault  # 在主函数中设置管理员专属命令菜单，清除默认全员菜单
+import hashlib  # 用于计算命令菜单哈希
 import html  # 用于 HTML 转义
+import re  # 用于从文本中解析用户 ID
+import secrets  # 用于生成 webhook 校验密钥
+import asyncio  # 多机器人模式下在同一事件循环中运行所有机器人
+import sqlite3  # 用于本地持久化发送队列
 # 导入 Telegram 相关功能模块
 from telegram import (
     Update,
@@ -19,9 +26,11 @@ from telegram import (
     InlineKeyboardButton
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest
 from telegram.ext import (
     Application,
     CommandHandler,
+    CallbackQueryHandler,
     MessageHandler,
     filters,
     ContextTypes
@@ -30,56 +39,56 @@ from telegram.ext import (
 # 机器人版本号
 BOT_VER ="v1.1.2"
 
-# 定义配置文件路径
-CONFIG_PATH = "config.json"
-BLACKLIST_PATH = "blacklist.json"
-WELCOME_IMG_PATH = "welcome.jpg"  # 欢迎图默认路径
-REPLY_IMG_PATH = "reply_banner.jpg"  # 自动回复图像储存路径
+# ✅ 从 bot_state.py 导入单个机器人的运行状态（配置、存储后端、限流器、媒体组缓存、错误通知聚合器等）
+# 处理函数通过 get_state(context) 取得当前机器人的状态，同一进程可以运行多个机器人
+from bot_state import BotState, CONFIG_PATH, load_json
 
-# 定义缓存变量
-MEDIA_GROUP_CACHE = {}  # 用于收集媒体组的所有消息
-POST_COUNTER = defaultdict(list)  # 用于记录用户投稿的时间戳，用于频率限制
+# ✅ 从 media_group_buffer.py 导入收集中媒体组的紧凑记录（只保存转发所需的字段，缓存有上限）
+from media_group_buffer import MediaItem, MediaGroup
 
-# 通用 JSON 文件读取函数
-# 如果读取失败（比如文件不存在），就返回默认值
-def load_json(path, default={}):
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return default
-
-# 通用 JSON 文件写入函数
-def save_json(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-# 读取配置和黑名单
-config = load_json(CONFIG_PATH)
-blacklist = load_json(BLACKLIST_PATH)
-
-# 从 config 中获取必要信息
-TOKEN = config.get("token")
-ADMIN_ID = config.get("admin_id")
-AUTO_REPLY = config.get("auto_reply", "感谢你的投稿，我们已收到！")
-WELCOME_MSG = config.get("welcome_message", "欢迎使用投稿机器人！")
-WELCOME_BTNS = config.get("welcome_buttons", [])
-POST_LIMIT_CFG = config.get("post_limit", {"enabled": False, "count": 30})
-BUTTON_LAYOUT = config.get("button_layout", {"row": 2, "col": 2})
+MEDIA_GROUP_MAX_ITEMS = 10  # Telegram 单个媒体组最多 10 条
+# 共享模式（config.json 中配置 shared_state）下媒体组收集在共享状态中，由取得租约的进程转发
+MEDIA_GROUP_SHARED_TTL = 3600  # 共享状态中收集中的媒体组最长保留时间（秒）
+MEDIA_GROUP_LEASE_SECONDS = 30  # 取出媒体组时持有的租约时长（秒）
+MEDIA_GROUP_SWEEP_INTERVAL = 5  # 检查已超时但无人转发的媒体组（如收集它的进程已退出）的间隔（秒）
+
+# ✅ 从 metrics.py 导入运行指标（处理耗时、发送耗时、重试次数等），由状态服务 /metrics 与 /stats 指令输出
+from metrics import METRICS, HANDLER_LATENCY, timed_handler
+MEDIA_GROUP_SIZE = METRICS.histogram("media_group_items", "Items per forwarded media group", buckets=range(1, MEDIA_GROUP_MAX_ITEMS + 1))
+MEDIA_GROUP_WAIT = METRICS.histogram("media_group_wait_seconds", "Time from first album item to forwarding", buckets=(0.5, 1, 1.5, 2, 3, 5, 10))
+
+DUPLICATE_REPLY = "⚠️ 该内容已经投稿过了，请勿重复投稿。"
+# 本地状态服务（健康检查），默认关闭；多机器人模式下所有机器人共用一个，在顶层 config.json 中配置
+STATUS_SERVER_CFG = {"enabled": False, "listen": "127.0.0.1", "port": 8080}
+# 多机器人模式下共用的 HTTP 连接池大小（Bot API 请求），默认按机器人数量计算
+HTTP_POOL_SIZE = None
+
+# 运行中的机器人：{bot token: BotState}（register_handlers() 中登记，用于健康检查与指标汇总）
+BOTS = {}
+
+# ✅ 存储后端（storage.py）：禁言名单与可修改配置（欢迎语、按钮、投稿限制等）统一经过 state.storage 读写
+# "storage": "json"（默认，config.json / blacklist.json） 或 "sqlite"（首次启动时自动从 JSON 文件迁移）
+# ✅ 从 config_snapshot.py 导入不可变配置快照：欢迎语、自动回复、按钮、投稿限制、重复投稿检测
+# 处理函数只读取 state.config 这一个引用；管理员指令或手动编辑配置文件后生成新快照整体替换
+from config_snapshot import ConfigSnapshot, ConfigError
+CONFIG_WATCH_INTERVAL = 5  # 检查配置文件是否被修改的间隔（秒）
 
 # ✅ 从 safe_send.py 模块导入 safe_send 函数
 from safe_send import safe_send
 # ✅ 从 safe_send.py 模块导入 safe_send_image 函数
 from safe_send import safe_send_image
-# ✅ 向 safe_send.py 传递 ADMIN_ID
-from safe_send import set_admin_id
-set_admin_id(config.get("admin_id"))
+# ✅ 图片变更时清除 safe_send.py 中缓存的 file_id
+from safe_send import invalidate_file_id
+# ✅ 向 safe_send.py 登记每个机器人的管理员 ID、出站限流器（全局 + 每个聊天令牌桶）和错误通知聚合器
+from safe_send import register_bot
+# ✅ safe_send.py 中记录的发送耗时、重试与失败次数（/stats 指令显示）
+from safe_send import SEND_LATENCY, SEND_RETRIES, SEND_FAILURES
 
 
 # 格式化剩余时间为“xx秒/分钟/小时/天”的形式
 def format_time_left(until_timestamp):
     # 如果是永久禁言，直接返回文字
-    if until_timestamp == float('inf'):
+    if until_timestamp is None or until_timestamp == float('inf'):
         return "永久"
     seconds = int(until_timestamp - time.time())
     if seconds <= 0:
@@ -95,67 +104,139 @@ def format_time_left(until_timestamp):
     return " ".join(parts)
 
 
-# 构建带按钮的 InlineKeyboard
-def build_inline_keyboard(buttons, row_size=2):
-    keyboard = []
-    for i in range(0, len(buttons), row_size):
-        row = [InlineKeyboardButton(text=btn['text'], url=btn['url']) for btn in buttons[i:i+row_size]]
-        keyboard.append(row)
-    return InlineKeyboardMarkup(keyboard)
+# 取得当前机器人的运行状态（处理函数与定时任务通用）
+def get_state(context: ContextTypes.DEFAULT_TYPE) -> BotState:
+    return context.bot_data["state"]
+
+
+# 修改配置：校验并生成新快照，保存后整体替换 state.config（校验失败抛出 ConfigError，配置保持不变）
+def update_config(state, **changes):
+    snapshot = state.config.replace(**changes)
+    for key in changes:
+        state.storage.set_setting(key, snapshot.setting(key))
+    state.config = snapshot
+    return snapshot
+
+
+# 定时任务：配置文件（或 SQLite 配置表）被手动修改后重新加载，无需重启
+# 新配置无效时记录错误并继续使用当前快照；token、admin_id 等启动参数仍需重启生效
+async def reload_config(context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
+    settings = state.storage.reload_settings()
+    if settings is None:
+        return
+    if str(settings.get("admin_id", state.admin_id)) != str(state.admin_id) or settings.get("token", state.token) != state.token:
+        logging.warning(f"{state.config_path}: 检测到 token / admin_id 变更，需要重启后生效")
+    try:
+        snapshot = ConfigSnapshot.build(settings, state.config.version + 1)
+    except ConfigError as e:
+        logging.error(f"{state.config_path} 无效，继续使用当前配置: {e}")
+        return
+    state.storage.accept_settings(settings)
+    if snapshot.dedup["persist"] != state.config.dedup["persist"]:
+        logging.warning(f"{state.config_path}: 检测到 dedup.persist 变更，需要重启后生效")
+    if snapshot.settings() != state.config.settings():
+        state.config = snapshot
+        state.duplicates.configure(snapshot.dedup["window_hours"] * 3600, snapshot.dedup["capacity"])
+        logging.info(f"{state.config_path} 已重新加载（版本 {snapshot.version}）")
+
+
+BAN_PURGE_INTERVAL = 60  # 过期禁言清理任务的执行间隔（秒）
+
 
+# 定时任务：批量移除已过期的禁言（JSON 后端一轮只保存一次，SQLite 后端按 until 索引删除）
+async def purge_expired_bans(context: ContextTypes.DEFAULT_TYPE):
+    removed = get_state(context).storage.pop_expired_bans(time.time())
+    if removed:
+        logging.info(f"已自动解除 {len(removed)} 个过期禁言")
 
-# 检查用户是否被禁言，如果禁言已过期则自动清除记录
-def is_user_banned(user_id):
-    info = blacklist.get(str(user_id))  # 确保 user_id 是字符串
+
+# 查询用户当前生效的禁言记录，未被禁言返回 None（过期记录由 purge_expired_bans 统一清理）
+def get_active_ban(state, user_id):
+    info = state.storage.get_ban(user_id)
     if not info:
-        return False, 0  # 没有记录，未被禁言
+        return None  # 没有记录，未被禁言
     until = info.get("until", 0)
-    # 如果禁言已过期（且不是永久禁言），自动解除并保存
-    if until != float('inf') and until < time.time():
-        blacklist.pop(str(user_id))
-        save_json(BLACKLIST_PATH, blacklist)
-        return False, 0
-    return True, until
+    # 已过期但尚未被清理的禁言，直接视为未禁言
+    if until is not None and until < time.time():
+        return None
+    return info
+
 
+# ✅ 投稿频率限制使用 rate_limit.py 中的滑动窗口限流器（state.post_limiter，每用户 deque，均摊 O(1)，定期清理空闲用户）
+LIMIT_EVICT_INTERVAL = 600  # 清理空闲用户计数的间隔（秒）
 
-# 检查用户是否超过投稿限制
-def check_post_limit(user_id):
-    if not POST_LIMIT_CFG.get("enabled"):
+# 可单独限制的投稿类别：文字 / 单条媒体（图片、视频、文件等） / 媒体组
+POST_KINDS = {"text": "文字", "media": "媒体", "media_group": "媒体组"}
+
+
+# 判断投稿类别
+def get_post_kind(message):
+    if message.media_group_id:
+        return "media_group"
+    if message.text:
+        return "text"
+    return "media"
+
+
+# 检查用户是否超过投稿限制（总次数 + 可选的分类别次数）
+def check_post_limit(state, user_id, kind):
+    post_limit = state.config.post_limit
+    if not post_limit.enabled:
         return True, None
-    now = time.time()
-    POST_COUNTER[user_id] = [t for t in POST_COUNTER[user_id] if now - t < 3600]
-    if len(POST_COUNTER[user_id]) >= POST_LIMIT_CFG["count"]:
-        return False, POST_LIMIT_CFG["count"]
-    POST_COUNTER[user_id].append(now)
-    return True, None
+    limits = {"all": post_limit.count}
+    type_limit = post_limit.types.get(kind)
+    if type_limit:
+        limits[kind] = type_limit
+    allowed, _, limit = state.post_limiter.hit(user_id, limits)
+    return allowed, limit
+
+
+# 定时任务：清理窗口内已无投稿记录的用户，防止计数表无限增长
+async def evict_idle_limits(context: ContextTypes.DEFAULT_TYPE):
+    get_state(context).post_limiter.evict_idle()
 
 
 # 判断欢迎图片是否存在
-def has_welcome_image():
-    return os.path.exists(WELCOME_IMG_PATH)
+def has_welcome_image(state):
+    return os.path.exists(state.welcome_img_path)
 
 # 判断自动回复图片是否存在
-def has_reply_image():
-    return os.path.exists(REPLY_IMG_PATH)
+def has_reply_image(state):
+    return os.path.exists(state.reply_img_path)
 
 
 # 用户投稿处理函数
+@timed_handler("handle_post")
 async def handle_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
     user = update.effective_user
     user_id = str(user.id)
     message = update.message
     # 如果是管理员发的投稿，直接忽略
-    if str(user_id) == str(ADMIN_ID):
+    if str(user_id) == str(state.admin_id):
         return
+    # 记录投稿用户资料，之后禁言时无需再查询
+    state.profiles.remember(user_id, user.full_name, user.username)
     # 检查是否禁言
-    banned, until = is_user_banned(user_id)
-    if banned:
-        time_left = format_time_left(until)
-        reason = blacklist.get(user_id, {}).get("reason", "")
+    ban = get_active_ban(state, user_id)
+    if ban:
+        time_left = format_time_left(ban.get("until"))
+        reason = ban.get("reason", "")
         await message.reply_text(f"你已被禁言，剩余时间：{time_left}" + (f"\n原因：{reason}" if reason else ""))
         return
-    # 检查投稿频率限制
-    allowed, limit = check_post_limit(user_id)
+    # 检查重复投稿（媒体组在收集完成后整体检查）
+    fingerprint = None
+    if not message.media_group_id and state.config.dedup["enabled"]:
+        fingerprint = message_fingerprint(message)
+        if state.duplicates.is_duplicate(fingerprint):
+            await message.reply_text(DUPLICATE_REPLY)
+            return
+    # 检查投稿频率限制（媒体组只在收到第一条时计数一次）
+    if message.media_group_id and media_group_collecting(state, message.media_group_id):
+        allowed, limit = True, None
+    else:
+        allowed, limit = check_post_limit(state, user_id, get_post_kind(message))
     if not allowed:
         await message.reply_text(f"你已超过每小时{limit}次投稿限制，请稍后再试。")
         return
@@ -163,237 +244,396 @@ async def handle_post(update: Update, context: ContextTypes.DEFAULT_TYPE):
     caption_info = f"来自: [{user.full_name}](tg://user?id={user.id})  |  ID: `{user.id}`"
     # 如果是媒体组，进行缓存收集和延迟转发
     if message.media_group_id:
-        group_id = message.media_group_id
-        MEDIA_GROUP_CACHE.setdefault(group_id, []).append(message)
-        # 如果是首次收到该媒体组，则安排一个延时任务 2 秒后执行处理
-        if len(MEDIA_GROUP_CACHE[group_id]) == 1:
-            context.job_queue.run_once(
-                partial(process_media_group, group_id=group_id, user=user, caption_info=caption_info),
-                when=2,
-                name=str(group_id)
-            )
+        add_media_group_part(context, message, user, caption_info)
         return
+    # 写入持久化发送队列（由后台工作协程转发给管理员），写入成功后立即回复投稿用户
+    kind, payload = build_forward_payload(message, caption_info)
+    payload.update(user_id=user.id, caption_info=caption_info, fingerprints=[fingerprint] if fingerprint else [])
+    await enqueue_forward(state, context.bot, f"post:{message.chat_id}:{message.message_id}", kind, payload)
+
+
+# 根据投稿类型构造转发任务内容（只保存转发所需的字段，可序列化为 JSON）
+def build_forward_payload(message, caption_info):
+    # 普通文字消息
+    if message.text:
+        return "text", {"text": f"{caption_info}\n\n{message.text}"}
+    full_caption = f"{caption_info}\n\n{message.caption or ''}"
+    # 图片投稿
+    if message.photo:
+        return "photo", {"file_id": message.photo[-1].file_id, "caption": full_caption}
+    # 视频投稿
+    if message.video:
+        return "video", {"file_id": message.video.file_id, "caption": full_caption}
+    # 文档投稿
+    if message.document:
+        return "document", {"file_id": message.document.file_id, "caption": full_caption}
+    # 其他类型：复制消息
+    return "copy", {"from_chat_id": message.chat_id, "message_id": message.message_id}
+
+
+# 写入发送队列并回复投稿用户
+async def enqueue_forward(state, bot, idem_key, kind, payload):
     try:
-        # ✅ 改为保存返回值 result，用于判断发送成功
-        result = None  # 用于保存每种投稿类型的转发结果
-        # 普通文字消息
-        if message.text:
-            full_text = f"{caption_info}\n\n{message.text}"
-            result = await safe_send(
-                context.bot,
-                context.bot.send_message,
-                chat_id=ADMIN_ID,
-                text=full_text,
-                parse_mode=ParseMode.MARKDOWN,
-                user_info=caption_info,
-                user_id=user.id
-            )
-        # 图片投稿
-        elif message.photo:
-            full_caption = f"{caption_info}\n\n{message.caption or ''}"
-            result = await safe_send(
-                context.bot,
-                context.bot.send_photo,
-                chat_id=ADMIN_ID,
-                photo=message.photo[-1].file_id,
-                caption=full_caption,
-                parse_mode=ParseMode.MARKDOWN,
-                user_info=caption_info,
-                user_id=user.id,
-                retries=5,
-                delay=3
-            )
-        # 视频投稿
-        elif message.video:
-            full_caption = f"{caption_info}\n\n{message.caption or ''}"
-            result = await safe_send(
-                context.bot,
-                context.bot.send_video,
-                chat_id=ADMIN_ID,
-                video=message.video.file_id,
-                caption=full_caption,
-                parse_mode=ParseMode.MARKDOWN,
-                user_info=caption_info,
-                user_id=user.id,
-                retries=10,
-                delay=5
-            )
-        # 文档投稿
-        elif message.document:
-            full_caption = f"{caption_info}\n\n{message.caption or ''}"
-            result = await safe_send(
-                context.bot,
-                context.bot.send_document,
-                chat_id=ADMIN_ID,
-                document=message.document.file_id,
-                caption=full_caption,
-                parse_mode=ParseMode.MARKDOWN,
-                user_info=caption_info,
-                user_id=user.id,
-                retries=5,
-                delay=3
-            )
-        # 其他类型：复制消息
-        else:
-            result = await safe_send(
-                context.bot,
-                context.bot.copy_message,
-                chat_id=ADMIN_ID,
-                from_chat_id=message.chat_id,
-                message_id=message.message_id,
-                user_info=caption_info,
-                user_id=user.id
-            )
-        # ✅ 仅当 result 为真时，发送“投稿成功”自动回复（图文 or 文本）
-        if result:
-            if has_reply_image():
-                # ✅ 使用 safe_send_image() 安全发送图片，避免因网络重试文件句柄失效
-                await safe_send_image(
-                    bot=context.bot,
-                    chat_id=user.id,
-                    file_path=REPLY_IMG_PATH,
-                    caption=config.get("auto_reply", "🎉投递成功，感谢投稿！管理员会尽快进行审核。"),
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=build_inline_keyboard(WELCOME_BTNS, row_size=BUTTON_LAYOUT["col"]),
-                    user_info=caption_info,
-                    user_id=user.id
-                )
-            else:
-                # ✅ 无图片时仍使用 safe_send 发送纯文本
-                await safe_send(
-                    context.bot,
-                    context.bot.send_message,
-                    chat_id=user.id,
-                    text=config.get("auto_reply", "🎉投递成功，感谢投稿！管理员会尽快进行审核。"),
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=build_inline_keyboard(WELCOME_BTNS, row_size=BUTTON_LAYOUT["col"]),
-                    user_info=caption_info,
-                    user_id=user.id
-                )
-        else:
-            # ❌ 如果 result 为 None，说明转发失败，告知投稿用户
-            await safe_send(
-                context.bot,
-                context.bot.send_message,
-                chat_id=user.id,
-                text="❌ 很抱歉，您的投稿发送失败了，请稍后再试。",
-                parse_mode=ParseMode.HTML,
-                reply_markup=build_inline_keyboard(WELCOME_BTNS, row_size=BUTTON_LAYOUT["col"]),
-                user_info=caption_info,
-                user_id=user.id
-            )
-    except Exception as e:
-        logging.error(f"转发失败（异常）: {e}")
+        queued = state.outbox.enqueue(idem_key, kind, payload)
+    except sqlite3.Error as e:
+        logging.error(f"投稿写入发送队列失败: {e}")
+        await send_failure_notice(state, bot, payload["user_id"], payload["caption_info"])
+        return
+    if not queued:
+        # 同一条投稿已经入队（如重启后 Telegram 重新推送了同一更新），不重复处理
+        logging.info(f"投稿 {idem_key} 已在发送队列中，忽略重复更新")
+        return
+    # 入队成功后记录内容指纹，之后相同内容判定为重复投稿
+    for fingerprint in payload.get("fingerprints", []):
+        state.duplicates.add(fingerprint)
+    await send_auto_reply(state, bot, payload["user_id"], payload["caption_info"])
 
 
-# 延迟处理媒体组投稿（在所有组内消息收集完后统一转发）
-async def process_media_group(context: ContextTypes.DEFAULT_TYPE, group_id, user, caption_info):
-    messages = MEDIA_GROUP_CACHE.pop(group_id, [])  # 取出该组的所有消息
+# 发送“投稿成功”自动回复（图文 or 文本）
+async def send_auto_reply(state, bot, user_id, caption_info):
+    cfg = state.config
+    if has_reply_image(state):
+        # ✅ 使用 safe_send_image() 安全发送图片，复用已上传图片的 file_id
+        await safe_send_image(
+            bot=bot,
+            chat_id=user_id,
+            file_path=state.reply_img_path,
+            caption=cfg.auto_reply,
+            **cfg.reply_kwargs,
+            user_info=caption_info,
+            user_id=user_id
+        )
+    else:
+        # ✅ 无图片时仍使用 safe_send 发送纯文本
+        await safe_send(
+            bot,
+            bot.send_message,
+            chat_id=user_id,
+            text=cfg.auto_reply,
+            **cfg.reply_kwargs,
+            user_info=caption_info,
+            user_id=user_id
+        )
+
+
+# ❌ 转发最终失败，告知投稿用户
+async def send_failure_notice(state, bot, user_id, caption_info):
+    await safe_send(
+        bot,
+        bot.send_message,
+        chat_id=user_id,
+        text="❌ 很抱歉，您的投稿发送失败了，请稍后再试。",
+        **state.config.reply_kwargs,
+        user_info=caption_info,
+        user_id=user_id
+    )
+
+
+# 构造媒体组的 InputMedia 列表（caption 只加在第一条媒体上）
+def build_input_media(items, caption):
+    media_types = {"photo": InputMediaPhoto, "video": InputMediaVideo, "document": InputMediaDocument}
     media = []
+    for i, item in enumerate(items):
+        media.append(media_types[item["type"]](
+            media=item["file_id"],
+            caption=caption if i == 0 else None,
+            parse_mode=ParseMode.MARKDOWN if i == 0 else None
+        ))
+    return media
+
+
+# 发送队列工作协程执行的转发任务
+# 返回 True 表示完成；返回数字表示若干秒后再次重试；返回 False 表示最终失败
+async def deliver_forward(state, bot, job):
+    kind, payload = job["kind"], job["payload"]
+    common = dict(chat_id=state.admin_id, user_info=payload["caption_info"], user_id=payload["user_id"])
+    if kind == "text":
+        result = await safe_send(bot, bot.send_message, text=payload["text"], parse_mode=ParseMode.MARKDOWN, **common)
+    elif kind == "photo":
+        result = await safe_send(bot, bot.send_photo, photo=payload["file_id"], caption=payload["caption"], parse_mode=ParseMode.MARKDOWN, policy="media", **common)
+    elif kind == "video":
+        result = await safe_send(bot, bot.send_video, video=payload["file_id"], caption=payload["caption"], parse_mode=ParseMode.MARKDOWN, policy="large_media", **common)
+    elif kind == "document":
+        result = await safe_send(bot, bot.send_document, document=payload["file_id"], caption=payload["caption"], parse_mode=ParseMode.MARKDOWN, policy="media", **common)
+    elif kind == "media_group":
+        media = build_input_media(payload["items"], payload["caption"])
+        result = await safe_send(bot, bot.send_media_group, media=media, policy="large_media", **common)
+    elif kind == "copy":
+        result = await safe_send(bot, bot.copy_message, from_chat_id=payload["from_chat_id"], message_id=payload["message_id"], **common)
+    else:
+        logging.error(f"未知的转发任务类型: {kind}")
+        return False
+    if result:
+        # 记录管理员聊天中每条转发消息对应的投稿用户，管理员回复时直接按消息 ID 查找
+        message_ids = [m.message_id for m in result] if isinstance(result, (list, tuple)) else [result.message_id]
+        try:
+            state.message_index.record(state.admin_id, message_ids, payload["user_id"])
+        except sqlite3.Error as e:
+            logging.error(f"记录转发消息索引失败: {e}")
+        return True
+    # 本轮重试全部失败：网络故障、限流等可重试的错误按 OUTBOX_RETRY_DELAYS 稍后整体重试，仍失败再通知投稿用户
+    # 终止类错误（用户屏蔽机器人、格式错误等，见 safe_send.classify_error）再发也不会成功，直接判定失败
+    if result.retryable and job["attempts"] <= len(OUTBOX_RETRY_DELAYS):
+        return OUTBOX_RETRY_DELAYS[job["attempts"] - 1]
+    # 投稿没有送达，撤销内容指纹，允许用户重新投稿
+    for fingerprint in payload.get("fingerprints", []):
+        state.duplicates.forget(fingerprint)
+    await send_failure_notice(state, bot, payload["user_id"], payload["caption_info"])
+    return False
+
+
+# 媒体组是否正在收集中（已收到过其他部分）
+def media_group_collecting(state, group_id):
+    if state.shared:
+        return state.shared.get(f"album:{group_id}") is not None
+    return group_id in state.media_groups
+
+
+# 收集中的媒体组数量（共享模式下为所有进程合计）
+def count_media_groups(state):
+    if state.shared:
+        return len(state.shared.keys("album:"))
+    return len(state.media_groups)
+
+
+# 收集媒体组消息，并按“最后一条到达后静默一段时间”重新安排转发任务
+# - 收满 10 条立即转发
+# - 从第一条起最多等待 max_wait 秒，避免持续到达的消息无限推迟转发
+# - 只保存转发所需的字段（MediaItem），超出缓存上限时最早的媒体组提前转发
+def add_media_group_part(context: ContextTypes.DEFAULT_TYPE, message, user, caption_info):
+    state = get_state(context)
+    group_id = message.media_group_id
+    if state.shared:
+        add_shared_media_group_part(context, message, user, caption_info)
+        return
+    now = time.time()
+    evicted = []
+    group = state.media_groups.get(group_id)
+    if group is None:
+        late = group_id in state.flushed_groups
+        if late:
+            # 该媒体组已经转发过，这是迟到的部分，只能作为新的媒体组单独转发
+            state.media_group_stats["late"] += 1
+            logging.warning(f"媒体组 {group_id} 转发后又收到迟到的消息，将拆分为新的媒体组转发")
+        group = MediaGroup(user.id, message.chat_id, caption_info, now, late)
+        evicted += state.media_groups.add_group(group_id, group)
+    evicted += state.media_groups.add_item(group_id, MediaItem.from_message(message))
+    for old_id, old_group in evicted:
+        flush_evicted_media_group(state, context.job_queue, old_id, old_group)
+    # 取消之前安排的转发任务，按最新到达时间重新计时
+    if group.job:
+        group.job.schedule_removal()
+    if len(group.items) >= MEDIA_GROUP_MAX_ITEMS:
+        state.media_group_stats["full"] += 1
+        when = 0
+    else:
+        remaining = group.first_at + state.media_group_cfg.get("max_wait", 5) - now
+        when = max(0, min(state.media_group_cfg.get("idle", 1.0), remaining))
+    schedule_media_group(context.job_queue, group_id, group, when)
+
+
+# 超出缓存上限被提前取出的媒体组：取消原定的转发任务，立即转发
+def flush_evicted_media_group(state, job_queue, group_id, group):
+    state.media_group_stats["overflow"] += 1
+    if group.job:
+        group.job.schedule_removal()
+        group.job = None
+    mark_media_group_flushed(state, group_id)
+    job_queue.run_once(partial(forward_media_group, group=group), when=0, name=f"{group_id}:overflow", job_kwargs=RUN_LATE)
+
+
+# 定时任务错过预定时间后仍然执行（APScheduler 默认错过 1 秒即丢弃）：
+# post_init 中安排的任务要等 job_queue 启动后才运行，中间的 deleteWebhook / setWebhook 等请求可能超过 1 秒
+RUN_LATE = {"misfire_grace_time": None}
+
+
+# 安排 when 秒后转发媒体组，记录预定时间（重启恢复时按剩余时间重新安排）
+def schedule_media_group(job_queue, group_id, group, when):
+    group.due = time.time() + when
+    group.job = job_queue.run_once(
+        partial(process_media_group, group_id=group_id),
+        when=when,
+        name=str(group_id),
+        job_kwargs=RUN_LATE
+    )
+
+
+# 记录媒体组的转发时间，只保留最近一分钟内转发过的媒体组
+def mark_media_group_flushed(state, group_id):
+    now = time.time()
+    flushed_groups = state.flushed_groups
+    flushed_groups[group_id] = now
+    for gid in [gid for gid, t in flushed_groups.items() if now - t > 60]:
+        flushed_groups.pop(gid)
+
+
+# 延迟处理媒体组投稿（在所有组内消息收集完后统一转发）
+@timed_handler("process_media_group")
+async def process_media_group(context: ContextTypes.DEFAULT_TYPE, group_id):
+    state = get_state(context)
+    group = state.media_groups.pop(group_id)  # 取出该组的所有消息
+    if not group:
+        return
+    mark_media_group_flushed(state, group_id)
+    await forward_media_group(context, group)
+
+
+# 共享模式：媒体组的各部分可能由不同进程收到，统一追加到共享状态的 "album:{group_id}" 列表
+# 收到该组消息的进程各自安排检查任务，到期后由取得租约的进程取出整组转发，其他进程取不到则跳过
+def add_shared_media_group_part(context: ContextTypes.DEFAULT_TYPE, message, user, caption_info):
+    state = get_state(context)
+    group_id = message.media_group_id
+    part = {
+        "item": MediaItem.from_message(message).to_dict(),
+        "user_id": user.id,
+        "chat_id": message.chat_id,
+        "caption_info": caption_info,
+        "at": time.time()
+    }
+    count = state.shared.append(f"album:{group_id}", part, ttl=MEDIA_GROUP_SHARED_TTL)
+    if count >= MEDIA_GROUP_MAX_ITEMS:
+        state.media_group_stats["full"] += 1
+        when = 0
+    else:
+        when = state.media_group_cfg.get("idle", 1.0)
+    for job in context.job_queue.get_jobs_by_name(str(group_id)):
+        job.schedule_removal()
+    context.job_queue.run_once(partial(process_shared_media_group, group_id=group_id), when=when, name=str(group_id), job_kwargs=RUN_LATE)
+
+
+# 在租约保护下取出到期的共享媒体组，返回 (MediaGroup, 等待秒数)
+# 未到期时 MediaGroup 为 None 并返回剩余秒数；已被其他进程取走或正被其他进程取出时两者均为 None
+def take_shared_media_group(state, group_id):
+    shared = state.shared
+    key = f"album:{group_id}"
+    if not shared.acquire(key, MEDIA_GROUP_LEASE_SECONDS):
+        return None, None
+    try:
+        parts = shared.get(key)
+        if not parts:
+            return None, None
+        now = time.time()
+        if len(parts) < MEDIA_GROUP_MAX_ITEMS:
+            # 各部分可能来自不同进程，按共享列表中最后一条的到达时间计算静默时间
+            due = min(parts[-1]["at"] + state.media_group_cfg.get("idle", 1.0), parts[0]["at"] + state.media_group_cfg.get("max_wait", 5))
+            if due > now:
+                return None, due - now
+        late = shared.get(f"album_flushed:{group_id}") is not None
+        shared.set(f"album_flushed:{group_id}", now, ttl=60)
+        shared.delete(key)
+    finally:
+        shared.release(key)
+    if late:
+        state.media_group_stats["late"] += 1
+        logging.warning(f"媒体组 {group_id} 转发后又收到迟到的消息，将拆分为新的媒体组转发")
+    first = parts[0]
+    group = MediaGroup(first["user_id"], first["chat_id"], first["caption_info"], first["at"], late)
+    group.items = [MediaItem.from_dict(part["item"]) for part in parts]
+    return group, None
+
+
+# 共享模式的媒体组转发任务：未到期则按剩余时间重新安排
+@timed_handler("process_media_group")
+async def process_shared_media_group(context: ContextTypes.DEFAULT_TYPE, group_id):
+    group, wait = take_shared_media_group(get_state(context), group_id)
+    if wait is not None:
+        context.job_queue.run_once(partial(process_shared_media_group, group_id=group_id), when=wait, name=str(group_id), job_kwargs=RUN_LATE)
+    if group:
+        await forward_media_group(context, group)
+
+
+# 定时任务（共享模式）：转发已超时但没有进程安排转发的媒体组（收集它的进程已退出或重启）
+async def sweep_shared_media_groups(context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
+    for key in state.shared.keys("album:"):
+        group_id = key[len("album:"):]
+        if context.job_queue.get_jobs_by_name(group_id):
+            continue  # 本进程已安排转发任务
+        group, _ = take_shared_media_group(state, group_id)
+        if group:
+            await forward_media_group(context, group)
+
+
+# 转发取出的媒体组：检查重复投稿后写入发送队列（本地模式与共享模式共用）
+async def forward_media_group(context: ContextTypes.DEFAULT_TYPE, group):
+    state = get_state(context)
+    state.media_group_stats["flushed"] += 1
+    MEDIA_GROUP_SIZE.observe(len(group.items))
+    MEDIA_GROUP_WAIT.observe(time.time() - group.first_at)
+    caption_info = group.caption_info
+    if group.late:
+        caption_info += "\n⚠️ 媒体组部分内容迟到，已拆分转发"
+    # 按 message_id 排序，保证转发顺序与用户发送顺序一致
+    items = sorted(group.items, key=lambda item: item.message_id)
     # 获取用户附加的 caption（通常只有一条消息包含）
-    user_caption = ""
-    for m in messages:
-        if m.caption:
-            user_caption = m.caption
-            break
+    user_caption = next((item.caption for item in items if item.caption), "")
     # 拼接完整 caption 信息（第一条媒体用）
     full_caption = f"{caption_info}\n\n{user_caption}".strip()
-    for i, m in enumerate(messages):
-        if m.photo:
-            media.append(InputMediaPhoto(
-                media=m.photo[-1].file_id,
-                caption=full_caption if i == 0 else None,
-                parse_mode=ParseMode.MARKDOWN if i == 0 else None
-            ))
-        elif m.video:
-            media.append(InputMediaVideo(
-                media=m.video.file_id,
-                caption=full_caption if i == 0 else None,
-                parse_mode=ParseMode.MARKDOWN if i == 0 else None
-            ))
-        elif m.document:
-            media.append(InputMediaDocument(
-                media=m.document.file_id,
-                caption=full_caption if i == 0 else None,
-                parse_mode=ParseMode.MARKDOWN if i == 0 else None
-            ))
-    try:
-        # 发送媒体组
-        # ✅ 改为使用 safe_send，并接收 result 判断发送结果
-        result = await safe_send(
-            context.bot,
-            context.bot.send_media_group,
-            chat_id=ADMIN_ID,
-            media=media,
-            user_info=caption_info,
-            user_id=user.id,
-            retries=10,  # 👈 设置重试次数
-            delay=5       # 👈 每次重试间隔
-        )
-        # ✅ 仅当 result 为真时，发送“投稿成功”自动回复（图文 or 文本）
-        if result:
-            if has_reply_image():
-                # ✅ 使用 safe_send_image() 安全发送图片，避免因网络重试文件句柄失效
-                await safe_send_image(
-                    bot=context.bot,
-                    chat_id=user.id,
-                    file_path=REPLY_IMG_PATH,
-                    caption=config.get("auto_reply", "🎉投递成功，感谢投稿！管理员会尽快进行审核。"),
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=build_inline_keyboard(WELCOME_BTNS, row_size=BUTTON_LAYOUT["col"]),
-                    user_info=caption_info,
-                    user_id=user.id
-                )
-            else:
-                # ✅ 无图片时仍使用 safe_send 发送纯文本
-                await safe_send(
-                    context.bot,
-                    context.bot.send_message,
-                    chat_id=user.id,
-                    text=config.get("auto_reply", "🎉投递成功，感谢投稿！管理员会尽快进行审核。"),
-                    parse_mode=ParseMode.HTML,
-                    reply_markup=build_inline_keyboard(WELCOME_BTNS, row_size=BUTTON_LAYOUT["col"]),
-                    user_info=caption_info,
-                    user_id=user.id
-                )
-        else:
-            # ❌ 失败：通知投稿用户失败信息
+    media = [item for item in items if item.kind]
+    if not media:
+        return
+    # 检查重复投稿：整组出现过，或组内每一条都单独投稿过
+    fingerprints = []
+    if state.config.dedup["enabled"]:
+        duplicates = state.duplicates
+        item_fingerprints = [file_fingerprint(item.file_unique_id) for item in items]
+        fingerprints = [group_fingerprint([item.file_unique_id for item in media])] + [fp for fp in item_fingerprints if fp]
+        if duplicates.is_duplicate(fingerprints[0]) or (item_fingerprints and all(duplicates.seen(fp) for fp in item_fingerprints)):
             await safe_send(
                 context.bot,
                 context.bot.send_message,
-                chat_id=user.id,
-                text="❌ 很抱歉，您的投稿发送失败了，请稍后再试。",
-                parse_mode=ParseMode.HTML,
-                reply_markup=build_inline_keyboard(WELCOME_BTNS, row_size=BUTTON_LAYOUT["col"]),
+                chat_id=group.user_id,
+                text=DUPLICATE_REPLY,
                 user_info=caption_info,
-                user_id=user.id
+                user_id=group.user_id
             )
-    except Exception as e:
-        logging.error(f"媒体组发送失败: {e}")
+            return
+    payload = {
+        "items": [{"type": item.kind, "file_id": item.file_id} for item in media],
+        "caption": full_caption,
+        "user_id": group.user_id,
+        "caption_info": caption_info,
+        "fingerprints": fingerprints
+    }
+    await enqueue_forward(state, context.bot, f"album:{group.chat_id}:{items[0].message_id}", "media_group", payload)
+
+
+# 从转发消息的 caption / 文本中解析 "ID: `123`" 形式的投稿用户 ID（兼容索引建立前的旧消息）
+def parse_target_id(reply_to_message):
+    lines = []
+    if reply_to_message.caption:
+        lines = reply_to_message.caption.splitlines()
+    elif reply_to_message.text:
+        lines = reply_to_message.text.splitlines()
+    # 用户信息总在第一行，只检查第一行，避免误读投稿正文中的 "ID:"
+    for line in lines[:1]:
+        if "ID:" in line:
+            try:
+                return line.split("ID:")[-1].strip().strip("`").split()[0]
+            except IndexError:
+                continue
+    return None
 
 
 # 管理员回复投稿者（通过回复投稿消息）
+@timed_handler("handle_admin_reply")
 async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
     message = update.message
     # 配合 safe_send 给 caption_info 赋值管理员信息
     caption_info = f"📮本条消息来自管理员: [{message.from_user.full_name}](tg://user?id={message.from_user.id})  |  ⛔️请勿回复本消息！"
     # 只允许管理员操作，且必须是“回复消息”形式
     if not message.reply_to_message or not message.text:
         return
-    # 提取被回复消息中包含的用户 ID
-    lines = []
-    if message.reply_to_message.caption:
-        lines = message.reply_to_message.caption.splitlines()
-    elif message.reply_to_message.text:
-        lines = message.reply_to_message.text.splitlines()
-    target_id = None
-    for line in lines:
-        if "ID:" in line:
-            try:
-                target_id = line.split("ID:")[-1].strip().strip("`").split()[0]
-                break
-            except:
-                continue
+    # 按被回复消息的 ID 查找投稿用户（适用于所有转发类型，包括媒体组的每一条）
+    try:
+        target_id = state.message_index.lookup(message.chat_id, message.reply_to_message.message_id)
+    except sqlite3.Error as e:
+        logging.error(f"查询转发消息索引失败: {e}")
+        target_id = None
+    # 索引中没有记录（如升级前转发的旧消息），退回到从 caption 中解析用户 ID
+    if not target_id:
+        target_id = parse_target_id(message.reply_to_message)
     if not target_id:
         await message.reply_text("⚠️ 未找到目标用户 ID，可能不是投稿消息")
         return
@@ -405,7 +645,7 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
             chat_id=int(target_id),
             text=f"{caption_info}\n\n{message.text}",  # ✅ 显式把“来自管理员...”加到正文
             parse_mode=ParseMode.MARKDOWN,
-            reply_markup=build_inline_keyboard(WELCOME_BTNS, row_size=BUTTON_LAYOUT["col"]),
+            reply_markup=state.config.markup,
             user_info=caption_info,
             user_id=message.from_user.id  # ✅ 修正为当前发信管理员的 ID
         )
@@ -419,127 +659,335 @@ async def handle_admin_reply(update: Update, context: ContextTypes.DEFAULT_TYPE)
         await message.reply_text("❌ 发送失败，发生异常错误")
 
 
-# 管理员禁言用户：/ban 用户ID 时长(分钟) [原因]
-async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
+# ✅ 用户资料缓存（profile_cache.py，state.profiles）：投稿时记录昵称 / 用户名，禁言时大多无需再调用 get_chat
+BULK_BAN_MAX = 10000  # 单次批量禁言 / 解禁最多处理的用户数
+BULK_FILE_MAX_BYTES = 1024 * 1024  # 用户 ID 列表文件大小上限
+BULK_FILE_EXTENSIONS = (".txt", ".csv")  # 未标明 text/* 类型时按扩展名认定为文本文件
+USER_ID_LIST = re.compile(r"\d+(,\d+)*,?")  # 指令参数中的用户 ID 列表：123 或 123,456
+
+
+# 从文本中解析用户 ID 列表：每行一个 ID，或一行内用逗号分隔多个 ID（去重并保持顺序）
+# 只接受整项都是数字的内容，日期、混在文字中的数字等不会被当作用户 ID
+def parse_user_ids(text):
+    ids = []
+    for line in text.splitlines():
+        for token in line.split(","):
+            token = token.strip()
+            if re.fullmatch(r"[0-9]+", token):
+                ids.append(token)
+    return list(dict.fromkeys(ids))
+
+
+# 是否为文本文件（只从文本文件读取用户 ID 列表，图片、压缩包等投稿文件不处理）
+def is_text_document(document):
+    if document.mime_type and document.mime_type.startswith("text/"):
+        return True
+    return (document.file_name or "").lower().endswith(BULK_FILE_EXTENSIONS)
+
+
+# 读取管理员回复的用户 ID 列表文件，返回 ID 列表；文件过大或无法读取时返回 None
+async def read_user_id_file(context: ContextTypes.DEFAULT_TYPE, document):
+    if document.file_size and document.file_size > BULK_FILE_MAX_BYTES:
+        return None
+    try:
+        file = await context.bot.get_file(document.file_id)
+        data = await file.download_as_bytearray()
+    except Exception as e:
+        logging.error(f"下载用户 ID 列表文件失败: {e}")
+        return None
+    try:
+        text = bytes(data).decode("utf-8-sig")
+    except UnicodeDecodeError:
+        logging.warning(f"用户 ID 列表文件 {document.file_name} 不是 UTF-8 文本，已忽略")
+        return None
+    return parse_user_ids(text)
+
+
+# 取得本次指令要处理的用户 ID：第一个参数为 ID 列表（逗号分隔多个 ID）时使用参数，
+# 否则在回复文本文件时从文件读取（回复投稿的文件时仍可直接写 ID：/ban 123 60）
+# with_duration: ID 之后必须跟着时长（/ban），/ban 60 广告 这样回复文件时的写法不会被当作 ID
+# 返回 (用户 ID 列表, 剩余参数)；格式错误时用户 ID 列表为 None，回复的不是文本文件时为空列表
+async def get_target_user_ids(update: Update, context: ContextTypes.DEFAULT_TYPE, with_duration=False):
     args = context.args
+    has_ids = bool(args) and USER_ID_LIST.fullmatch(args[0]) is not None
+    explicit = has_ids and (not with_duration or (len(args) > 1 and re.fullmatch(r"-?\d+", args[1]) is not None))
+    reply = update.message.reply_to_message
+    if reply and reply.document and not explicit:
+        if not is_text_document(reply.document):
+            return [], args
+        return await read_user_id_file(context, reply.document), args
+    if not has_ids:
+        return None, args[1:]
+    return parse_user_ids(args[0]), args[1:]
+
+
+# 管理员禁言用户：/ban 用户ID[,用户ID...] 时长(分钟) [原因]，或回复 ID 列表文件：/ban 时长(分钟) [原因]
+async def ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
+    user_ids, args = await get_target_user_ids(update, context, with_duration=True)
     # 参数数量不足，至少需要 用户ID 和 禁言分钟数
-    if len(args) < 2:
-        await update.message.reply_text("用法：/ban [用户ID] [时长(分钟)] [原因(可选)]\n\n时长填 0 表示永久禁言")
+    if user_ids is None or not args:
+        await update.message.reply_text(
+            "用法：/ban [用户ID] [时长(分钟)] [原因(可选)]\n\n时长填 0 表示永久禁言\n"
+            "多个用户用逗号分隔：/ban 123,456 60 广告\n"
+            "或回复一个用户 ID 列表文本文件（每行一个 ID 或逗号分隔）：/ban 60 广告"
+        )
+        return
+    if not user_ids:
+        await update.message.reply_text("❌ 没有找到有效的用户 ID")
+        return
+    if len(user_ids) > BULK_BAN_MAX:
+        await update.message.reply_text(f"❌ 单次最多处理 {BULK_BAN_MAX} 个用户")
         return
-    user_id = args[0]
-    # 检查第二个参数是否是整数（防止 `/ban 123 abc`）
+    # 检查时长参数是否是整数（防止 `/ban 123 abc`）
     try:
-        minutes = int(args[1])
+        minutes = int(args[0])
     except ValueError:
         await update.message.reply_text("❌ 无效的禁言时长，必须是数字（单位为分钟）")
         return
-    reason = " ".join(args[2:]) if len(args) > 2 else ""
-    until = time.time() + minutes * 60 if minutes > 0 else float('inf')
-    # 主动获取用户资料（避免昵称未知）
-    try:
-        user_obj = await context.bot.get_chat(user_id)
-        name = user_obj.full_name
-        username = user_obj.username or "无"
-    except:
-        name = "未知"
-        username = "无"
-    user_info = {
-        "user_id": user_id,
-        "until": until,
-        "time_str": datetime.fromtimestamp(until).strftime("%Y-%m-%d %H:%M") if until != float('inf') else "永久",
-        "name": name,
-        "username": username,
-        "reason": reason
-    }
-    blacklist[user_id] = user_info
-    save_json(BLACKLIST_PATH, blacklist)
-    await update.message.reply_text(
-        f"✅ 已禁言用户 {user_id}（{name}），时长：{user_info['time_str']}"
-        + (f"\n📌 原因：{reason}" if reason else "")
-    )
+    reason = " ".join(args[1:])
+    now = time.time()
+    until = now + minutes * 60 if minutes > 0 else None  # None 表示永久禁言
+    time_str = datetime.fromtimestamp(until).strftime("%Y-%m-%d %H:%M") if until is not None else "永久"
+    # 获取用户资料：优先读缓存，未缓存的用户并发调用 get_chat
+    profiles = await state.profiles.resolve(context.bot, user_ids)
+    bans = {}
+    for user_id in user_ids:
+        name, username = profiles.get(user_id) or ("未知", None)
+        bans[user_id] = {
+            "user_id": user_id,
+            "until": until,
+            "time_str": time_str,
+            "name": name,
+            "username": username or "无",
+            "reason": reason,
+            "banned_at": now
+        }
+    # 一次性保存
+    state.storage.set_bans(bans)
+    unresolved = sum(1 for user_id in user_ids if profiles.get(user_id) is None)
+    if len(user_ids) == 1:
+        text = f"✅ 已禁言用户 {user_ids[0]}（{bans[user_ids[0]]['name']}），时长：{time_str}"
+    else:
+        text = f"✅ 已禁言 {len(user_ids)} 个用户，时长：{time_str}"
+    if unresolved:
+        text += f"\n⚠️ {unresolved} 个用户资料获取失败，昵称记录为“未知”"
+    await update.message.reply_text(text + (f"\n📌 原因：{reason}" if reason else ""))
 
 
-# 解除禁言用户：/unban 用户ID
+# 解除禁言用户：/unban 用户ID[,用户ID...]，或回复 ID 列表文件：/unban
 async def unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
-    args = context.args
-    if not args:
-        await update.message.reply_text("用法：/unban 用户ID")
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
+    user_ids, _ = await get_target_user_ids(update, context)
+    if not user_ids:
+        await update.message.reply_text("用法：/unban 用户ID（多个用逗号分隔，或回复用户 ID 列表文件）")
+        return
+    if len(user_ids) > BULK_BAN_MAX:
+        await update.message.reply_text(f"❌ 单次最多处理 {BULK_BAN_MAX} 个用户")
         return
-    user_id = args[0]
-    if user_id in blacklist:
-        blacklist.pop(user_id)
-        save_json(BLACKLIST_PATH, blacklist)
-        await update.message.reply_text(f"已解除禁言用户 {user_id}")
+    removed = state.storage.delete_bans(user_ids)
+    if len(user_ids) == 1:
+        await update.message.reply_text(f"已解除禁言用户 {user_ids[0]}" if removed else "该用户不在禁言列表中")
     else:
-        await update.message.reply_text("该用户不在禁言列表中")
+        await update.message.reply_text(f"已解除禁言 {removed} 个用户（{len(user_ids) - removed} 个不在禁言列表中）")
+
+
+# 禁言列表分页参数：每页最多条数、单条消息长度上限（Telegram 限制 4096 字符）、原因最多显示的字数
+BANNED_PAGE_SIZE = 10
+MESSAGE_LIMIT = 4096
+BANNED_REASON_MAX = 100
+BANNED_ORDER_NAMES = {"time": "按禁言时间", "until": "按到期时间"}
+CALLBACK_DATA_MAX = 64  # Telegram 按钮 callback_data 上限（字节）
+BANNED_QUERY_MAX_BYTES = CALLBACK_DATA_MAX - len("banned|until|9999999|")  # 搜索关键字在翻页按钮数据中可用的字节数
+
+
+# 按 UTF-8 字节数截断搜索关键字（中文每字 3 字节），保证翻页按钮数据不超长，且翻页前后搜索同一个关键字
+def clip_banned_query(query):
+    return query.encode("utf-8")[:BANNED_QUERY_MAX_BYTES].decode("utf-8", errors="ignore")
+
+
+# 渲染一条禁言记录（完整的 HTML 片段，标签不会跨条目）
+def format_ban_entry(uid, info):
+    name = html.escape(info.get("name", "未知"))
+    username = html.escape(info.get("username", "无"))
+    reason = info.get("reason", "")
+    if len(reason) > BANNED_REASON_MAX:
+        reason = reason[:BANNED_REASON_MAX] + "…"
+    reason = html.escape(reason)
+    left = format_time_left(info.get("until"))
+    return (
+        f"👤 {name} (@{username})\n"
+        f"ID: <code>{html.escape(str(uid))}</code>\n"
+        f"剩余时间：{left}" + (f"\n原因：{reason}" if reason else "") + "\n\n"
+    )
 
 
-# 查看所有被禁言用户：/banned
+# 生成禁言列表的一页：从存储后端按排序方式只读取当前页，按条目边界截断到消息长度上限以内
+# 返回 (文本, 翻页按钮)；回调数据格式 banned|排序|偏移|搜索关键字
+def build_banned_page(state, order="time", offset=0, query=""):
+    query = clip_banned_query(query)
+    total, entries = state.storage.page_bans(order, offset, BANNED_PAGE_SIZE, query or None)
+    if total and offset >= total:
+        # 翻页期间有人被解禁导致页码越界，回到最后一页
+        offset = max(0, total - BANNED_PAGE_SIZE)
+        total, entries = state.storage.page_bans(order, offset, BANNED_PAGE_SIZE, query or None)
+    if not total:
+        return ("没有找到匹配的禁言用户" if query else "当前无被禁言用户"), None
+    header = f"<b>🔒 当前被禁言用户列表（{BANNED_ORDER_NAMES[order]}）：</b>\n"
+    if query:
+        header += f"🔍 搜索：{html.escape(query)}\n"
+    footer = f"第 {offset + 1}-{{end}} 条，共 {total} 条"
+    text = header + "\n"
+    shown = 0
+    for uid, info in entries:
+        entry = format_ban_entry(uid, info)
+        if shown and len(text) + len(entry) + len(footer) + 10 > MESSAGE_LIMIT:
+            break
+        text += entry
+        shown += 1
+    text += footer.format(end=offset + shown)
+    nav = []
+    if offset > 0:
+        nav.append(InlineKeyboardButton("⬅️ 上一页", callback_data=f"banned|{order}|{max(0, offset - BANNED_PAGE_SIZE)}|{query}"))
+    if offset + shown < total:
+        nav.append(InlineKeyboardButton("下一页 ➡️", callback_data=f"banned|{order}|{offset + shown}|{query}"))
+    other = "until" if order == "time" else "time"
+    buttons = [nav] if nav else []
+    buttons.append([InlineKeyboardButton(f"🔃 {BANNED_ORDER_NAMES[other]}", callback_data=f"banned|{other}|0|{query}")])
+    return text, InlineKeyboardMarkup(buttons)
+
+
+# 查看被禁言用户：/banned [time/until] | /banned search 关键字（用户 ID、用户名或昵称）
 async def list_banned(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID):
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id):
         return
-    if not blacklist:
-        await update.message.reply_text("当前无被禁言用户")
+    args = context.args
+    order, query = "time", ""
+    if args and args[0].lower() == "search":
+        if len(args) < 2:
+            await update.message.reply_text("用法：/banned search [用户ID/用户名/昵称]")
+            return
+        query = " ".join(args[1:])
+    elif args and args[0].lower() in BANNED_ORDER_NAMES:
+        order = args[0].lower()
+    text, markup = build_banned_page(state, order, 0, query)
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=markup)
+
+
+# 禁言列表翻页 / 切换排序按钮回调
+async def banned_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
+    query = update.callback_query
+    if str(update.effective_user.id) != str(state.admin_id):
+        await query.answer()
         return
-    text = "<b>🔒 当前被禁言用户列表：</b>\n\n"
-    for uid, info in blacklist.items():
-        name = html.escape(info.get("name", "未知"))
-        username = html.escape(info.get("username", "无"))
-        reason = html.escape(info.get("reason", ""))
-        left = format_time_left(info["until"]) if info["until"] != float("inf") else "永久"
+    try:
+        _, order, offset, keyword = query.data.split("|", 3)
+        offset = int(offset)
+    except ValueError:
+        await query.answer("❌ 无效的翻页数据")
+        return
+    if order not in BANNED_ORDER_NAMES:
+        order = "time"
+    await query.answer()
+    text, markup = build_banned_page(state, order, max(0, offset), keyword)
+    try:
+        await query.edit_message_text(text, parse_mode=ParseMode.HTML, reply_markup=markup)
+    except BadRequest as e:
+        # 内容没有变化（例如重复点击）时 Telegram 会返回错误，忽略即可
+        if "not modified" not in str(e).lower():
+            raise
 
-        text += (
-            f"👤 {name} (@{username})\n"
-            f"ID: <code>{uid}</code>\n"
-            f"剩余时间：{left}" + (f"\n原因：{reason}" if reason else "") + "\n\n"
-        )
-    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
 
+# 投稿限制当前状态文字
+def format_limit_status(state):
+    post_limit = state.config.post_limit
+    if not post_limit.enabled:
+        return "✅ 投稿限制已关闭"
+    text = f"✅ 投稿限制已启用，每小时限制 {post_limit.count} 次"
+    for kind, limit in post_limit.types.items():
+        text += f"\n　· {POST_KINDS.get(kind, kind)}：每小时 {limit} 次"
+    return text
 
-# 开启或关闭投稿频率限制：/limit [on/off 次数]
+
+# 开启或关闭投稿频率限制：/limit [on/off 次数] | /limit type [类别] [次数/off] | /limit stats
 async def toggle_limit(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
     args = context.args
     if not args:
         # 不带参数指令默认显示当前状态
-        await update.message.reply_text(f"✅ 投稿限制已启用，每小时限制 {POST_LIMIT_CFG['count']} 次" if POST_LIMIT_CFG['enabled'] else "✅ 投稿限制已关闭")
+        await update.message.reply_text(format_limit_status(state))
         return
+    elif args[0].lower() == "stats":
+        # 查看限流器内存占用与命中统计
+        stats = state.post_limiter.stats()
+        await update.message.reply_text(
+            f"📊 投稿限制统计\n"
+            f"跟踪用户：{stats['users']}\n"
+            f"计数桶：{stats['buckets']}\n"
+            f"窗口内记录：{stats['timestamps']}\n"
+            f"累计放行：{stats['allowed']}\n"
+            f"累计拒绝：{stats['denied']}\n"
+            f"已清理空闲计数：{stats['evicted']}"
+        )
+        # 出站发送限流排队情况
+        out = state.outbound_limiter.stats()
+        await update.message.reply_text(
+            f"📤 出站发送限流统计\n"
+            f"累计发送：{out['acquired']}\n"
+            f"排队次数：{out['delayed']}\n"
+            f"平均等待：{out['avg_wait']:.2f} 秒\n"
+            f"最长等待：{out['max_wait']:.2f} 秒\n"
+            f"当前排队：{out['queued']}"
+        )
+        return
+    elif args[0].lower() == "type":
+        # 单独设置某一类投稿的每小时上限
+        if len(args) < 3 or args[1] not in POST_KINDS or not (args[2].isdigit() or args[2].lower() == "off"):
+            await update.message.reply_text("用法：/limit type [text/media/media_group] [次数/off]")
+            return
+        post_limit = state.config.setting("post_limit")
+        types = post_limit.setdefault("types", {})
+        if args[2].lower() == "off" or int(args[2]) == 0:
+            types.pop(args[1], None)
+        else:
+            types[args[1]] = int(args[2])
+        update_config(state, post_limit=post_limit)
     else:
-        POST_LIMIT_CFG["enabled"] = args[0].lower() == "on"
-        POST_LIMIT_CFG["count"] = int(args[1]) if len(args) > 1 else 30
-    config["post_limit"] = POST_LIMIT_CFG
-    save_json(CONFIG_PATH, config)
-    await update.message.reply_text(f"✅ 投稿限制已启用，每小时限制 {POST_LIMIT_CFG['count']} 次" if POST_LIMIT_CFG['enabled'] else "✅ 投稿限制已关闭")
+        if len(args) > 1 and not args[1].isdigit():
+            await update.message.reply_text("用法：/limit [on/off] [次数]")
+            return
+        enabled = args[0].lower() == "on"
+        update_config(state, post_limit=dict(state.config.setting("post_limit"), enabled=enabled, count=int(args[1]) if len(args) > 1 else 30))
+        if not enabled:
+            state.post_limiter.clear()
+    await update.message.reply_text(format_limit_status(state))
 
 
 # 设置欢迎文本内容：/setwelcome 欢迎文字
 async def set_welcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
     text = update.message.text_html.replace("/setwelcome", "").strip()
     if not text:
         await update.message.reply_text("请提供欢迎内容。用法：/setwelcome 欢迎文本")
         return
-    config["welcome_message"] = text
-    save_json(CONFIG_PATH, config)
+    update_config(state, welcome_message=text)
     await update.message.reply_text("✅ 欢迎信息已更新。")
 
 
-# === 通用等待操作状态 ===
-pending_action = {
-    "type": None,      # 等待任务类型：如 "welcome_image"
-    "user_id": None    # 触发该任务的管理员 ID
-}
-
-
 # 通用取消指令：/cancel 可取消任何等待状态
 async def cancel_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
+    pending_action = state.get_pending_action()  # 通用等待操作状态：等待任务类型（如 "welcome_image"）与触发该任务的管理员 ID
     if pending_action["type"]:
         desc = pending_action["type"]
-        pending_action["type"] = None
-        pending_action["user_id"] = None
+        state.set_pending_action()
         await update.message.reply_text(f"✅ 操作已取消（类型：{desc}）")
     else:
         await update.message.reply_text("📭 当前无待取消的操作")
@@ -550,9 +998,10 @@ async def handle_admin_image(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not update.message.photo:
         return
     # 判断当前处于哪种等待状态，并委托给对应函数
-    if pending_action["type"] == "welcome_image":
+    action = get_state(context).get_pending_action()["type"]
+    if action == "welcome_image":
         await set_welcome_image(update, context)
-    elif pending_action["type"] == "reply_image":
+    elif action == "reply_image":
         await set_reply_image(update, context)
     else:
         # 如果没有等待任务，不处理图片
@@ -561,14 +1010,16 @@ async def handle_admin_image(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 # 管理员输入 /setwelcomeimg，进入等待欢迎图片模式
 async def start_set_welcome_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
-    pending_action["type"] = "welcome_image"
-    pending_action["user_id"] = update.effective_user.id
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
+    state.set_pending_action("welcome_image", update.effective_user.id)
     await update.message.reply_text("✅ 请发送欢迎图片，我将自动设置为欢迎图。如需取消，请发送 /cancel")
 
 
 # 管理员发送图片后，若处于等待设置欢迎图状态则保存
 async def set_welcome_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
+    pending_action = state.get_pending_action()
     if not (pending_action["type"] == "welcome_image" and update.effective_user.id == pending_action["user_id"]):
         return  # 非等待状态或非触发管理员，不处理
     if not update.message.photo:
@@ -577,18 +1028,20 @@ async def set_welcome_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 获取并保存图片
     photo = update.message.photo[-1]
     file = await context.bot.get_file(photo.file_id)
-    await file.download_to_drive(WELCOME_IMG_PATH)
+    await file.download_to_drive(state.welcome_img_path)
+    invalidate_file_id(state.welcome_img_path)
     # 重置状态
-    pending_action["type"] = None
-    pending_action["user_id"] = None
+    state.set_pending_action()
     await update.message.reply_text("✅ 欢迎图片已成功设置！")
 
 
 # 清除当前设置的欢迎图片
 async def clear_welcome_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
-    if os.path.exists(WELCOME_IMG_PATH):
-        os.remove(WELCOME_IMG_PATH)
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
+    if os.path.exists(state.welcome_img_path):
+        os.remove(state.welcome_img_path)
+        invalidate_file_id(state.welcome_img_path)
         await update.message.reply_text("✅ 已移除欢迎图片")
     else:
         await update.message.reply_text("⚠️ 当前无欢迎图片")
@@ -596,14 +1049,16 @@ async def clear_welcome_image(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 # 管理员输入 /setreplyimg，进入等待设置自动回复图片状态
 async def start_set_reply_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
-    pending_action["type"] = "reply_image"
-    pending_action["user_id"] = update.effective_user.id
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
+    state.set_pending_action("reply_image", update.effective_user.id)
     await update.message.reply_text("✅ 请发送自动回复图片，如需取消请输入 /cancel")
 
 
 # 管理员发送图片后，若处于等待设置自动回复图状态则保存
 async def set_reply_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
+    pending_action = state.get_pending_action()
     if not (pending_action["type"] == "reply_image" and update.effective_user.id == pending_action["user_id"]):
         return
     if not update.message.photo:
@@ -611,17 +1066,19 @@ async def set_reply_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     photo = update.message.photo[-1]
     file = await context.bot.get_file(photo.file_id)
-    await file.download_to_drive(REPLY_IMG_PATH)
-    pending_action["type"] = None
-    pending_action["user_id"] = None
+    await file.download_to_drive(state.reply_img_path)
+    invalidate_file_id(state.reply_img_path)
+    state.set_pending_action()
     await update.message.reply_text("✅ 自动回复图片已设置！")
 
 
 # 清除当前设置的自动回复图片
 async def clear_reply_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
-    if os.path.exists(REPLY_IMG_PATH):
-        os.remove(REPLY_IMG_PATH)
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
+    if os.path.exists(state.reply_img_path):
+        os.remove(state.reply_img_path)
+        invalidate_file_id(state.reply_img_path)
         await update.message.reply_text("✅ 已移除自动回复图片")
     else:
         await update.message.reply_text("⚠️ 当前无自动回复图片")
@@ -629,62 +1086,64 @@ async def clear_reply_image(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # 设置自动回复文本内容：/setautoreply 欢迎文字
 async def set_autoreply(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
     text = update.message.text_html.replace("/setautoreply", "").strip()
     if not text:
         await update.message.reply_text("请提供自动回复内容。用法：/setautoreply 自动回复文本")
         return
-    config["auto_reply"] = text
-    save_json(CONFIG_PATH, config)
+    update_config(state, auto_reply=text)
     await update.message.reply_text("✅ 自动回复信息已更新。")
 
 
 # 设置按钮布局：/sortbuttons 2x2
 async def sort_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
     args = context.args[0].lower().split("x") if context.args else []
     if len(args) != 2 or not all(x.isdigit() for x in args):
         await update.message.reply_text("用法：/sortbuttons 2x2")
         return
-    BUTTON_LAYOUT["row"], BUTTON_LAYOUT["col"] = int(args[0]), int(args[1])
-    config["button_layout"] = BUTTON_LAYOUT
-    save_json(CONFIG_PATH, config)
-    await update.message.reply_text(f"✅ 按钮布局更新为：{BUTTON_LAYOUT['row']}行×{BUTTON_LAYOUT['col']}列")
+    row, col = update_config(state, button_layout={"row": int(args[0]), "col": int(args[1])}).button_layout
+    await update.message.reply_text(f"✅ 按钮布局更新为：{row}行×{col}列")
 
 
 # 显示当前设置的欢迎按钮列表
 async def list_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
     msg = "📌 当前欢迎按钮：\n"
-    for i, btn in enumerate(WELCOME_BTNS, 1):
-        msg += f"{i}. {btn['text']} → {btn['url']}\n"
+    for i, (text, url) in enumerate(state.config.welcome_buttons, 1):
+        msg += f"{i}. {text} → {url}\n"
     await update.message.reply_text(msg)
 
 
 # 添加新按钮：/addbutton 文本 URL
 async def add_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
     if len(context.args) < 2:
         await update.message.reply_text("用法：/addbutton 文本 URL")
         return
     text, url = context.args[0], context.args[1]
-    WELCOME_BTNS.append({"text": text, "url": url})
-    config["welcome_buttons"] = WELCOME_BTNS
-    save_json(CONFIG_PATH, config)
+    buttons = state.config.setting("welcome_buttons")
+    buttons.append({"text": text, "url": url})
+    update_config(state, welcome_buttons=buttons)
     await update.message.reply_text(f"✅ 按钮已添加：{text} → {url}")
 
 
 # 删除按钮：/delbutton 序号
 async def del_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
     if not context.args or not context.args[0].isdigit():
         await update.message.reply_text("用法：/delbutton 序号")
         return
     idx = int(context.args[0]) - 1
-    if 0 <= idx < len(WELCOME_BTNS):
-        removed = WELCOME_BTNS.pop(idx)
-        config["welcome_buttons"] = WELCOME_BTNS
-        save_json(CONFIG_PATH, config)
+    buttons = state.config.setting("welcome_buttons")
+    if 0 <= idx < len(buttons):
+        removed = buttons.pop(idx)
+        update_config(state, welcome_buttons=buttons)
         await update.message.reply_text(f"✅ 已删除按钮：{removed['text']}")
     else:
         await update.message.reply_text("❌ 无效序号")
@@ -692,38 +1151,39 @@ async def del_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # 编辑已有按钮：/editbutton 序号 文本 URL
 async def edit_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID): return
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
     if len(context.args) < 3 or not context.args[0].isdigit():
         await update.message.reply_text("用法：/editbutton 序号 文本 URL")
         return
     idx = int(context.args[0]) - 1
     text, url = context.args[1], context.args[2]
-    if 0 <= idx < len(WELCOME_BTNS):
-        WELCOME_BTNS[idx] = {"text": text, "url": url}
-        config["welcome_buttons"] = WELCOME_BTNS
-        save_json(CONFIG_PATH, config)
+    buttons = state.config.setting("welcome_buttons")
+    if 0 <= idx < len(buttons):
+        buttons[idx] = {"text": text, "url": url}
+        update_config(state, welcome_buttons=buttons)
         await update.message.reply_text(f"✅ 按钮已修改为：{text} → {url}")
     else:
         await update.message.reply_text("❌ 无效序号")
 
 
 # 用户使用 /start 指令时看到的欢迎信息
+@timed_handler("start_command")
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
     user = update.effective_user
     # 构造投稿用户信息（用于失败通知）
     caption_info = f'<a href="tg://user?id={user.id}">{user.full_name}</a> | ID: <code>{user.id}</code>'
-    # 获取欢迎消息内容和按钮布局
-    welcome_text = config.get("welcome_message", "欢迎加入频道！")
-    reply_markup = build_inline_keyboard(WELCOME_BTNS, row_size=BUTTON_LAYOUT["col"])
-    if has_welcome_image():
+    # 获取欢迎消息内容和按钮布局（同一快照，保证两者一致）
+    cfg = state.config
+    if has_welcome_image(state):
         # ✅ 使用封装好的安全发送图片函数，自动处理 open + retry
         await safe_send_image(
             context.bot,
             chat_id=user.id,
-            file_path=WELCOME_IMG_PATH,
-            caption=welcome_text,
-            parse_mode=ParseMode.HTML,
-            reply_markup=reply_markup,
+            file_path=state.welcome_img_path,
+            caption=cfg.welcome_message,
+            **cfg.reply_kwargs,
             user_info=caption_info,
             user_id=user.id
         )
@@ -733,9 +1193,8 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             context.bot,
             context.bot.send_message,
             chat_id=user.id,
-            text=welcome_text,
-            parse_mode=ParseMode.HTML,
-            reply_markup=reply_markup,
+            text=cfg.welcome_message,
+            **cfg.reply_kwargs,
             user_info=caption_info,
             user_id=user.id
         )
@@ -744,22 +1203,28 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # 管理员使用 /ver 指令获取机器人当前版本号
 async def bot_ver(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) == str(ADMIN_ID):
+    if str(update.effective_user.id) == str(get_state(context).admin_id):
         text = f"📌 <b>当前机器人版本：</b>\n🤖 {BOT_VER}"
         await update.message.reply_text(text, parse_mode=ParseMode.HTML)
 
 # 管理员专用 /help 指令，显示所有可用管理指令说明
 async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if str(update.effective_user.id) != str(ADMIN_ID):
+    if str(update.effective_user.id) != str(get_state(context).admin_id):
         return
     text = (
         "🛠 <b>管理员指令说明</b>\n\n"
         "<b>📥 投稿相关</b>\n"
         "/ban [用户ID] [时长(分钟)] [原因(可选)] 【禁言用户】\n"
         "/unban [用户ID] 【解除禁言】\n"
-        "/banned 【查看当前禁言列表】\n"
+        "( 多个用户ID用逗号分隔，或回复用户ID列表文件发送 /ban [时长] [原因]、/unban )\n"
+        "/banned [time/until] 【分页查看禁言列表，可按禁言时间或到期时间排序】\n"
+        "/banned search [用户ID/用户名] 【搜索禁言用户】\n"
         "/limit [on/off] [次数] 【设置每小时投稿次数限制】\n"
-        "( 不带次数默认每小时30次 - 不带参数为查看当前状态 )\n\n"
+        "( 不带次数默认每小时30次 - 不带参数为查看当前状态 )\n"
+        "/limit type [text/media/media_group] [次数/off] 【单独限制某类投稿】\n"
+        "/limit stats 【查看投稿限制统计】\n"
+        "/dedup [on/off] 【重复投稿检测开关与统计】\n"
+        "/stats 【查看处理耗时与发送统计】\n\n"
 
         "<b>📣 自动回复设置</b>\n"
         "/setwelcome [欢迎内容] 【设置欢迎文字(支持HTML)】\n"
@@ -796,54 +1261,330 @@ async def show_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(text, parse_mode=ParseMode.HTML, reply_markup=help_buttons)
 
 
-# 设置指令菜单（仅对管理员可见）
+# 管理员专属命令菜单：(命令, 说明)
+ADMIN_COMMANDS = [
+    ("ban", "禁言用户"),
+    ("unban", "解除禁言"),
+    ("banned", "查看禁言列表"),
+    ("limit", "设置投稿频率限制"),
+    ("dedup", "重复投稿检测"),
+    ("stats", "查看运行统计"),
+    ("setwelcome", "设置欢迎信息"),
+    ("setwelcomeimg", "设置欢迎信息附加图片"),
+    ("clearwelcomeimg", "清除欢迎信息附加图片"),
+    ("setautoreply", "设置自动回复信息"),
+    ("setreplyimg", "设置自动回复附加图片"),
+    ("clearreplyimg", "清除自动回复附加图片"),
+    ("listbuttons", "查看自动回复按钮"),
+    ("addbutton", "添加自动回复按钮"),
+    ("editbutton", "修改自动回复按钮"),
+    ("delbutton", "删除自动回复按钮"),
+    ("sortbuttons", "设置自动回复按钮布局"),
+    ("cancel", "取消操作"),
+    ("help", "显示帮助菜单"),
+    ("ver", "显示机器人版本信息")
+]
+COMMANDS_REFRESH_INTERVAL = 7 * 24 * 3600  # 菜单未变化时也定期重新发布一次（秒），防止在其他地方被修改后一直不同步
+
+
+# 命令菜单哈希：机器人 ID、管理员 ID 或命令列表变化时才需要重新发布
+def commands_hash(bot_id, admin_id):
+    data = json.dumps([str(bot_id), str(admin_id), ADMIN_COMMANDS], ensure_ascii=False)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+# 设置指令菜单（仅对管理员可见），与上次发布的内容相同时跳过网络请求
 async def setup_commands(application: Application):
+    state = application.bot_data["state"]
+    digest = commands_hash(application.bot.token.split(":")[0], state.admin_id)
+    published = state.checkpoint.get_meta("commands", {})
+    if published.get("hash") == digest and time.time() - published.get("at", 0) < COMMANDS_REFRESH_INTERVAL:
+        logging.info("✅ 命令菜单未变化，跳过发布")
+        return
     try:
         # 设置管理员专属命令菜单
         await application.bot.set_my_commands(
-            commands=[
-                BotCommand("ban", "禁言用户"),
-                BotCommand("unban", "解除禁言"),
-                BotCommand("banned", "查看禁言列表"),
-                BotCommand("limit", "设置投稿频率限制"),
-                BotCommand("setwelcome", "设置欢迎信息"),
-                BotCommand("setwelcomeimg", "设置欢迎信息附加图片"),
-                BotCommand("clearwelcomeimg", "清除欢迎信息附加图片"),
-                BotCommand("setautoreply", "设置自动回复信息"),
-                BotCommand("setreplyimg", "设置自动回复附加图片"),
-                BotCommand("clearreplyimg", "清除自动回复附加图片"),
-                BotCommand("listbuttons", "查看自动回复按钮"),
-                BotCommand("addbutton", "添加自动回复按钮"),
-                BotCommand("editbutton", "修改自动回复按钮"),
-                BotCommand("delbutton", "删除自动回复按钮"),
-                BotCommand("sortbuttons", "设置自动回复按钮布局"),
-                BotCommand("cancel", "取消操作"),
-                BotCommand("help", "显示帮助菜单"),
-                BotCommand("ver", "显示机器人版本信息")
-            ],
-            scope=BotCommandScopeChat(chat_id=int(ADMIN_ID))
+            commands=[BotCommand(command, description) for command, description in ADMIN_COMMANDS],
+            scope=BotCommandScopeChat(chat_id=int(state.admin_id))
         )
         # 清除默认的所有人可见菜单（防止普通用户看到）
         await application.bot.delete_my_commands(scope=BotCommandScopeDefault())
+        state.checkpoint.set_meta("commands", {"hash": digest, "at": time.time()})
         logging.info("✅ 已设置管理员专属命令菜单，清除默认指令菜单")
     except Exception as e:
         logging.warning(f"⚠️ 设置命令菜单失败: {e}")
 
 
+# ✅ 持久化发送队列（outbox.py，state.outbox）：投稿先写入本地数据库，再由后台工作协程转发，重启后自动续传
+OUTBOX_RETRY_DELAYS = [30, 120]  # 一轮 safe_send 重试全部失败后，整体再重试的间隔（秒）
+OUTBOX_PURGE_INTERVAL = 3600  # 清理过期已完成任务的间隔（秒）
+
+
+# ✅ 转发消息索引（message_index.py，state.message_index）：管理员聊天消息 ID → 投稿用户 ID，LRU 内存 + SQLite
+# ✅ 从 dedup.py 导入重复投稿检测（file_unique_id / 规范化文字指纹，时间窗口 + 容量上限），指纹在 warm_up() 中载入
+from dedup import message_fingerprint, group_fingerprint, file_fingerprint
+
+
+# ✅ 重启检查点（checkpoint.py，state.checkpoint）：停止时保存收集中的媒体组、投稿限制计数、等待中的管理员操作
+# 共享模式下这些状态本来就保存在共享状态中，不使用检查点
+PENDING_ACTION_MAX_AGE = 600  # 超过该时间（秒）的检查点不再恢复管理员等待中的操作
 
-# 主函数：注册处理器并启动 bot（使用 polling 模式）
-def main():
-    # 初始化日志输出格式
-    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
-    # 创建 bot 应用实例（传入 token）
-    application = Application.builder().token(TOKEN).build()
-    # 设置管理员专属菜单，设置 post_init 钩子函数（事件循环准备好后自动执行）
-    application.post_init = setup_commands
+
+# 停止时保存检查点（媒体组的转发任务随 job_queue 停止而丢失，这里记录剩余的预定时间）
+def save_checkpoint(state):
+    if state.shared:
+        return
+    groups = []
+    for group_id, group in state.media_groups.items():
+        groups.append({
+            "group_id": group_id,
+            "items": [item.to_dict() for item in group.items],
+            "user_id": group.user_id,
+            "chat_id": group.chat_id,
+            "caption_info": group.caption_info,
+            "first_at": group.first_at,
+            "due": group.due,
+            "late": group.late
+        })
+    data = {
+        "media_groups": groups,
+        "flushed_groups": state.flushed_groups,
+        "post_limit": state.post_limiter.snapshot(),
+        "pending_action": state.pending_action
+    }
+    try:
+        size = state.checkpoint.save(data)
+    except Exception as e:
+        logging.error(f"❌ 保存检查点失败: {e}")
+        return
+    logging.info(f"✅ 已保存检查点：{len(groups)} 个媒体组，{len(data['post_limit'])} 个投稿计数（{size} 字节）")
+
+
+# 启动时恢复检查点，媒体组按剩余时间重新安排转发（已过期的立即转发）
+def restore_checkpoint(application: Application):
+    state = application.bot_data["state"]
+    if state.shared:
+        return
+    checkpoint = state.checkpoint.take()
+    if checkpoint is None:
+        return
+    saved_at, data = checkpoint
+    now = time.time()
+    for saved in data.get("media_groups", []):
+        group_id = saved["group_id"]
+        group = MediaGroup(saved["user_id"], saved["chat_id"], saved["caption_info"], saved["first_at"], saved["late"])
+        group.items = [MediaItem.from_dict(item) for item in saved["items"]]
+        for old_id, old_group in state.media_groups.add_group(group_id, group):
+            flush_evicted_media_group(state, application.job_queue, old_id, old_group)
+        schedule_media_group(application.job_queue, group_id, group, max(0, (saved["due"] or now) - now))
+    for group_id, flushed_at in data.get("flushed_groups", {}).items():
+        state.flushed_groups.setdefault(group_id, flushed_at)
+    restored = state.post_limiter.restore(data.get("post_limit", []))
+    if now - saved_at <= PENDING_ACTION_MAX_AGE:
+        state.pending_action.update(data.get("pending_action", {}))
+    logging.info(
+        f"✅ 已从检查点恢复 {len(data.get('media_groups', []))} 个媒体组，{restored} 个投稿计数"
+        f"（停机 {now - saved_at:.1f} 秒）"
+    )
+
+
+# 定时任务：清理发送队列中保留期已过的已完成 / 已失败任务，以及过期的转发消息索引、去重指纹、共享状态
+async def purge_outbox(context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
+    state.outbox.purge_finished()
+    state.message_index.purge()
+    state.duplicates.purge()
+    if state.shared:
+        state.shared.purge()
+
+
+# 查看重复投稿统计 / 开关重复投稿检测：/dedup [on/off]
+async def dedup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
+    if context.args:
+        update_config(state, dedup=dict(state.config.dedup, enabled=context.args[0].lower() == "on"))
+    stats = state.duplicates.stats()
+    await update.message.reply_text(
+        f"{'✅ 重复投稿检测已启用' if state.config.dedup['enabled'] else '✅ 重复投稿检测已关闭'}\n"
+        f"记录指纹：{stats['tracked']}\n"
+        f"重复命中：{stats['hits']}\n"
+        f"新内容：{stats['misses']}\n"
+        f"命中率：{stats['hit_rate']:.1%}"
+    )
+
+
+# ✅ 从 update_processor.py 导入并发更新处理器（同一用户串行、不同用户并发）
+from update_processor import KeyedUpdateProcessor
+
+# ✅ 从 multi_bot.py 导入多机器人运行器（共用事件循环与 HTTP 连接池）
+from multi_bot import SharedConnectionPool, run_applications
+
+# ✅ 从 status_server.py 导入本地状态 HTTP 服务（健康检查）
+from status_server import StatusServer
+STATUS_SERVER = None  # 启用后为 StatusServer 实例（所有机器人共用）
+STARTED_AT = time.time()  # 进程启动时间，用于计算运行时长
+
+
+# 健康检查：GET /healthz（所有机器人都在运行才返回 200）
+def health_check():
+    states = list(BOTS.values())
+    running = bool(states) and all(
+        state.application.running and (state.application.updater is None or state.application.updater.running)
+        for state in states
+    )
+    body = json.dumps({
+        "status": "ok" if running else "starting",
+        "mode": states[0].run_mode if len(states) == 1 else "multi",
+        "bots": len(states),
+        "version": BOT_VER,
+        "uptime": int(time.time() - STARTED_AT)
+    })
+    return (200 if running else 503), "application/json", body
+
+
+# 所有机器人某项统计之和（多机器人模式下指标按进程汇总）
+def sum_states(func):
+    return sum(func(state) for state in BOTS.values())
+
+
+# 所有机器人按标签汇总的统计（字典各项相加）
+def merge_states(func):
+    merged = {}
+    for state in BOTS.values():
+        for key, value in func(state).items():
+            merged[(key,)] = merged.get((key,), 0) + value
+    return merged
+
+
+# 运行中的缓存 / 队列大小，在读取指标时实时计算
+METRICS.gauge("media_group_cache", "Media groups still being collected", lambda: sum_states(count_media_groups))
+METRICS.gauge("media_group_buffered_items", "Album items held in the media group buffer", lambda: sum_states(lambda s: s.media_groups.item_count))
+METRICS.gauge("media_groups", "Media group counters", lambda: merge_states(lambda s: s.media_group_stats), ("event",))
+METRICS.gauge("post_limit_users", "Users tracked by the post rate limiter", lambda: sum_states(lambda s: s.post_limiter.stats()["users"]))
+METRICS.gauge("post_limit_timestamps", "Post timestamps held in the rate-limit window", lambda: sum_states(lambda s: s.post_limiter.stats()["timestamps"]))
+METRICS.gauge("outbound_queued", "Sends waiting for an outbound rate-limit token", lambda: sum_states(lambda s: s.outbound_limiter.stats()["queued"]))
+METRICS.gauge("outbox_jobs", "Outbox jobs by status", lambda: merge_states(lambda s: s.outbox.stats()), ("status",))
+METRICS.gauge("startup_seconds", "Cold start time per phase", lambda: {(k,): v for k, v in STARTUP.phases.items()}, ("phase",))
+METRICS.gauge("bots", "Bots running in this process", lambda: len(BOTS))
+
+
+# 指标：GET /metrics（Prometheus 文本格式）
+def metrics_endpoint():
+    return 200, "text/plain; version=0.0.4; charset=utf-8", METRICS.render()
+
+
+# 格式化一个直方图序列的 p50 / p95 / p99（毫秒）
+def format_latency(histogram, *labels):
+    p50, p95, p99 = (histogram.quantile(q, *labels) * 1000 for q in (0.5, 0.95, 0.99))
+    return f"n={histogram.count(*labels)} p50={p50:.0f} p95={p95:.0f} p99={p99:.0f} ms"
+
+
+# 查看运行统计：/stats（处理函数与 Bot API 调用耗时分位数、重试 / 失败次数、缓存大小）
+# 耗时与发送统计按进程汇总（多机器人模式下包含所有机器人），缓存与通知为当前机器人
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    state = get_state(context)
+    if str(update.effective_user.id) != str(state.admin_id): return
+    text = "<b>📊 运行统计</b>\n\n<b>处理耗时</b>\n"
+    for labels in HANDLER_LATENCY.series():
+        text += f"<code>{html.escape(labels[0])}</code> {format_latency(HANDLER_LATENCY, *labels)}\n"
+    text += "\n<b>Bot API 耗时（每次尝试）</b>\n"
+    for labels in SEND_LATENCY.series():
+        method = labels[0]
+        failures = SEND_FAILURES.value(method, "terminal") + SEND_FAILURES.value(method, "exhausted")
+        text += (
+            f"<code>{html.escape(method)}</code> {format_latency(SEND_LATENCY, *labels)}"
+            f" 重试={SEND_RETRIES.value(method)} 失败={failures}\n"
+        )
+    if MEDIA_GROUP_SIZE.count():
+        text += f"\n<b>媒体组</b>\n平均条数 {MEDIA_GROUP_SIZE.mean():.1f}，等待 {format_latency(MEDIA_GROUP_WAIT)}\n"
+    text += (
+        f"\n收集中媒体组：{count_media_groups(state)}（超出上限提前转发 {state.media_group_stats['overflow']} 个）\n"
+        f"限流跟踪用户：{state.post_limiter.stats()['users']}\n"
+        f"待通知发送失败：{state.error_notifier.pending()}（通知间隔 {state.error_notifier.stats()['delay']:.0f} 秒）\n"
+        + (f"本进程机器人数：{len(BOTS)}\n" if len(BOTS) > 1 else "")
+        + f"启动耗时：{STARTUP.report()}"
+    )
+    await update.message.reply_text(text, parse_mode=ParseMode.HTML)
+
+
+# 启动本地状态服务（配置中启用时；多机器人模式下只启动一次）
+async def start_status_server():
+    global STATUS_SERVER
+    if STATUS_SERVER is not None or not STATUS_SERVER_CFG.get("enabled"):
+        return
+    STATUS_SERVER = StatusServer(STATUS_SERVER_CFG.get("listen", "127.0.0.1"), STATUS_SERVER_CFG.get("port", 8080))
+    STATUS_SERVER.route(STATUS_SERVER_CFG.get("health_path", "/healthz"), health_check)
+    STATUS_SERVER.route(STATUS_SERVER_CFG.get("metrics_path", "/metrics"), metrics_endpoint)
+    try:
+        await STATUS_SERVER.start()
+    except OSError as e:
+        logging.error(f"⚠️ 状态服务启动失败: {e}")
+        STATUS_SERVER = None
+
+
+# post_init 钩子：启动状态服务 + 恢复并启动发送队列 + 恢复检查点
+# 命令菜单、去重指纹载入等非必要任务交给 warm_up()，不推迟开始接收更新
+async def on_startup(application: Application):
+    state = application.bot_data["state"]
+    await start_status_server()
+    # 共享模式下其他进程的任务可能正在执行，不能整体重置；已退出进程的任务在租约到期后由任一进程接手
+    if state.shared is None:
+        recovered = state.outbox.recover()
+        if recovered:
+            logging.info(f"✅ 已恢复 {recovered} 个上次未完成的转发任务")
+    state.outbox.run_workers(partial(deliver_forward, state, application.bot), concurrency=max(1, state.outbox_workers))
+    restore_checkpoint(application)
+    # job_queue 在开始轮询（或 webhook 开始监听）之后才启动，warm_up 因此在其后执行（启动请求较慢时也不会被丢弃）
+    application.job_queue.run_once(warm_up, when=0, name="warm_up", job_kwargs=RUN_LATE)
+    STARTUP.mark("post_init")
+
+
+# 启动预热：开始接收更新后再发布命令菜单、载入去重指纹，完成后输出启动耗时
+async def warm_up(context: ContextTypes.DEFAULT_TYPE):
+    STARTUP.mark("polling")
+    await setup_commands(context.application)
+    loaded = get_state(context).duplicates.load()
+    if loaded:
+        logging.info(f"✅ 已载入 {loaded} 条去重指纹")
+    STARTUP.mark("warm_up")
+    logging.info(f"✅ 启动完成，{STARTUP.report()}")
+
+
+# post_stop 钩子：停止发送队列（在 shutdown() 关闭 HTTP 连接之前，避免工作协程用已关闭的连接发送）
+async def on_stop(application: Application):
+    # 未完成的转发任务保留在数据库中，下次启动时继续执行
+    await application.bot_data["state"].outbox.stop_workers()
+
+
+# post_shutdown 钩子：保存检查点，写出所有尚未落盘的配置 / 黑名单修改
+# 状态服务在最后一个机器人停止时关闭
+async def on_shutdown(application: Application):
+    global STATUS_SERVER
+    state = application.bot_data["state"]
+    # 未成功启动（没有执行 post_stop）时在这里停止发送队列
+    await state.outbox.stop_workers()
+    save_checkpoint(state)
+    if STATUS_SERVER and not any(s.application.running for s in BOTS.values()):
+        await STATUS_SERVER.stop()
+        STATUS_SERVER = None
+    await state.storage.close()
+    if state.shared:
+        state.shared.close()
+
+
+# 注册所有消息 / 指令处理器和定时任务（main() 与 benchmark.py 共用），并把机器人状态绑定到 application
+def register_handlers(application: Application, state: BotState):
+    application.bot_data["state"] = state
+    state.application = application
+    BOTS[application.bot.token] = state
+    register_bot(application.bot, state.admin_id, state.outbound_limiter, state.error_notifier)
+    admin_id = int(state.admin_id)
 
     # 📥 投稿处理（用户发送消息）
     application.add_handler(
         MessageHandler(
-            filters.ALL & ~filters.COMMAND & ~filters.User(user_id=int(ADMIN_ID)),  # 忽略管理员的普通消息
+            filters.ALL & ~filters.COMMAND & ~filters.User(user_id=admin_id),  # 忽略管理员的普通消息
             handle_post
         )
     )
@@ -851,7 +1592,7 @@ def main():
     # 📩 管理员回复投稿用户（必须是回复文字）
     application.add_handler(
         MessageHandler(
-            filters.REPLY & filters.TEXT & filters.User(user_id=int(ADMIN_ID)),
+            filters.REPLY & filters.TEXT & ~filters.COMMAND & filters.User(user_id=admin_id),
             handle_admin_reply
         )
     )
@@ -860,13 +1601,16 @@ def main():
     application.add_handler(CommandHandler("start", start_command))
     
     #注册管理员图片监听器
-    application.add_handler(MessageHandler(filters.PHOTO & filters.User(user_id=int(ADMIN_ID)), handle_admin_image))
+    application.add_handler(MessageHandler(filters.PHOTO & filters.User(user_id=admin_id), handle_admin_image))
 
     # 🛠 管理指令注册
     application.add_handler(CommandHandler("ban", ban_user))
     application.add_handler(CommandHandler("unban", unban_user))
     application.add_handler(CommandHandler("banned", list_banned))
+    application.add_handler(CallbackQueryHandler(banned_page_callback, pattern=r"^banned\|"))
     application.add_handler(CommandHandler("limit", toggle_limit))
+    application.add_handler(CommandHandler("dedup", dedup_command))
+    application.add_handler(CommandHandler("stats", stats_command))
     application.add_handler(CommandHandler("setwelcome", set_welcome))
     application.add_handler(CommandHandler("setwelcomeimg", start_set_welcome_image))
     application.add_handler(CommandHandler("clearwelcomeimg", clear_welcome_image))
@@ -884,8 +1628,116 @@ def main():
     application.add_handler(CommandHandler("delbutton", del_button))
     application.add_handler(CommandHandler("editbutton", edit_button))
 
-    # 🚀 启动 bot（使用 long polling 方式，一直等待消息）
-    application.run_polling()
+    # ⏰ 定时清理已过期的禁言记录
+    application.job_queue.run_repeating(purge_expired_bans, interval=BAN_PURGE_INTERVAL, first=BAN_PURGE_INTERVAL)
+    # 🗑 定时清理发送队列中过期的已完成任务
+    application.job_queue.run_repeating(purge_outbox, interval=OUTBOX_PURGE_INTERVAL, first=OUTBOX_PURGE_INTERVAL)
+    # 🧹 定时清理投稿限制中的空闲用户
+    application.job_queue.run_repeating(evict_idle_limits, interval=LIMIT_EVICT_INTERVAL, first=LIMIT_EVICT_INTERVAL)
+    # 🔄 定时检查配置文件是否被手动修改
+    application.job_queue.run_repeating(reload_config, interval=CONFIG_WATCH_INTERVAL, first=CONFIG_WATCH_INTERVAL)
+    # 📦 共享模式下接手已超时但无人转发的媒体组
+    if state.shared:
+        application.job_queue.run_repeating(sweep_shared_media_groups, interval=MEDIA_GROUP_SWEEP_INTERVAL, first=MEDIA_GROUP_SWEEP_INTERVAL)
+
+
+# 读取配置，为每个机器人创建运行状态（存储后端、数据库连接、限流器等；导入本模块不读写任何文件）
+# config.json 中有 "bots"（机器人目录列表）时为多机器人模式：每个目录下各自有 config.json、blacklist.json、数据库和图片
+# 否则为单机器人模式，config.json 所在目录即机器人目录
+def init(config_path=CONFIG_PATH):
+    global STATUS_SERVER_CFG, HTTP_POOL_SIZE
+    config = load_json(config_path)
+    STATUS_SERVER_CFG = config.get("status_server", STATUS_SERVER_CFG)
+    HTTP_POOL_SIZE = config.get("http_pool_size", HTTP_POOL_SIZE)
+    base_dir = os.path.dirname(config_path)
+    if "bots" not in config:
+        return [BotState(base_dir, os.path.basename(config_path), config, timer=STARTUP)]
+    states = [BotState(os.path.join(base_dir, bot_dir), timer=STARTUP) for bot_dir in config["bots"]]
+    if len({state.token for state in states}) != len(states):
+        raise ConfigError("bots 中有重复的机器人 token")
+    return states
+
+
+# 创建一个机器人的 application（传入 token，启用按用户串行的并发更新处理），注册处理器与启动 / 停止钩子
+# 多机器人模式下传入共用的连接池：pool 用于 Bot API 请求，updates_pool 用于长轮询 getUpdates
+def build_application(state, pool=None, updates_pool=None):
+    builder = (
+        Application.builder()
+        .token(state.token)
+        .concurrent_updates(KeyedUpdateProcessor(max(1, state.concurrent_updates)))
+    )
+    if pool is not None:
+        builder = builder.request(pool.request()).get_updates_request(updates_pool.request())
+    application = builder.build()
+    # 设置 post_init 钩子函数（事件循环准备好后自动执行）
+    application.post_init = on_startup
+    # 设置 post_stop 钩子函数（停止接收更新后、关闭连接前停止发送队列）
+    application.post_stop = on_stop
+    # 设置 post_shutdown 钩子函数（退出前把待保存的数据写入磁盘）
+    application.post_shutdown = on_shutdown
+    register_handlers(application, state)
+    return application
+
+
+# webhook 模式参数：本地监听端口，由 Telegram（或反向代理）推送更新
+# 未配置 secret_token 时每次启动随机生成，Telegram 推送时会在请求头携带，用于校验来源
+def webhook_kwargs(state):
+    cfg = state.webhook_cfg
+    return dict(
+        listen=cfg.get("listen", "127.0.0.1"),
+        port=cfg.get("port", 8443),
+        url_path=cfg.get("url_path", "telegram"),
+        webhook_url=cfg.get("url"),
+        secret_token=cfg.get("secret_token") or secrets.token_urlsafe(32),
+        allowed_updates=Update.ALL_TYPES
+    )
+
+
+# 多机器人模式：按各自配置开始长轮询或 webhook 监听（每个 webhook 机器人需要配置不同的端口）
+async def start_updater(application: Application):
+    state = application.bot_data["state"]
+    if state.run_mode == "webhook":
+        await application.updater.start_webhook(**webhook_kwargs(state))
+    else:
+        await application.updater.start_polling()
+
+
+# 多机器人模式：在同一事件循环中运行所有机器人，全部停止后关闭共用的连接池
+async def run_bots(applications, pools):
+    try:
+        await run_applications(applications, start_updater)
+    finally:
+        for pool in pools:
+            await pool.close()
+
+
+# 主函数：注册处理器并启动 bot（polling 或 webhook 模式；配置了多个机器人时在同一进程中运行）
+def main():
+    # 初始化日志输出格式
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+    states = init()
+
+    if len(states) > 1:
+        # 🤖 多机器人模式：共用事件循环与 HTTP 连接池
+        pool = SharedConnectionPool(HTTP_POOL_SIZE or max(8, 4 * len(states)))
+        updates_pool = SharedConnectionPool(len(states))
+        applications = [build_application(state, pool, updates_pool) for state in states]
+        STARTUP.mark("build")
+        asyncio.run(run_bots(applications, (pool, updates_pool)))
+        return
+
+    state = states[0]
+    application = build_application(state)
+    STARTUP.mark("build")
+    if state.run_mode == "webhook":
+        # 🌐 webhook 模式
+        application.run_webhook(**webhook_kwargs(state))
+    else:
+        # 🚀 启动 bot（使用 long polling 方式，一直等待消息）
+        application.run_polling()
+
+
+STARTUP.mark("imports")
 
 
 # 启动入口：如果是主文件运行，就执行 main()
@@ -0,0 +1,132 @@
+# ✅ media_group_buffer.py
+# --- 收集中的媒体组缓存 ---
+# 媒体组要等全部消息到达后才整组转发，收集期间只保存转发与去重所需的字段（紧凑的 __slots__ 记录），
+# 不保留完整的 Message 对象（所有尺寸的图片、用户、聊天、回复等），大量媒体组同时收集时内存占用小一个数量级。
+# 缓存的媒体组数与消息总数都有上限，超出时最早开始收集的媒体组提前转发，不丢弃投稿。
+
+# 可以放进 sendMediaGroup 转发的媒体类型
+MEDIA_KINDS = ("photo", "video", "document")
+
+
+class MediaItem:
+    """
+    媒体组中的一条消息：
+    - kind / file_id: 媒体类型与 file_id（图片只保留最大尺寸），不支持转发的类型（如音频）kind 为 None
+    - file_unique_id: 计算去重指纹用
+    - caption: 用户附加的说明文字（没有时为 None），转发时与投稿人信息一起按 Markdown 发送，与单条投稿相同
+    """
+
+    __slots__ = ("message_id", "kind", "file_id", "file_unique_id", "caption")
+
+    def __init__(self, message_id, kind, file_id, file_unique_id, caption=None):
+        self.message_id = message_id
+        self.kind = kind
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+        self.caption = caption
+
+    @classmethod
+    def from_message(cls, message):
+        caption = message.caption or None
+        for kind in MEDIA_KINDS:
+            media = getattr(message, kind)
+            if media:
+                if kind == "photo":
+                    media = media[-1]
+                return cls(message.message_id, kind, media.file_id, media.file_unique_id, caption)
+        attachment = message.effective_attachment
+        if isinstance(attachment, (list, tuple)):
+            attachment = attachment[-1] if attachment else None
+        return cls(message.message_id, None, None, getattr(attachment, "file_unique_id", None), caption)
+
+    # 转为可 JSON 序列化的字典（重启检查点、共享状态用）
+    def to_dict(self):
+        data = {"message_id": self.message_id, "kind": self.kind, "file_id": self.file_id, "file_unique_id": self.file_unique_id}
+        if self.caption:
+            data["caption"] = self.caption
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data["message_id"], data["kind"], data["file_id"], data["file_unique_id"], data.get("caption"))
+
+
+class MediaGroup:
+    """
+    一个收集中的媒体组：
+    - items: 已收到的 MediaItem（按到达顺序）
+    - user_id / chat_id / caption_info: 投稿用户、所在聊天、转发时附加的用户信息
+    - first_at / due / job / late: 第一条到达时间、预定转发时间、转发任务、是否为迟到被拆分的部分
+    """
+
+    __slots__ = ("items", "user_id", "chat_id", "caption_info", "first_at", "due", "job", "late")
+
+    def __init__(self, user_id, chat_id, caption_info, first_at, late=False):
+        self.items = []
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.caption_info = caption_info
+        self.first_at = first_at
+        self.due = None
+        self.job = None
+        self.late = late
+
+
+class MediaGroupBuffer:
+    """
+    收集中的媒体组，按开始收集的顺序保存：
+    - get() / pop() / in / len() / 遍历 / items() 与字典相同，item_count 为缓存的消息总数
+    - add_group() / add_item(): 加入新的媒体组 / 追加一条消息，超出 max_groups 或 max_items 时
+      按开始收集的顺序取出其他媒体组，返回 [(group_id, MediaGroup)] 交给调用方立即转发
+    """
+
+    def __init__(self, max_groups=1000, max_items=5000):
+        self.max_groups = max_groups
+        self.max_items = max_items
+        self._groups = {}  # {group_id: MediaGroup}，字典保持插入顺序，最早开始收集的在前
+        self.item_count = 0
+
+    def __len__(self):
+        return len(self._groups)
+
+    def __contains__(self, group_id):
+        return group_id in self._groups
+
+    def __iter__(self):
+        return iter(self._groups)
+
+    def get(self, group_id, default=None):
+        return self._groups.get(group_id, default)
+
+    def items(self):
+        return self._groups.items()
+
+    def pop(self, group_id, default=None):
+        group = self._groups.pop(group_id, None)
+        if group is None:
+            return default
+        self.item_count -= len(group.items)
+        return group
+
+    # 加入新的媒体组（也用于从检查点恢复，此时 group.items 已有内容）
+    def add_group(self, group_id, group):
+        evicted = []
+        while len(self._groups) >= self.max_groups:
+            oldest = next(iter(self._groups))
+            evicted.append((oldest, self.pop(oldest)))
+        self._groups[group_id] = group
+        self.item_count += len(group.items)
+        return evicted
+
+    # 向已有的媒体组追加一条消息（该媒体组本身不会被取出）
+    def add_item(self, group_id, item):
+        evicted = []
+        if self.item_count >= self.max_items:
+            for other in list(self._groups):
+                if self.item_count < self.max_items:
+                    break
+                if other != group_id:
+                    evicted.append((other, self.pop(other)))
+        self._groups[group_id].items.append(item)
+        self.item_count += 1
+        return evicted
@@ -0,0 +1,92 @@
+# ✅ message_index.py
+# --- 管理员聊天消息 ID → 投稿用户 ID 索引 ---
+# 每条转发到管理员聊天的消息（含媒体组的每一条、copy_message 的结果）都记录对应的投稿用户，
+# 管理员回复任意一条转发消息时直接按消息 ID 查找，不再从 caption 文本里解析 "ID:"。
+
+import time
+from collections import OrderedDict
+
+from outbox import open_database
+
+# 默认内存缓存条数
+DEFAULT_CAPACITY = 10000
+# 默认保留时间（秒）：超过后从数据库清理，管理员一般不会回复半年前的投稿
+DEFAULT_RETENTION = 180 * 24 * 3600
+
+
+class MessageIndex:
+    """
+    两级索引：
+    - 内存层：OrderedDict 实现的 LRU，最近转发 / 查询的消息直接命中
+    - 持久层：SQLite 表，进程重启后仍可查询
+    """
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.conn = open_database(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS message_index (
+                chat_id INTEGER NOT NULL,
+                message_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (chat_id, message_id)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_message_index_created ON message_index(created_at);
+        """)
+        self._lru = OrderedDict()  # {(chat_id, message_id): user_id}
+        self.memory_hits = 0  # 内存层命中次数
+        self.db_hits = 0  # 持久层命中次数
+        self.misses = 0  # 未找到次数
+
+    def _remember(self, key, user_id):
+        self._lru[key] = user_id
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.capacity:
+            self._lru.popitem(last=False)
+
+    # 记录一组转发消息对应的投稿用户
+    def record(self, chat_id, message_ids, user_id):
+        now = time.time()
+        chat_id, user_id = int(chat_id), int(user_id)
+        rows = [(chat_id, int(message_id), user_id, now) for message_id in message_ids]
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO message_index (chat_id, message_id, user_id, created_at) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        for _, message_id, _, _ in rows:
+            self._remember((chat_id, message_id), user_id)
+
+    # 查找转发消息对应的投稿用户 ID，找不到返回 None
+    def lookup(self, chat_id, message_id):
+        key = (int(chat_id), int(message_id))
+        user_id = self._lru.get(key)
+        if user_id is not None:
+            self._lru.move_to_end(key)
+            self.memory_hits += 1
+            return user_id
+        row = self.conn.execute(
+            "SELECT user_id FROM message_index WHERE chat_id = ? AND message_id = ?", key
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.db_hits += 1
+        self._remember(key, row[0])
+        return row[0]
+
+    # 清理超过保留时间的记录
+    def purge(self, retention=DEFAULT_RETENTION):
+        cur = self.conn.execute("DELETE FROM message_index WHERE created_at < ?", (time.time() - retention,))
+        return cur.rowcount
+
+    def stats(self):
+        return {
+            "cached": len(self._lru),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+        }
+
+    def close(self):
+        self.conn.close()
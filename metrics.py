@@ -0,0 +1,256 @@
+# ✅ metrics.py
+# --- 运行指标：计数器 / 即时值 / 延迟直方图 ---
+# 各模块在 METRICS 上登记指标并在运行中记录，状态服务的 /metrics 输出 Prometheus 文本格式，
+# 管理员 /stats 指令按直方图估算 p50 / p95 / p99。
+
+import functools
+import logging
+import time
+
+# 默认延迟分桶（秒），覆盖从本地处理到慢速上传
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    只增不减的计数器，按标签值分别计数：
+    - inc(*labels, amount=1)
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self._values = {}  # {标签值元组: 计数}
+
+    def inc(self, *labels, amount=1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def reset(self):
+        self._values.clear()
+
+    def samples(self):
+        for labels, value in sorted(self._values.items()):
+            yield self.name, _format_labels(self.labels, labels), value
+
+
+class Gauge:
+    """
+    即时值：读取时调用 func()，用于缓存大小、队列长度等随时变化的数值
+    func 返回数字，或 {标签值元组: 数字}（带标签时）
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, func, labels=()):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.labels = tuple(labels)
+
+    def reset(self):
+        pass
+
+    def samples(self):
+        value = self.func()
+        if isinstance(value, dict):
+            for labels, v in sorted(value.items()):
+                yield self.name, _format_labels(self.labels, labels), v
+        else:
+            yield self.name, "", value
+
+
+class Histogram:
+    """
+    固定分桶的直方图（与 Prometheus histogram 相同的累计分桶）：
+    - observe(value, *labels)
+    - quantile(q, *labels): 在所在分桶内线性插值估算分位数
+    内存占用只和分桶数、标签组合数有关，不保存原始样本
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # {标签值元组: [各分桶计数..., +Inf 计数, 总和]}
+
+    def observe(self, value, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def mean(self, *labels):
+        count = self.count(*labels)
+        return self._series[labels][-1] / count if count else None
+
+    def series(self):
+        return sorted(self._series)
+
+    def reset(self):
+        self._series.clear()
+
+    def quantile(self, q, *labels):
+        series = self._series.get(labels)
+        if not series:
+            return None
+        counts = series[:-1]
+        total = sum(counts)
+        if not total:
+            return None
+        rank = q * total
+        seen = 0
+        lower = 0.0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                if i == len(self.buckets):
+                    # 落在最大分桶之外，只能返回最大分桶上限
+                    return self.buckets[-1]
+                upper = self.buckets[i]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+            if i < len(self.buckets):
+                lower = self.buckets[i]
+        return self.buckets[-1]
+
+    def samples(self):
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                yield self.name + "_bucket", _format_labels(self.labels, labels, ("le", _format_value(bound))), cumulative
+            yield self.name + "_sum", _format_labels(self.labels, labels), series[-1]
+            yield self.name + "_count", _format_labels(self.labels, labels), cumulative
+
+
+class Registry:
+    """
+    指标登记表：
+    - counter() / gauge() / histogram(): 登记指标（同名重复登记返回已有指标）
+    - render(): 输出 Prometheus 文本格式
+    - reset(): 清零所有计数器和直方图（基准测试分场景统计时使用）
+    """
+
+    def __init__(self, prefix="imneko_"):
+        self.prefix = prefix
+        self._metrics = {}
+
+    def _register(self, cls, name, *args, **kwargs):
+        name = self.prefix + name
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._register(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, func, labels=()):
+        return self._register(Gauge, name, help_text, func, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help_text, labels, buckets)
+
+    def reset(self):
+        for metric in self._metrics.values():
+            metric.reset()
+
+    def render(self):
+        lines = []
+        for name, metric in self._metrics.items():
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                logging.error(f"读取指标 {name} 失败: {e}")
+                continue
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(f"{sample}{labels} {_format_value(value)}" for sample, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+class PhaseTimer:
+    """
+    分阶段计时（启动耗时分析）：
+    - mark(phase): 记录从上一次 mark（或创建时）到现在的耗时，同名阶段累加
+    - total(): 第一次创建到最后一次 mark 的总耗时
+    - report(): 各阶段耗时与占比文字
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started = clock()
+        self._last = self.started
+        self.phases = {}  # {阶段名: 秒}，按首次记录顺序
+
+    def mark(self, phase):
+        now = self.clock()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def total(self):
+        return self._last - self.started
+
+    def report(self):
+        total = self.total()
+        parts = [f"{phase} {seconds * 1000:.0f}ms" + (f"（{seconds / total:.0%}）" if total else "") for phase, seconds in self.phases.items()]
+        return f"总计 {total * 1000:.0f}ms：" + "，".join(parts)
+
+
+# 全局指标登记表
+METRICS = Registry()
+
+# 处理函数耗时（handle_post、process_media_group 等）
+HANDLER_LATENCY = METRICS.histogram("handler_seconds", "Handler latency in seconds", ("handler",))
+HANDLER_ERRORS = METRICS.counter("handler_errors_total", "Handler calls that raised", ("handler",))
+
+
+# 装饰器：记录协程处理函数的耗时与异常次数
+def timed_handler(name):
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(name)
+                raise
+            finally:
+                HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+        return wrapper
+    return decorator
@@ -0,0 +1,105 @@
+# ✅ multi_bot.py
+# --- 同一进程运行多个机器人 ---
+# 所有机器人共用一个事件循环和 HTTP 连接池（Bot API 请求一个池，长轮询 getUpdates 另一个池，
+# 避免长轮询占满连接导致发送排队），每个机器人仍是独立的 Application。
+
+import asyncio
+import logging
+import signal
+
+import httpx
+from telegram.request import HTTPXRequest
+
+
+class SharedConnectionPool:
+    """
+    多个机器人共用的 httpx 连接池：
+    - request(): 为一个机器人创建使用本连接池的请求对象
+    - 机器人停止时不关闭连接池，全部停止后由 close() 统一关闭
+    """
+
+    def __init__(self, size, timeout=5.0, pool_timeout=5.0):
+        self.size = size
+        self._kwargs = {
+            "timeout": httpx.Timeout(timeout, pool=pool_timeout),
+            "limits": httpx.Limits(max_connections=size, max_keepalive_connections=size),
+        }
+        self._client = None
+
+    def client(self):
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(**self._kwargs)
+        return self._client
+
+    def request(self):
+        return SharedHTTPXRequest(self)
+
+    async def close(self):
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+
+
+class SharedHTTPXRequest(HTTPXRequest):
+    __slots__ = ("_pool",)
+
+    def __init__(self, pool):
+        self._pool = pool
+        super().__init__(connection_pool_size=pool.size)
+
+    def _build_client(self):
+        return self._pool.client()
+
+    # 连接池由 SharedConnectionPool.close() 关闭，单个机器人停止时不关闭
+    async def shutdown(self):
+        pass
+
+
+# 依次启动所有机器人并运行到收到 SIGINT / SIGTERM，再按相反顺序停止
+# 启动顺序与 Application.run_polling() 相同：initialize → post_init → 开始接收更新 → start
+# 停止顺序也相同：停止接收更新 → stop → post_stop → shutdown → post_shutdown
+# 某个机器人启动失败（如 token 无效）时记录错误并跳过，不影响其他机器人
+async def run_applications(applications, start_updater):
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            pass  # Windows 不支持，依靠 KeyboardInterrupt 退出
+    started = []  # 已执行 post_init 的机器人，停止时需要执行 post_shutdown
+    try:
+        for application in applications:
+            try:
+                await application.initialize()
+                if application.post_init:
+                    await application.post_init(application)
+                started.append(application)
+                await start_updater(application)
+                await application.start()
+            except Exception as e:
+                logging.error(f"❌ 机器人 {application.bot.token.split(':')[0]} 启动失败: {e}")
+                await _stop_application(application)
+        if not any(application.running for application in started):
+            logging.error("❌ 没有成功启动的机器人")
+            return
+        logging.info(f"✅ 已启动 {sum(application.running for application in started)} 个机器人")
+        await stop.wait()
+    finally:
+        for application in reversed(started):
+            try:
+                await _stop_application(application)
+                if application.post_shutdown:
+                    await application.post_shutdown(application)
+            except Exception as e:
+                logging.error(f"❌ 机器人 {application.bot.token.split(':')[0]} 停止失败: {e}")
+
+
+async def _stop_application(application):
+    if application.updater and application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+        # 与 run_polling() 相同，只有执行过 stop() 才调用 post_stop
+        if application.post_stop:
+            await application.post_stop(application)
+    await application.shutdown()
@@ -0,0 +1,132 @@
+# ✅ outbound_limiter.py
+# --- 出站消息限流模块（全局 + 每个聊天的令牌桶）---
+# Telegram 对机器人有全局约 30 条/秒、单个聊天约 1 条/秒的发送限制，
+# 超出后返回 RetryAfter。在发送前主动排队，比触发限流后再重试更快也更稳定。
+
+import asyncio
+import time
+
+# 每处理多少次 acquire 清理一次空闲的聊天令牌桶
+CLEANUP_EVERY = 1000
+
+
+class TokenBucket:
+    """
+    令牌桶：以 rate 个/秒的速度补充令牌，最多积攒 capacity 个
+    """
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    # 距离可以取出 cost 个令牌还需等待的秒数（0 表示立即可用）
+    def delay_for(self, cost, now):
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, cost, now):
+        self._refill(now)
+        self.tokens -= cost
+
+    # 令牌已满说明近期没有发送，可以安全回收
+    def is_idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class OutboundLimiter:
+    """
+    出站限流器：
+    - 每个目标聊天一个令牌桶，同一聊天的发送按到达顺序排队（asyncio.Lock 先进先出）
+    - 拿到聊天令牌后再按到达顺序排队获取全局令牌，某个聊天积压不会阻塞其他聊天
+    - clock / sleep 可替换为虚拟时钟，便于脱离真实时间测试
+    - stats(): 排队等待时间统计
+    """
+
+    def __init__(self, global_rate=30, global_burst=30, chat_rate=1, chat_burst=3, clock=time.monotonic, sleep=asyncio.sleep):
+        self.clock = clock
+        self.sleep = sleep
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_burst, clock())
+        self._global_lock = asyncio.Lock()
+        self._chats = {}  # {chat_id: TokenBucket}
+        self._chat_locks = {}  # {chat_id: [asyncio.Lock, 排队数]}
+        self._since_cleanup = 0
+        # 统计数据
+        self.acquired = 0  # 累计放行次数
+        self.delayed = 0  # 需要排队等待的次数
+        self.total_wait = 0.0  # 累计等待秒数
+        self.max_wait = 0.0  # 单次最长等待秒数
+
+    # 在令牌桶上等待直到可以取出 cost 个令牌
+    async def _wait_bucket(self, bucket, cost):
+        cost = min(cost, bucket.capacity)
+        while True:
+            delay = bucket.delay_for(cost, self.clock())
+            if delay <= 0:
+                bucket.consume(cost, self.clock())
+                return
+            await self.sleep(delay)
+
+    # 发送前调用：等待目标聊天和全局都有可用令牌
+    # cost: 本次发送消耗的令牌数（如媒体组按条数计算）
+    async def acquire(self, chat_id=None, cost=1):
+        started = self.clock()
+        if chat_id is not None:
+            key = str(chat_id)
+            entry = self._chat_locks.get(key)
+            if entry is None:
+                entry = self._chat_locks[key] = [asyncio.Lock(), 0]
+            entry[1] += 1
+            try:
+                async with entry[0]:
+                    bucket = self._chats.get(key)
+                    if bucket is None:
+                        bucket = self._chats[key] = TokenBucket(self.chat_rate, self.chat_burst, self.clock())
+                    await self._wait_bucket(bucket, cost)
+            finally:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    self._chat_locks.pop(key, None)
+        async with self._global_lock:
+            await self._wait_bucket(self._global, cost)
+        waited = self.clock() - started
+        self.acquired += 1
+        if waited > 0:
+            self.delayed += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+        self._since_cleanup += 1
+        if self._since_cleanup >= CLEANUP_EVERY:
+            self._since_cleanup = 0
+            self.cleanup()
+
+    # 回收令牌已满、且没有发送在排队的聊天令牌桶
+    def cleanup(self):
+        now = self.clock()
+        idle = [key for key, bucket in self._chats.items() if key not in self._chat_locks and bucket.is_idle(now)]
+        for key in idle:
+            del self._chats[key]
+        return len(idle)
+
+    def stats(self):
+        return {
+            "acquired": self.acquired,
+            "delayed": self.delayed,
+            "total_wait": self.total_wait,
+            "max_wait": self.max_wait,
+            "avg_wait": self.total_wait / self.delayed if self.delayed else 0.0,
+            "chats": len(self._chats),
+            "queued": sum(entry[1] for entry in self._chat_locks.values()),
+        }
@@ -0,0 +1,191 @@
+# ✅ outbox.py
+# --- 持久化发送队列（SQLite WAL）---
+# 投稿在真正转发给管理员之前先写入本地数据库，进程重启后未完成的转发会被重新执行，
+# 保证投稿“至少送达一次”；幂等键防止同一条投稿被重复入队。
+
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+
+# 已完成 / 已失败任务的保留时间（秒），用于幂等去重和排查问题
+KEEP_FINISHED = 7 * 24 * 3600
+# 单个任务的租约时长（秒），超时未完成的任务视为执行者已退出，可被重新领取
+LEASE_SECONDS = 600
+
+
+# 打开 SQLite 数据库并启用 WAL 模式（读写互不阻塞，多个模块可共用同一个文件）
+def open_database(path):
+    conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+class Outbox:
+    """
+    持久化发送队列：
+    - enqueue(): 写入一条任务（单次本地写入），幂等键重复时忽略
+    - claim() / complete() / retry() / fail(): 工作协程领取并回报任务结果
+    - recover(): 启动时把上次未完成的任务恢复为待执行
+    - run_workers(): 启动工作协程池，持续消费队列
+    """
+
+    def __init__(self, path):
+        self.conn = open_database(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idem_key TEXT NOT NULL UNIQUE,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_at REAL NOT NULL,
+                lease_until REAL,
+                created_at REAL NOT NULL,
+                finished_at REAL,
+                last_error TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_outbox_ready ON outbox(status, next_at);
+        """)
+        self._wakeup = asyncio.Event()
+        self._workers = []
+
+    # 写入任务，返回 False 表示幂等键已存在（重复投递的更新）
+    def enqueue(self, idem_key, kind, payload):
+        now = time.time()
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO outbox (idem_key, kind, payload, next_at, created_at) VALUES (?, ?, ?, ?, ?)",
+            (idem_key, kind, json.dumps(payload, ensure_ascii=False), now, now)
+        )
+        if cur.rowcount:
+            self._wakeup.set()
+            return True
+        return False
+
+    # 领取一个到期任务（pending 且已到执行时间，或租约已过期的 running）
+    def claim(self):
+        now = time.time()
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.conn.execute(
+                "SELECT * FROM outbox WHERE (status = 'pending' AND next_at <= ?) "
+                "OR (status = 'running' AND lease_until <= ?) ORDER BY id LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE outbox SET status = 'running', attempts = attempts + 1, lease_until = ? WHERE id = ?",
+                    (now + LEASE_SECONDS, row["id"])
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["attempts"] += 1
+        return job
+
+    def complete(self, job_id):
+        self.conn.execute(
+            "UPDATE outbox SET status = 'done', finished_at = ?, lease_until = NULL WHERE id = ?",
+            (time.time(), job_id)
+        )
+
+    # 稍后重试
+    def retry(self, job_id, delay, error=None):
+        self.conn.execute(
+            "UPDATE outbox SET status = 'pending', next_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+            (time.time() + delay, error, job_id)
+        )
+        self._wakeup.set()
+
+    def fail(self, job_id, error=None):
+        self.conn.execute(
+            "UPDATE outbox SET status = 'failed', finished_at = ?, lease_until = NULL, last_error = ? WHERE id = ?",
+            (time.time(), error, job_id)
+        )
+
+    # 启动时调用：上次进程退出时仍在执行的任务重新排队，返回恢复数量
+    def recover(self):
+        cur = self.conn.execute(
+            "UPDATE outbox SET status = 'pending', next_at = ?, lease_until = NULL WHERE status = 'running'",
+            (time.time(),)
+        )
+        return cur.rowcount
+
+    # 清理过期的已完成 / 已失败任务
+    def purge_finished(self, keep=KEEP_FINISHED):
+        cur = self.conn.execute(
+            "DELETE FROM outbox WHERE status IN ('done', 'failed') AND finished_at < ?",
+            (time.time() - keep,)
+        )
+        return cur.rowcount
+
+    # 距离下一个待执行任务到期的秒数，没有任务时返回 None
+    def next_delay(self):
+        row = self.conn.execute("SELECT MIN(next_at) FROM outbox WHERE status = 'pending'").fetchone()
+        if row[0] is None:
+            return None
+        return max(0.0, row[0] - time.time())
+
+    # 各状态任务数量
+    def stats(self):
+        rows = self.conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return {status: count for status, count in rows}
+
+    # 单个工作协程：循环领取任务交给 handler(job) 执行
+    # handler 返回 True 表示完成；返回数字表示若干秒后重试；返回 False / None 表示最终失败
+    async def _worker(self, handler):
+        while True:
+            try:
+                job = self.claim()
+            except sqlite3.Error as e:
+                logging.error(f"发送队列读取失败: {e}")
+                await asyncio.sleep(1)
+                continue
+            if job is None:
+                self._wakeup.clear()
+                delay = self.next_delay()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay if delay is not None else 60)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                outcome = await handler(job)
+            except asyncio.CancelledError:
+                # 关机时被取消：任务立即放回队列，下次启动（或其他进程）继续执行
+                self.retry(job["id"], 0, "已取消")
+                raise
+            except Exception as e:
+                logging.error(f"发送队列任务 {job['id']} 执行异常: {e}")
+                outcome = None
+            if outcome is True:
+                self.complete(job["id"])
+            elif isinstance(outcome, (int, float)) and not isinstance(outcome, bool):
+                self.retry(job["id"], outcome)
+            else:
+                self.fail(job["id"], "发送失败")
+
+    # 启动工作协程池
+    def run_workers(self, handler, concurrency=4):
+        for _ in range(concurrency):
+            self._workers.append(asyncio.create_task(self._worker(handler)))
+
+    # 停止所有工作协程
+    async def stop_workers(self):
+        workers, self._workers = self._workers, []
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+    def close(self):
+        self.conn.close()
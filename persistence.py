@@ -0,0 +1,115 @@
+# ✅ persistence.py
+# --- JSON 配置文件的后台落盘模块（config.json / blacklist.json）---
+
+import asyncio
+import copy
+import json
+import logging
+import os
+import tempfile
+
+# 合并写入窗口（秒）：窗口内对同一文件的多次修改只落盘一次
+SAVE_DELAY = 0.5
+
+
+# 原子写入 JSON 文件：
+# 先写入同目录下的临时文件并 fsync，再用 os.replace 覆盖原文件，
+# 进程在写入中途崩溃时原文件保持完整，不会出现被截断的 JSON
+def write_json_atomic(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # 同步目录项，确保 rename 本身也已落盘（部分平台不支持，忽略即可）
+    try:
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+    except OSError:
+        pass
+
+
+class JsonWriter:
+    """
+    写回式（write-behind）JSON 持久化：
+    - schedule(): 只记录“某文件需要保存”，立即返回，不阻塞事件循环
+    - 合并窗口内的多次修改只写一次，且总是写入最新数据
+    - 序列化、写文件、fsync 都在线程池中执行
+    - flush(): 立即写出所有待保存数据（关机时调用）
+    - is_pending(): 某文件是否还有尚未落盘的修改
+    """
+
+    def __init__(self, delay=SAVE_DELAY):
+        self.delay = delay
+        self._pending = {}  # {路径: 最新数据对象}
+        self._writing = set()  # 正在线程池中写入的路径
+        self._task = None  # 当前延迟写入任务
+        self._lock = asyncio.Lock()  # 保证同一时间只有一轮写入，避免新旧数据乱序落盘
+
+    # 标记文件待保存
+    def schedule(self, path, data):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # 没有运行中的事件循环（如启动阶段），直接同步原子写入
+            self._pending.pop(path, None)
+            write_json_atomic(path, data)
+            return
+        self._pending[path] = data
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._delayed_flush())
+
+    # 文件是否还有尚未落盘的修改（等待合并或正在写入）
+    def is_pending(self, path):
+        return path in self._pending or path in self._writing
+
+    async def _delayed_flush(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    # 立即写出所有待保存的数据
+    async def flush(self):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            failed = {}
+            while self._pending:
+                batch, self._pending = self._pending, {}
+                self._writing.update(batch)
+                for path, data in batch.items():
+                    # 在事件循环内做快照，避免线程池序列化时数据被并发修改
+                    snapshot = copy.deepcopy(data)
+                    try:
+                        await loop.run_in_executor(None, write_json_atomic, path, snapshot)
+                        self._writing.discard(path)
+                    except Exception as e:
+                        logging.error(f"保存 {path} 失败: {e}")
+                        failed[path] = data
+            # 写入失败的文件放回队列，下一次 schedule / flush 时重试
+            for path, data in failed.items():
+                self._pending.setdefault(path, data)
+            self._writing.clear()
+
+    # 关机时调用：取消延迟任务并写出剩余数据
+    async def close(self):
+        task, self._task = self._task, None
+        if task and not task.done():
+            # 还在等待合并窗口时直接取消；正在写入时等它写完，避免丢失已取出的数据
+            if not self._lock.locked():
+                task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
@@ -0,0 +1,80 @@
+# ✅ profile_cache.py
+# --- 用户资料缓存（昵称、用户名）---
+# 投稿时顺手记录 update.effective_user 的资料，禁言时优先读缓存，
+# 只有缓存中没有的用户才调用 get_chat，批量查询时限制并发数。
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 7 * 24 * 3600  # 默认缓存有效期（秒）
+DEFAULT_CAPACITY = 10000  # 默认最多缓存的用户数
+DEFAULT_CONCURRENCY = 8  # 批量查询时同时进行的 get_chat 请求数
+
+
+class ProfileCache:
+    """
+    有有效期、有容量上限的用户资料缓存：
+    - remember(): 记录用户资料（投稿、管理员回复等场景中免费获得）
+    - get(): 读取未过期的资料，返回 (昵称, 用户名) 或 None
+    - resolve(): 批量获取资料，缓存未命中的用户并发调用 get_chat（带并发上限）
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, capacity=DEFAULT_CAPACITY, clock=time.monotonic):
+        self.ttl = ttl
+        self.capacity = capacity
+        self.clock = clock
+        self._profiles = OrderedDict()  # {用户ID(str): (过期时间, 昵称, 用户名)}
+        self.hits = 0  # 缓存命中次数
+        self.misses = 0  # 缓存未命中次数
+        self.failures = 0  # get_chat 失败次数
+
+    def remember(self, user_id, full_name, username=None):
+        key = str(user_id)
+        self._profiles[key] = (self.clock() + self.ttl, full_name, username)
+        self._profiles.move_to_end(key)
+        while len(self._profiles) > self.capacity:
+            self._profiles.popitem(last=False)
+
+    def get(self, user_id):
+        key = str(user_id)
+        entry = self._profiles.get(key)
+        if entry is None:
+            return None
+        if entry[0] < self.clock():
+            self._profiles.pop(key, None)
+            return None
+        return entry[1], entry[2]
+
+    # 批量获取资料，返回 {用户ID(str): (昵称, 用户名) 或 None（获取失败）}
+    async def resolve(self, bot, user_ids, concurrency=DEFAULT_CONCURRENCY):
+        results = {}
+        missing = []
+        for key in dict.fromkeys(str(user_id) for user_id in user_ids):
+            profile = self.get(key)
+            if profile is None:
+                self.misses += 1
+                missing.append(key)
+            else:
+                self.hits += 1
+                results[key] = profile
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def fetch(key):
+            async with semaphore:
+                try:
+                    chat = await bot.get_chat(key)
+                except Exception as e:
+                    self.failures += 1
+                    logging.warning(f"获取用户 {key} 资料失败: {e}")
+                    return key, None
+            self.remember(key, chat.full_name, chat.username)
+            return key, (chat.full_name, chat.username)
+
+        for key, profile in await asyncio.gather(*(fetch(key) for key in missing)):
+            results[key] = profile
+        return results
+
+    def stats(self):
+        return {"cached": len(self._profiles), "hits": self.hits, "misses": self.misses, "failures": self.failures}
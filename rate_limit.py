@@ -0,0 +1,181 @@
+# ✅ rate_limit.py
+# --- 投稿频率限制模块（滑动窗口计数）---
+
+import time
+from collections import deque
+
+# 默认统计窗口：1 小时
+DEFAULT_WINDOW = 3600
+
+
+class SlidingWindowLimiter:
+    """
+    滑动窗口频率限制器：
+    - 每个（用户, 计数类别）一个 deque，只保存窗口内的投稿时间戳
+    - 检查时从队头弹出过期时间戳，均摊 O(1)；deque 长度不超过限额，内存有上限
+    - evict_idle(): 定期清理窗口内已无记录的用户，一次性投稿者不会永久占用内存
+    - snapshot() / restore(): 导出 / 恢复窗口内的记录，重启后计数不清零
+    - clock 可替换，便于用虚拟时钟测试
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW, clock=time.time):
+        self.window = window
+        self.clock = clock
+        self._buckets = {}  # {(user_id, 类别): deque[时间戳]}
+        self.allowed = 0  # 累计放行次数
+        self.denied = 0  # 累计拒绝次数
+        self.evicted = 0  # 累计清理的空闲计数桶
+
+    # 弹出窗口外的时间戳
+    def _prune(self, bucket, now):
+        cutoff = now - self.window
+        while bucket and bucket[0] <= cutoff:
+            bucket.popleft()
+
+    # 尝试记录一次投稿
+    # limits: {计数类别: 窗口内上限}，所有类别都未超限才记录
+    # 返回 (是否允许, 超限类别, 对应上限)
+    def hit(self, user_id, limits):
+        now = self.clock()
+        buckets = []
+        for kind, limit in limits.items():
+            key = (user_id, kind)
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = deque()
+            self._prune(bucket, now)
+            if len(bucket) >= limit:
+                self.denied += 1
+                return False, kind, limit
+            buckets.append(bucket)
+        for bucket in buckets:
+            bucket.append(now)
+        self.allowed += 1
+        return True, None, None
+
+    # 清理窗口内没有任何记录的计数桶，返回清理数量
+    def evict_idle(self):
+        now = self.clock()
+        idle = []
+        for key, bucket in self._buckets.items():
+            self._prune(bucket, now)
+            if not bucket:
+                idle.append(key)
+        for key in idle:
+            del self._buckets[key]
+        self.evicted += len(idle)
+        return len(idle)
+
+    # 清空所有计数（关闭限制时调用）
+    def clear(self):
+        self._buckets.clear()
+
+    # 导出窗口内的记录：[[user_id, 类别, [时间戳...]], ...]
+    def snapshot(self):
+        now = self.clock()
+        rows = []
+        for (user_id, kind), bucket in self._buckets.items():
+            self._prune(bucket, now)
+            if bucket:
+                rows.append([user_id, kind, list(bucket)])
+        return rows
+
+    # 恢复 snapshot() 导出的记录（已过期的时间戳直接丢弃），返回恢复的计数桶数量
+    def restore(self, rows):
+        now = self.clock()
+        restored = 0
+        for user_id, kind, timestamps in rows:
+            bucket = deque(sorted(timestamps))
+            self._prune(bucket, now)
+            if bucket:
+                self._buckets[(user_id, kind)] = bucket
+                restored += 1
+        return restored
+
+    # 当前状态统计，用于 /limit stats
+    def stats(self):
+        return {
+            "users": len({user_id for user_id, _ in self._buckets}),
+            "buckets": len(self._buckets),
+            "timestamps": sum(len(bucket) for bucket in self._buckets.values()),
+            "allowed": self.allowed,
+            "denied": self.denied,
+            "evicted": self.evicted,
+        }
+
+
+class SharedWindowLimiter:
+    """
+    多进程共享的频率限制器（接口与 SlidingWindowLimiter 相同，计数保存在 shared_state.py 的共享状态中）：
+    - 窗口分为 slots 段，每个（用户, 计数类别, 时间段）一个原子计数键，随窗口过期自动删除
+    - 统计最近 slots + 1 段（比窗口多出不到一段），只会比滑动窗口更严格，不会放过超限投稿
+    - 先原子加一再求和，超限时撤销本次已加的计数，多个进程同时投稿也不会绕过限制
+    - 计数本身已持久化在共享状态中，snapshot() / restore() 不需要保存任何内容
+    """
+
+    def __init__(self, shared, window=DEFAULT_WINDOW, slots=6, prefix="limit:"):
+        self.shared = shared
+        self.window = window
+        self.slots = slots
+        self.slot = window / slots  # 每段时长（秒）
+        self.prefix = prefix
+        self.allowed = 0  # 本进程累计放行次数
+        self.denied = 0  # 本进程累计拒绝次数
+        self.evicted = 0  # 本进程累计清理的过期键
+
+    def _key(self, user_id, kind, index):
+        return f"{self.prefix}{user_id}:{kind}:{index}"
+
+    # 尝试记录一次投稿，参数与返回值同 SlidingWindowLimiter.hit()
+    def hit(self, user_id, limits):
+        current = int(self.shared.clock() // self.slot)
+        taken = []
+        for kind, limit in limits.items():
+            key = self._key(user_id, kind, current)
+            count = self.shared.incr(key, 1, ttl=self.window + self.slot)
+            taken.append(key)
+            for index in range(current - self.slots, current):
+                count += self.shared.get(self._key(user_id, kind, index), 0)
+            if count > limit:
+                for key in taken:
+                    self.shared.incr(key, -1)
+                self.denied += 1
+                return False, kind, limit
+        self.allowed += 1
+        return True, None, None
+
+    # 计数键到期自动失效，这里只删除共享状态中已过期的键，返回删除数量
+    def evict_idle(self):
+        removed = self.shared.purge()
+        self.evicted += removed
+        return removed
+
+    # 清空所有计数（关闭限制时调用）
+    def clear(self):
+        for key in self.shared.keys(self.prefix):
+            self.shared.delete(key)
+
+    def snapshot(self):
+        return []
+
+    def restore(self, rows):
+        return 0
+
+    # 当前状态统计（所有进程合计的计数 + 本进程的放行 / 拒绝次数），用于 /limit stats
+    def stats(self):
+        buckets = set()
+        timestamps = 0
+        for key in self.shared.keys(self.prefix):
+            user_id, kind, _ = key[len(self.prefix):].rsplit(":", 2)
+            count = self.shared.get(key, 0)
+            if count > 0:
+                buckets.add((user_id, kind))
+                timestamps += count
+        return {
+            "users": len({user_id for user_id, _ in buckets}),
+            "buckets": len(buckets),
+            "timestamps": timestamps,
+            "allowed": self.allowed,
+            "denied": self.denied,
+            "evicted": self.evicted,
+        }
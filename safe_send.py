@@ -2,98 +2,394 @@
 # --- 用于 Telegram Bot 的安全消息发送模块 ---
 
 import asyncio
+import html
+import json
 import logging
+import os
+import random
+import time
 from telegram import InputFile
 from telegram.constants import ParseMode
+from telegram.error import (
+    BadRequest,
+    ChatMigrated,
+    Conflict,
+    EndPointNotFound,
+    Forbidden,
+    InvalidToken,
+    NetworkError,
+    RetryAfter,
+    TelegramError
+)
+from metrics import METRICS
 
 # ✅ 安全发送函数 safe_send
 # 用于替代 bot.send_message, bot.send_photo 等方法
 # 自动处理异常、重试，并在所有尝试失败后通知管理员和投稿用户
 
-# 全局错误通知缓冲区（用于聚合转发失败消息，防刷屏）
-ERROR_NOTIFY_BUFFER = []
-ERROR_NOTIFY_DELAY = 5  # 等待时间（秒）后批量通知
-ERROR_NOTIFY_TASK = None  # 当前通知任务引用（防重复调度）
+# 单条 Telegram 消息长度上限
+MESSAGE_LIMIT = 4096
+
+
+class ErrorNotifier:
+    """
+    管理员错误通知聚合器（防刷屏）：
+    - 同一发送函数 + 同一错误类型合并为一条，只记录次数、最近的错误内容和少量涉及用户
+    - 最多保留 max_entries 种错误，超出部分追加到磁盘溢出日志（超过 overflow_max_bytes 时轮转为 .1）
+    - 通知按条目边界拆分为多条不超过 4096 字符的 HTML 消息
+    - 故障持续时通知间隔指数增长（delay → max_delay），平稳一段时间后恢复；通知发送失败时保留条目稍后重试
+    - 每个事件循环各自调度通知任务
+    """
+
+    def __init__(self, delay=5, max_delay=300, max_entries=50, max_users=3,
+                 overflow_path="error_overflow.log", overflow_max_bytes=1024 * 1024):
+        self.base_delay = delay
+        self.max_delay = max_delay
+        self.max_entries = max_entries
+        self.max_users = max_users
+        self.overflow_path = overflow_path
+        self.overflow_max_bytes = overflow_max_bytes
+        self._entries = {}  # {(函数名, 错误类型): {"count", "first_at", "last_at", "error", "users"}}
+        self._delay = delay  # 当前通知间隔
+        self._last_sent_at = None  # 上次成功发送通知的时间（monotonic）
+        self._tasks = {}  # {事件循环: 通知任务}
+        self.overflowed = 0  # 写入溢出日志的次数（未发送的部分在下次通知中提示）
+        self.sent = 0  # 已发送的通知消息数
+
+    def pending(self):
+        return sum(entry["count"] for entry in self._entries.values())
+
+    # 记录一次最终失败，并确保当前事件循环中有通知任务在等待
+    def add(self, bot, func_name, error, user_info=None):
+        key = (func_name, type(error).__name__)
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is None:
+            if len(self._entries) >= self.max_entries:
+                self._write_overflow(now, key, error, user_info)
+            else:
+                entry = self._entries[key] = {"count": 0, "first_at": now, "last_at": now, "error": "", "users": []}
+        if entry is not None:
+            entry["count"] += 1
+            entry["last_at"] = now
+            entry["error"] = str(error)[:300]
+            if user_info and user_info not in entry["users"] and len(entry["users"]) < self.max_users:
+                entry["users"].append(user_info)
+        self._schedule(bot)
+
+    def _write_overflow(self, now, key, error, user_info):
+        self.overflowed += 1
+        line = json.dumps({"time": now, "func": key[0], "error_type": key[1], "error": str(error), "user": user_info}, ensure_ascii=False)
+        try:
+            if os.path.exists(self.overflow_path) and os.path.getsize(self.overflow_path) > self.overflow_max_bytes:
+                os.replace(self.overflow_path, self.overflow_path + ".1")
+            with open(self.overflow_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logging.error(f"写入错误溢出日志失败: {e}")
+
+    def _schedule(self, bot, delay=None):
+        loop = asyncio.get_running_loop()
+        task = self._tasks.get(loop)
+        if task is not None and not task.done():
+            return
+        # 清理已关闭事件循环的任务引用
+        for other in [l for l, t in self._tasks.items() if t.done()]:
+            self._tasks.pop(other)
+        if delay is None:
+            delay = self._next_delay()
+        self._tasks[loop] = loop.create_task(self._flush_later(bot, delay))
+
+    # 距离上次通知不久又出现错误：间隔翻倍；否则恢复为基础间隔
+    def _next_delay(self):
+        now = time.monotonic()
+        if self._last_sent_at is not None and now - self._last_sent_at < self._delay * 2:
+            self._delay = min(self.max_delay, self._delay * 2)
+        else:
+            self._delay = self.base_delay
+        return self._delay
+
+    async def _flush_later(self, bot, delay):
+        await asyncio.sleep(delay)
+        await self.flush(bot)
+
+    # 把合并后的错误渲染为若干条不超过长度上限的 HTML 消息，返回 [(文本, 该消息包含的条目键), ...]
+    def render(self, entries, overflowed=0):
+        blocks = []
+        for key, entry in sorted(entries.items(), key=lambda item: -item[1]["count"]):
+            func_name, error_type = key
+            users = "、".join(html.escape(str(u)) for u in entry["users"])
+            more = entry["count"] - len(entry["users"])
+            block = (
+                f"❌ <code>{html.escape(func_name)}</code> · <code>{html.escape(error_type)}</code> × {entry['count']}\n"
+                + (f"👤 {users}" + (f" 等（共 {entry['count']} 次）" if more > 0 else "") + "\n" if users else "")
+                + f"最近错误：<code>{html.escape(entry['error'])}</code>"
+            )
+            if len(block) > MESSAGE_LIMIT - 100:
+                # 单条过长时缩短错误内容（不能直接截断，否则会切断 HTML 标签）
+                block = block.split("最近错误：")[0] + "最近错误：（内容过长已省略）"
+            blocks.append((block, key))
+        if overflowed:
+            blocks.append((f"📄 另有 {overflowed} 条错误超出缓冲上限，已写入 <code>{html.escape(self.overflow_path)}</code>", None))
+        header = "⚠️ <b>投稿转发失败汇总</b>"
+        messages, current, keys = [], header, []
+        for block, key in blocks:
+            if keys and len(current) + len(block) + 2 > MESSAGE_LIMIT:
+                messages.append((current, keys))
+                current, keys = header + "（续）", []
+            current += "\n\n" + block
+            keys.append(key)
+        messages.append((current, keys))
+        return messages
+
+    # 立即发送所有待通知的错误
+    async def flush(self, bot):
+        entries, self._entries = self._entries, {}
+        overflowed, self.overflowed = self.overflowed, 0
+        if not entries and not overflowed:
+            return
+        messages = self.render(entries, overflowed)
+        admin_id, limiter, _ = send_context(bot)
+        for i, (text, keys) in enumerate(messages):
+            try:
+                await limiter.acquire(admin_id)
+                await bot.send_message(chat_id=admin_id, text=text, parse_mode=ParseMode.HTML)
+                self.sent += 1
+            except Exception as e:
+                logging.error(f"聚合通知发送失败: {e}")
+                # 未发出的条目放回缓冲区（与期间新增的错误合并），退避后重试
+                unsent = [key for _, keys in messages[i:] for key in keys]
+                self._merge_back({key: entries[key] for key in unsent if key is not None})
+                if None in unsent:
+                    self.overflowed += overflowed
+                self._delay = min(self.max_delay, self._delay * 2)
+                self._tasks.pop(asyncio.get_running_loop(), None)
+                self._schedule(bot, self._delay)
+                return
+        self._last_sent_at = time.monotonic()
+
+    def _merge_back(self, entries):
+        for key, entry in entries.items():
+            current = self._entries.get(key)
+            if current is None:
+                if len(self._entries) < self.max_entries:
+                    self._entries[key] = entry
+                else:
+                    self._write_overflow(time.time(), key, f"{entry['error']}（共 {entry['count']} 次）", "、".join(entry["users"]))
+                continue
+            current["count"] += entry["count"]
+            current["first_at"] = min(current["first_at"], entry["first_at"])
+            for user in entry["users"]:
+                if user not in current["users"] and len(current["users"]) < self.max_users:
+                    current["users"].append(user)
+
+    def stats(self):
+        return {"kinds": len(self._entries), "pending": self.pending(), "overflowed": self.overflowed, "sent": self.sent, "delay": self._delay}
+
+# 发送指标：按发送函数名（send_message、send_photo 等）统计
+SEND_LATENCY = METRICS.histogram("bot_api_seconds", "Bot API call latency per attempt in seconds", ("method",))
+SEND_WAIT = METRICS.histogram("outbound_wait_seconds", "Time spent waiting for outbound rate-limit tokens", ("method",))
+SEND_RETRIES = METRICS.counter("bot_api_retries_total", "Bot API attempts that failed and were retried", ("method",))
+SEND_FAILURES = METRICS.counter("bot_api_failures_total", "Bot API calls that finally failed", ("method", "reason"))
+METRICS.gauge("error_notify_pending", "Final send failures waiting to be reported to the admin", lambda: sum(n.pending() for n in _notifiers()))
+
+# 重试策略：最大尝试次数 + 指数退避（带随机抖动）+ 总耗时上限
+class RetryPolicy:
+    __slots__ = ("attempts", "base_delay", "max_delay", "deadline")
+
+    def __init__(self, attempts=3, base_delay=1.0, max_delay=10.0, deadline=30.0):
+        self.attempts = attempts  # 最大尝试次数（含第一次）
+        self.base_delay = base_delay  # 第一次重试前的基础等待秒数，之后每次翻倍
+        self.max_delay = max_delay  # 单次等待上限
+        self.deadline = deadline  # 从第一次尝试开始的总耗时上限（秒）
+
+    # 第 attempt 次失败后的等待时间：一半固定 + 一半随机，避免大量请求同时重试
+    def backoff(self, attempt):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+# 具名重试策略，调用处用 policy="..." 选择
+RETRY_POLICIES = {
+    "default": RetryPolicy(attempts=3, base_delay=1, max_delay=10, deadline=30),  # 文字消息、自动回复、通知
+    "media": RetryPolicy(attempts=5, base_delay=1.5, max_delay=20, deadline=60),  # 图片、文件
+    "large_media": RetryPolicy(attempts=8, base_delay=2, max_delay=30, deadline=120),  # 视频、媒体组
+}
+
+# 不可能通过重试成功的错误：用户屏蔽机器人、请求格式错误、Token 无效等
+TERMINAL_ERRORS = (Forbidden, BadRequest, InvalidToken, ChatMigrated, Conflict, EndPointNotFound)
+
+
+# 错误分类：返回 (是否可重试, 指定等待秒数)
+# - RetryAfter：触发限流，按 Telegram 给出的 retry_after 等待
+# - 终止类错误、其他非 Telegram 异常（程序错误）：不再重试
+# - 其他网络错误 / 超时、RuntimeError（关机时 HTTP 连接已关闭）：按退避策略重试
+def classify_error(e):
+    if isinstance(e, RetryAfter):
+        retry_after = e.retry_after
+        seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+        return True, seconds
+    if isinstance(e, TERMINAL_ERRORS):
+        return False, None
+    if isinstance(e, (NetworkError, TelegramError, RuntimeError)):
+        return True, None
+    return False, None
+
+
+# 是否为 file_id 无效 / 过期导致的错误（只有这种情况需要重新上传文件）
+def is_file_id_error(e):
+    if not isinstance(e, BadRequest):
+        return False
+    message = str(e).lower()
+    return any(marker in message for marker in ("file identifier", "file_id", "file reference", "file_reference"))
+
+
+class SendFailure:
+    """
+    safe_send() 最终失败时的返回值，布尔值为假（调用方仍可用 if result 判断是否成功）：
+    - error: 最后一次尝试的异常
+    - retryable: 是否为可重试的错误（已达重试上限）；False 表示终止类错误，再次发送也不会成功
+    """
+
+    __slots__ = ("error", "retryable")
+
+    def __init__(self, error, retryable):
+        self.error = error
+        self.retryable = retryable
+
+    def __bool__(self):
+        return False
+
+
+# 每个机器人的管理员 ID、出站限流器和错误通知聚合器：{bot token: (管理员ID, 限流器, 通知聚合器)}
+# 所有经过 safe_send 的发送都先在该机器人的限流器排队，最终失败后登记到它的通知聚合器，合并后批量通知管理员
+BOT_CONTEXTS = {}
+
+
+# 登记一个机器人的发送设置（主程序注册处理器时调用）
+def register_bot(bot, admin_id, limiter, notifier):
+    BOT_CONTEXTS[bot.token] = (admin_id, limiter, notifier)
+
+
+# 取得某个机器人的 (管理员ID, 限流器, 通知聚合器)，未登记的机器人直接报错，不静默使用默认设置
+def send_context(bot):
+    context = BOT_CONTEXTS.get(bot.token)
+    if context is None:
+        logging.error("safe_send: 机器人未调用 register_bot 登记发送设置")
+        raise RuntimeError("bot is not registered with safe_send.register_bot()")
+    return context
+
+
+def _notifiers():
+    return {context[2] for context in BOT_CONTEXTS.values()}
+
+# 已上传图片的 file_id 缓存：{(bot token, 绝对路径): (文件签名, file_id)}
+# 首次上传成功后记录 Telegram 返回的 file_id，之后直接复用，不再重复上传图片字节（file_id 只对上传它的机器人有效）
+UPLOADED_FILE_IDS = {}
+
+
+# 文件签名：修改时间(纳秒) + 文件大小，图片被替换后签名变化，旧 file_id 自动失效
+def _file_signature(file_path):
+    st = os.stat(file_path)
+    return st.st_mtime_ns, st.st_size
+
+
+# 主动清除某个图片的 file_id 缓存（设置/清除欢迎图、自动回复图时调用）
+def invalidate_file_id(file_path):
+    path = os.path.abspath(file_path)
+    for key in [key for key in UPLOADED_FILE_IDS if key[1] == path]:
+        UPLOADED_FILE_IDS.pop(key)
 
-ADMIN_ID = None
-# 初始化函数，让主程序主动传入 ID
-def set_admin_id(admin_id):
-    global ADMIN_ID
-    ADMIN_ID = admin_id
 
 # safe_send_image 函数，安全发送带图片回复信息（欢迎信息 + 自动回复）
-async def safe_send_image(bot, chat_id, file_path, *, caption=None, parse_mode=None, reply_markup=None, user_info=None, user_id=None, retries=5, delay=3):
-    # - 自动使用 with open 打开文件，防止重复 retry 导致句柄失效
+async def safe_send_image(bot, chat_id, file_path, *, caption=None, parse_mode=None, reply_markup=None, user_info=None, user_id=None, policy="media"):
+    # - 优先复用已缓存的 file_id，只有首次发送（或图片变更后）才真正上传文件
+    # - 文件内容只读取一次，重试时复用同一份字节，不会重复打开文件
     # - 兼容所有常用参数 + safe_send 内部自动重试
+    key = (bot.token, os.path.abspath(file_path))
+    send_kwargs = dict(
+        chat_id=chat_id,
+        caption=caption,
+        parse_mode=parse_mode,
+        reply_markup=reply_markup,
+        user_info=user_info,
+        user_id=user_id,
+        policy=policy
+    )
     try:
+        signature = _file_signature(file_path)
+        cached = UPLOADED_FILE_IDS.get(key)
+        if cached and cached[0] == signature:
+            result = await safe_send(bot, bot.send_photo, photo=cached[1], notify=False, **send_kwargs)
+            if result:
+                return result
+            if not is_file_id_error(result.error):
+                # 用户屏蔽机器人、网络故障等与 file_id 无关的失败：保留缓存，重新上传也不会成功
+                send_context(bot)[2].add(bot, "send_photo", result.error, user_info)
+                return result
+            # file_id 已失效，丢弃缓存后回退为重新上传
+            UPLOADED_FILE_IDS.pop(key, None)
         with open(file_path, "rb") as f:
-            photo = InputFile(f)
-            return await safe_send(
-                bot,
-                bot.send_photo,
-                chat_id=chat_id,
-                photo=photo,
-                caption=caption,
-                parse_mode=parse_mode,
-                reply_markup=reply_markup,
-                user_info=user_info,
-                user_id=user_id,
-                retries=retries,
-                delay=delay
-            )
+            photo = InputFile(f.read(), filename=os.path.basename(file_path))
+        result = await safe_send(bot, bot.send_photo, photo=photo, **send_kwargs)
+        if result and result.photo:
+            # 记录最大尺寸图片的 file_id，后续发送直接引用
+            UPLOADED_FILE_IDS[key] = (signature, result.photo[-1].file_id)
+        return result
     except Exception as e:
         logging.error(f"safe_send_image 错误: {e}")
         return None
 
 
 # safe_send 函数，用于防止主机网络延迟卡顿导致程序崩溃
-async def safe_send(bot, send_func, *args, retries=3, delay=2, user_info="未知用户", user_id=None, **kwargs):
+async def safe_send(bot, send_func, *args, policy="default", user_info="未知用户", user_id=None, notify=True, **kwargs):
     """
     安全发送封装函数：
     - send_func: 发送函数，如 bot.send_message、bot.send_photo 等
-    - retries: 最大重试次数（默认 3 次）
-    - delay: 每次重试间隔秒数（默认 2 秒）
+    - policy: 重试策略名称（见 RETRY_POLICIES）或 RetryPolicy 实例
     - user_info: 投稿人信息（用于管理员通知）
     - user_id: 投稿用户的 Telegram ID（发送失败时通知用户）
+    - notify: 最终失败时是否登记到管理员错误通知（调用方自行处理失败时传 False）
     - args/kwargs: 原始发送函数的参数
+    终止类错误（如用户屏蔽机器人、格式错误）不会重试；限流错误按 retry_after 等待
+    成功返回发送函数的结果，最终失败返回 SendFailure（布尔值为假）
     """
-    global ERROR_NOTIFY_TASK
+    if isinstance(policy, str):
+        policy = RETRY_POLICIES.get(policy, RETRY_POLICIES["default"])
+    func_name = getattr(send_func, '__name__', str(send_func))
+    started = time.monotonic()
+    # 媒体组按条数消耗限流令牌
+    media = kwargs.get("media")
+    cost = len(media) if isinstance(media, (list, tuple)) else 1
+    _, limiter, notifier = send_context(bot)
 
-    for attempt in range(1, retries + 1):
+    for attempt in range(1, policy.attempts + 1):
+        call_started = None
         try:
-            return await send_func(*args, **kwargs)  # 正常执行发送函数
+            wait_started = time.perf_counter()
+            await limiter.acquire(kwargs.get("chat_id"), cost)  # 等待出站限流令牌
+            call_started = time.perf_counter()
+            SEND_WAIT.observe(call_started - wait_started, func_name)
+            result = await send_func(*args, **kwargs)  # 正常执行发送函数
+            SEND_LATENCY.observe(time.perf_counter() - call_started, func_name)
+            return result
         except Exception as e:
-            logging.warning(f"第 {attempt} 次尝试失败: {e}")
-
-            if attempt < retries:
-                await asyncio.sleep(delay)  # 重试前等待
+            if call_started is not None:
+                SEND_LATENCY.observe(time.perf_counter() - call_started, func_name)
+            retryable, wait = classify_error(e)
+            if wait is None:
+                wait = policy.backoff(attempt)
+            elapsed = time.monotonic() - started
+            # 仍可重试：错误可重试、还有剩余次数、等待后不会超过总耗时上限
+            if retryable and attempt < policy.attempts and elapsed + wait <= policy.deadline:
+                SEND_RETRIES.inc(func_name)
+                logging.warning(f"{func_name} 第 {attempt} 次尝试失败（{wait:.1f} 秒后重试）: {e}")
+                await asyncio.sleep(wait)  # 重试前等待
                 continue  # 继续下一次尝试
             else:
-                # 最终失败，准备错误通知消息
-                func_name = getattr(send_func, '__name__', str(send_func))
-                error_msg = (
-                    f"⚠️ <b>投稿转发失败：</b><code>{func_name}</code>\n"
-                    f"👤 {user_info}\n"
-                    f"❌ 错误：<code>{str(e)}</code>"
-                )
-                ERROR_NOTIFY_BUFFER.append(error_msg)  # 添加到缓冲区
-
-                # 启动聚合通知任务（仅一次）
-                if not ERROR_NOTIFY_TASK:
-                    ERROR_NOTIFY_TASK = asyncio.create_task(send_error_notifications(bot))
-
-
-async def send_error_notifications(bot):
-    # 延迟聚合发送错误通知，避免刷屏
-    global ERROR_NOTIFY_BUFFER, ERROR_NOTIFY_TASK
-    await asyncio.sleep(ERROR_NOTIFY_DELAY)  # 等待一段时间收集错误
-    if ERROR_NOTIFY_BUFFER:
-        try:
-            # 拼接所有错误信息
-            combined_message = "\n\n".join(ERROR_NOTIFY_BUFFER)
-            await bot.send_message(chat_id=ADMIN_ID, text=combined_message, parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logging.error(f"聚合通知发送失败: {e}")
-    # 清空缓存和任务引用
-    ERROR_NOTIFY_BUFFER = []
-    ERROR_NOTIFY_TASK = None
+                logging.warning(f"{func_name} 第 {attempt} 次尝试失败（{'已达重试上限' if retryable else '不可重试的错误'}）: {e}")
+                SEND_FAILURES.inc(func_name, "exhausted" if retryable else "terminal")
+                # 最终失败，登记到错误通知聚合器（合并同类错误，延迟批量通知管理员）
+                if notify:
+                    notifier.add(bot, func_name, e, user_info)
+                return SendFailure(e, retryable)
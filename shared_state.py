@@ -0,0 +1,280 @@
+# ✅ shared_state.py
+# --- 多进程共享状态 ---
+# 多个工作进程服务同一个机器人时（如 webhook 更新由反向代理分发给多个进程），
+# 投稿频率计数、收集中的媒体组、管理员等待中的操作需要所有进程共同可见。
+# SharedState 定义共享状态接口：原子计数、带过期时间的键、列表追加、租约锁；
+# SqliteSharedState 用于同一台机器上的多个进程（SQLite WAL），MemorySharedState 只在单个进程内有效，用于测试。
+
+import json
+import os
+import socket
+import time
+
+from outbox import open_database
+
+
+class SharedState:
+    """
+    共享状态接口（值为可 JSON 序列化的对象，ttl 为秒数，None 表示不过期）：
+    - get() / set() / delete(): 读写单个键，已过期的键视为不存在
+    - add(): 键不存在时才写入，返回是否写入（原子）
+    - incr(): 原子加减计数，返回新值；键不存在时从 0 开始并设置过期时间，已存在时保持原过期时间
+    - append() / pop(): 原子追加到列表并返回新长度 / 原子取出并删除
+    - keys(): 列出某个前缀下未过期的键
+    - acquire() / release(): 租约锁，同一时间只有一个持有者，持有者退出后到期自动释放
+    - purge(): 删除已过期的键，返回删除数量
+    """
+
+    def __init__(self, owner=None, clock=time.time):
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}"  # 本进程的租约持有者标识
+        self.clock = clock
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def incr(self, key, amount=1, ttl=None):
+        raise NotImplementedError
+
+    def append(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def pop(self, key, default=None):
+        raise NotImplementedError
+
+    def keys(self, prefix=""):
+        raise NotImplementedError
+
+    def acquire(self, name, ttl):
+        raise NotImplementedError
+
+    def release(self, name):
+        raise NotImplementedError
+
+    def purge(self):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def _expires(self, ttl):
+        return None if ttl is None else self.clock() + ttl
+
+
+class MemorySharedState(SharedState):
+    """
+    进程内的共享状态实现（字典 + 过期时间），行为与 SQLite 实现相同：
+    - 用于测试与单进程运行，clock 可替换为虚拟时钟
+    - 多个实例可以共用同一个 store，模拟多个进程访问同一份状态
+    """
+
+    def __init__(self, owner=None, clock=time.time, store=None):
+        super().__init__(owner, clock)
+        self._store = {} if store is None else store  # {键: (值, 过期时间)}
+
+    def _live(self, key):
+        item = self._store.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= self.clock():
+            del self._store[key]
+            return None
+        return item
+
+    def get(self, key, default=None):
+        item = self._live(key)
+        return default if item is None else item[0]
+
+    def set(self, key, value, ttl=None):
+        self._store[key] = (value, self._expires(ttl))
+
+    def delete(self, key):
+        return self._store.pop(key, None) is not None
+
+    def add(self, key, value, ttl=None):
+        if self._live(key) is not None:
+            return False
+        self.set(key, value, ttl)
+        return True
+
+    def incr(self, key, amount=1, ttl=None):
+        item = self._live(key)
+        if item is None:
+            item = (0, self._expires(ttl))
+        value = item[0] + amount
+        self._store[key] = (value, item[1])
+        return value
+
+    def append(self, key, value, ttl=None):
+        item = self._live(key)
+        if item is None:
+            item = ([], self._expires(ttl))
+        items = item[0] + [value]
+        self._store[key] = (items, item[1])
+        return len(items)
+
+    def pop(self, key, default=None):
+        item = self._live(key)
+        if item is None:
+            return default
+        del self._store[key]
+        return item[0]
+
+    def keys(self, prefix=""):
+        return [key for key in list(self._store) if key.startswith(prefix) and self._live(key) is not None]
+
+    def acquire(self, name, ttl):
+        key = f"lease:{name}"
+        item = self._live(key)
+        if item is not None and item[0] != self.owner:
+            return False
+        self.set(key, self.owner, ttl)
+        return True
+
+    def release(self, name):
+        key = f"lease:{name}"
+        item = self._live(key)
+        if item is not None and item[0] == self.owner:
+            del self._store[key]
+
+    def purge(self):
+        now = self.clock()
+        expired = [key for key, (_, expires_at) in self._store.items() if expires_at is not None and expires_at <= now]
+        for key in expired:
+            del self._store[key]
+        return len(expired)
+
+
+class SqliteSharedState(SharedState):
+    """
+    基于 SQLite WAL 的共享状态，同一台机器上的多个进程打开同一个数据库文件即可共享：
+    - 读操作直接查询；读-改-写操作在 BEGIN IMMEDIATE 事务中完成，多个进程之间互斥
+    - 过期的键在读取时忽略，由 purge() 定期删除（expires_at 带索引）
+    """
+
+    def __init__(self, path, owner=None, clock=time.time):
+        super().__init__(owner, clock)
+        self.conn = open_database(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS shared_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                expires_at REAL
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS idx_shared_state_expires ON shared_state(expires_at);
+        """)
+
+    # 在写事务中读取一个未过期的键，返回 (值, 过期时间) 或 None
+    def _select(self, key):
+        row = self.conn.execute(
+            "SELECT value, expires_at FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, self.clock())
+        ).fetchone()
+        return None if row is None else (json.loads(row["value"]), row["expires_at"])
+
+    def _write(self, key, value, expires_at):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False, separators=(",", ":")), expires_at)
+        )
+
+    # 读-改-写：func() 在同一个写事务中执行，返回 func() 的结果
+    def _update(self, func):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func()
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def get(self, key, default=None):
+        item = self._select(key)
+        return default if item is None else item[0]
+
+    def set(self, key, value, ttl=None):
+        self._write(key, value, self._expires(ttl))
+
+    def delete(self, key):
+        return self.conn.execute("DELETE FROM shared_state WHERE key = ?", (key,)).rowcount > 0
+
+    def add(self, key, value, ttl=None):
+        def add():
+            if self._select(key) is not None:
+                return False
+            self._write(key, value, self._expires(ttl))
+            return True
+        return self._update(add)
+
+    def incr(self, key, amount=1, ttl=None):
+        def incr():
+            item = self._select(key) or (0, self._expires(ttl))
+            self._write(key, item[0] + amount, item[1])
+            return item[0] + amount
+        return self._update(incr)
+
+    def append(self, key, value, ttl=None):
+        def append():
+            items, expires_at = self._select(key) or ([], self._expires(ttl))
+            items.append(value)
+            self._write(key, items, expires_at)
+            return len(items)
+        return self._update(append)
+
+    def pop(self, key, default=None):
+        def pop():
+            item = self._select(key)
+            if item is None:
+                return default
+            self.conn.execute("DELETE FROM shared_state WHERE key = ?", (key,))
+            return item[0]
+        return self._update(pop)
+
+    def keys(self, prefix=""):
+        # 前缀范围查询走主键索引（"\uffff" 作为上界）
+        rows = self.conn.execute(
+            "SELECT key FROM shared_state WHERE key >= ? AND key < ? AND (expires_at IS NULL OR expires_at > ?)",
+            (prefix, prefix + "\uffff", self.clock())
+        ).fetchall()
+        return [row["key"] for row in rows]
+
+    def acquire(self, name, ttl):
+        key = f"lease:{name}"
+
+        def acquire():
+            item = self._select(key)
+            if item is not None and item[0] != self.owner:
+                return False
+            self._write(key, self.owner, self._expires(ttl))
+            return True
+        return self._update(acquire)
+
+    def release(self, name):
+        self.conn.execute("DELETE FROM shared_state WHERE key = ? AND value = ?", (f"lease:{name}", json.dumps(self.owner)))
+
+    def purge(self):
+        return self.conn.execute(
+            "DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?", (self.clock(),)
+        ).rowcount
+
+    def close(self):
+        self.conn.close()
+
+
+# 按配置创建共享状态："sqlite"（默认，path 为数据库文件） 或 "memory"（仅本进程，测试用）
+def create_shared_state(cfg, path):
+    backend = cfg.get("backend", "sqlite")
+    if backend == "memory":
+        return MemorySharedState()
+    if backend == "sqlite":
+        return SqliteSharedState(path)
+    raise ValueError(f"未知的共享状态后端: {backend}")
@@ -0,0 +1,79 @@
+# ✅ status_server.py
+# --- 本地状态 HTTP 服务（健康检查等）---
+# 只处理简单的 GET 请求，基于 asyncio 实现，不引入额外 Web 框架
+
+import asyncio
+import inspect
+import logging
+
+# 读取请求头的超时时间（秒），防止空闲连接长期占用
+REQUEST_TIMEOUT = 5
+
+STATUS_TEXT = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 500: "Internal Server Error"}
+
+
+class StatusServer:
+    """
+    极简 HTTP 服务：
+    - route(path, handler): 注册路由，handler() 返回 (状态码, Content-Type, 响应内容)，可为普通函数或协程
+    - start() / stop(): 在当前事件循环中启动 / 关闭监听
+    """
+
+    def __init__(self, listen="127.0.0.1", port=8080):
+        self.listen = listen
+        self.port = port
+        self.routes = {}
+        self._server = None
+
+    def route(self, path, handler):
+        self.routes[path] = handler
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.listen, self.port)
+        logging.info(f"✅ 状态服务已启动：http://{self.listen}:{self.port}")
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            # 读完请求头（内容不使用）
+            while True:
+                line = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                if line in (b"\r\n", b"\n", b""):
+                    break
+            parts = request_line.decode("latin-1").split()
+            if len(parts) < 2:
+                return
+            method, path = parts[0], parts[1].split("?", 1)[0]
+            handler = self.routes.get(path)
+            if method not in ("GET", "HEAD"):
+                status, content_type, body = 405, "text/plain; charset=utf-8", "method not allowed\n"
+            elif handler is None:
+                status, content_type, body = 404, "text/plain; charset=utf-8", "not found\n"
+            else:
+                try:
+                    result = handler()
+                    if inspect.isawaitable(result):
+                        result = await result
+                    status, content_type, body = result
+                except Exception as e:
+                    logging.error(f"状态服务处理 {path} 失败: {e}")
+                    status, content_type, body = 500, "text/plain; charset=utf-8", "internal error\n"
+            payload = body.encode("utf-8") if isinstance(body, str) else body
+            head = (
+                f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(payload)}\r\n"
+                "Connection: close\r\n\r\n"
+            )
+            writer.write(head.encode("latin-1") + (b"" if method == "HEAD" else payload))
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,396 @@
+# ✅ storage.py
+# --- 禁言名单与可修改配置的存储后端 ---
+# JsonStorage: 沿用 config.json / blacklist.json（默认）
+# SqliteStorage: SQLite 单行增删改，until 字段带索引，可被多个进程共享
+
+import heapq
+import json
+import logging
+import os
+import time
+
+from outbox import open_database
+from persistence import JsonWriter
+
+# 管理员可通过指令修改的配置项（SQLite 后端只迁移和保存这些键，token 等启动参数仍留在 config.json）
+SETTING_KEYS = (
+    "welcome_message",
+    "auto_reply",
+    "welcome_buttons",
+    "post_limit",
+    "button_layout",
+    "dedup",
+)
+
+
+# 禁言列表的排序方式："time" 按禁言时间（最新在前），"until" 按到期时间（最先到期在前，永久禁言排最后）
+BAN_ORDERS = ("time", "until")
+
+# JSON 后端各排序方式的排序键
+_BAN_SORT_KEYS = {
+    "time": lambda item: -(item[1].get("banned_at") or 0),
+    "until": lambda item: (item[1].get("until") is None, item[1].get("until") or 0),
+}
+
+
+# 禁言记录是否匹配搜索关键字：用户 ID 前缀，或用户名 / 昵称包含关键字（不区分大小写，可带 @）
+def ban_matches(user_id, info, query):
+    query = query.lstrip("@").casefold()
+    return (
+        str(user_id).startswith(query)
+        or query in str(info.get("username") or "").casefold()
+        or query in str(info.get("name") or "").casefold()
+    )
+
+
+# SQLite 自定义函数：与 ban_matches() 相同的大小写折叠（内置 LIKE / lower() 只处理 ASCII）
+def _casefold(value):
+    return str(value or "").casefold()
+
+
+# 规范化禁言记录：旧版本用 float('inf') 表示永久禁言，统一转换为 None
+def normalize_ban(info):
+    if info.get("until") == float('inf'):
+        info["until"] = None
+    return info
+
+
+class BaseStorage:
+    """
+    存储后端接口：
+    - 禁言：get_ban / set_ban / set_bans / delete_ban / delete_bans / iter_bans / count_bans / page_bans / pop_expired_bans
+    - 配置：get_setting / set_setting / settings / reload_settings / accept_settings
+    - flush / close：写出待保存数据、关闭后端
+    """
+
+    def get_ban(self, user_id):
+        raise NotImplementedError
+
+    def set_ban(self, user_id, info):
+        self.set_bans({user_id: info})
+
+    def set_bans(self, bans):
+        raise NotImplementedError
+
+    def delete_ban(self, user_id):
+        return self.delete_bans([user_id]) > 0
+
+    def delete_bans(self, user_ids):
+        raise NotImplementedError
+
+    # 遍历所有禁言记录：(user_id, info)
+    def iter_bans(self):
+        raise NotImplementedError
+
+    def count_bans(self):
+        raise NotImplementedError
+
+    # 按排序方式分页读取禁言记录，可按关键字搜索，返回 (匹配总数, [(user_id, info), ...])
+    def page_bans(self, order="time", offset=0, limit=10, query=None):
+        raise NotImplementedError
+
+    # 移除所有在 now 之前到期的禁言，返回被移除的用户 ID 列表
+    def pop_expired_bans(self, now):
+        raise NotImplementedError
+
+    def get_setting(self, key, default=None):
+        raise NotImplementedError
+
+    def set_setting(self, key, value):
+        raise NotImplementedError
+
+    # 所有已保存的可修改配置项：{键: 值}
+    def settings(self):
+        raise NotImplementedError
+
+    # 配置被外部修改（手动编辑文件、其他进程写入）时返回最新配置，否则返回 None
+    # 只读取不替换，校验通过后由调用方调用 accept_settings() 采用
+    def reload_settings(self):
+        return None
+
+    # 采用 reload_settings() 读取并已校验通过的配置
+    def accept_settings(self, settings):
+        pass
+
+    async def flush(self):
+        pass
+
+    async def close(self):
+        pass
+
+
+class JsonStorage(BaseStorage):
+    """
+    JSON 文件后端：
+    - 禁言名单、配置都常驻内存，查询是字典查找
+    - 修改后由 JsonWriter 在后台合并写入、原子替换文件
+    - 有期限的禁言记录在最小堆中，按到期时间批量清理
+    - 分页用的有序索引在第一次翻页时按需排序，名单变化后失效重建
+    """
+
+    def __init__(self, config_path, blacklist_path, config, blacklist):
+        self.config_path = config_path
+        self.blacklist_path = blacklist_path
+        self.config = config
+        self.blacklist = {str(uid): normalize_ban(info) for uid, info in blacklist.items()}
+        self.writer = JsonWriter()
+        self._config_signature = self._file_signature(config_path)
+        # 禁言过期索引：[(until, user_id), ...]，解禁或重新禁言后旧条目不删除，出堆时与名单核对后丢弃
+        self._expiry_heap = []
+        self._order_index = {}  # {排序方式: [user_id, ...]}
+        for uid, info in self.blacklist.items():
+            self._schedule_expiry(uid, info.get("until", 0))
+
+    def _schedule_expiry(self, user_id, until):
+        if until is not None:
+            heapq.heappush(self._expiry_heap, (until, user_id))
+
+    def _save_blacklist(self):
+        self._order_index.clear()
+        self.writer.schedule(self.blacklist_path, self.blacklist)
+
+    def get_ban(self, user_id):
+        return self.blacklist.get(str(user_id))
+
+    def set_bans(self, bans):
+        for user_id, info in bans.items():
+            self.blacklist[str(user_id)] = info
+            self._schedule_expiry(str(user_id), info.get("until"))
+        self._save_blacklist()
+
+    def delete_bans(self, user_ids):
+        removed = sum(1 for user_id in user_ids if self.blacklist.pop(str(user_id), None) is not None)
+        if removed:
+            self._save_blacklist()
+        return removed
+
+    def iter_bans(self):
+        return iter(list(self.blacklist.items()))
+
+    def count_bans(self):
+        return len(self.blacklist)
+
+    def _ordered_ids(self, order):
+        ids = self._order_index.get(order)
+        if ids is None:
+            ids = [uid for uid, _ in sorted(self.blacklist.items(), key=_BAN_SORT_KEYS[order])]
+            self._order_index[order] = ids
+        return ids
+
+    def page_bans(self, order="time", offset=0, limit=10, query=None):
+        ids = self._ordered_ids(order)
+        if query:
+            ids = [uid for uid in ids if ban_matches(uid, self.blacklist[uid], query)]
+        return len(ids), [(uid, self.blacklist[uid]) for uid in ids[offset:offset + limit]]
+
+    def pop_expired_bans(self, now):
+        removed = []
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            until, user_id = heapq.heappop(self._expiry_heap)
+            info = self.blacklist.get(user_id)
+            # 记录已被解除或已被重新禁言（到期时间变化），属于过时条目
+            if info is None or info.get("until") != until:
+                continue
+            self.blacklist.pop(user_id)
+            removed.append(user_id)
+        if removed:
+            self._save_blacklist()
+        return removed
+
+    def get_setting(self, key, default=None):
+        return self.config.get(key, default)
+
+    def set_setting(self, key, value):
+        self.config[key] = value
+        self.writer.schedule(self.config_path, self.config)
+
+    def settings(self):
+        return {key: self.config[key] for key in SETTING_KEYS if key in self.config}
+
+    @staticmethod
+    def _file_signature(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_mtime_ns, st.st_size
+
+    def reload_settings(self):
+        # 还有尚未写出的修改时跳过本轮，避免用磁盘上的旧内容覆盖
+        if self.writer.is_pending(self.config_path):
+            return None
+        signature = self._file_signature(self.config_path)
+        if signature is None or signature == self._config_signature:
+            return None
+        try:
+            with open(self.config_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except Exception as e:
+            logging.error(f"重新读取 {self.config_path} 失败: {e}")
+            return None
+        # 记录签名：内容无效时不在每一轮重复报错，下次修改文件后再读取
+        self._config_signature = signature
+        return data
+
+    def accept_settings(self, settings):
+        # 原地更新，保证后续保存写出的是新内容
+        self.config.clear()
+        self.config.update(settings)
+
+    async def flush(self):
+        await self.writer.flush()
+
+    async def close(self):
+        await self.writer.close()
+
+
+class SqliteStorage(BaseStorage):
+    """
+    SQLite 后端：
+    - bans 表按用户 ID 单行增删改，until 字段有索引，过期清理是一条索引范围删除
+    - 分页直接按 banned_at / until 索引排序取一页，不读取整个名单
+    - 搜索用注册的 casefold() 函数比较用户名 / 昵称，与 JSON 后端一样不区分大小写（包括非拉丁字母）
+    - settings 表按键保存 JSON 值
+    - 与发送队列共用同一个 WAL 数据库文件，多个进程可同时读写
+    """
+
+    def __init__(self, path):
+        self.conn = open_database(path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS bans (
+                user_id TEXT PRIMARY KEY,
+                until REAL,
+                banned_at REAL NOT NULL,
+                info TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_bans_until ON bans(until);
+            CREATE INDEX IF NOT EXISTS idx_bans_banned_at ON bans(banned_at);
+            CREATE TABLE IF NOT EXISTS settings (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+        """)
+        self.conn.create_function("casefold", 1, _casefold, deterministic=True)
+        self._data_version = self._read_data_version()
+
+    # 其他连接（包括其他进程）提交修改后 data_version 会变化
+    def _read_data_version(self):
+        return self.conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def get_ban(self, user_id):
+        row = self.conn.execute("SELECT info FROM bans WHERE user_id = ?", (str(user_id),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set_bans(self, bans):
+        now = time.time()
+        rows = [
+            (str(uid), info.get("until"), info.get("banned_at") or now, json.dumps(info, ensure_ascii=False))
+            for uid, info in bans.items()
+        ]
+        with self.conn:
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT INTO bans (user_id, until, banned_at, info) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET until = excluded.until, banned_at = excluded.banned_at, info = excluded.info",
+                rows
+            )
+
+    def delete_bans(self, user_ids):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            cur = self.conn.executemany("DELETE FROM bans WHERE user_id = ?", [(str(uid),) for uid in user_ids])
+        return cur.rowcount
+
+    def iter_bans(self):
+        for user_id, info in self.conn.execute("SELECT user_id, info FROM bans ORDER BY banned_at"):
+            yield user_id, json.loads(info)
+
+    def count_bans(self):
+        return self.conn.execute("SELECT COUNT(*) FROM bans").fetchone()[0]
+
+    def page_bans(self, order="time", offset=0, limit=10, query=None):
+        order_by = "banned_at DESC" if order == "time" else "until IS NULL, until"
+        where, params = "", ()
+        if query:
+            query = query.lstrip("@").casefold()
+            pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+            where = (
+                "WHERE user_id LIKE ? ESCAPE '\\' "
+                "OR instr(casefold(json_extract(info, '$.username')), ?) > 0 "
+                "OR instr(casefold(json_extract(info, '$.name')), ?) > 0"
+            )
+            params = (pattern, query, query)
+        total = self.conn.execute(f"SELECT COUNT(*) FROM bans {where}", params).fetchone()[0]
+        rows = self.conn.execute(
+            f"SELECT user_id, info FROM bans {where} ORDER BY {order_by} LIMIT ? OFFSET ?",
+            params + (limit, offset)
+        ).fetchall()
+        return total, [(user_id, json.loads(info)) for user_id, info in rows]
+
+    def pop_expired_bans(self, now):
+        with self.conn:
+            self.conn.execute("BEGIN")
+            rows = self.conn.execute("SELECT user_id FROM bans WHERE until IS NOT NULL AND until <= ?", (now,)).fetchall()
+            self.conn.execute("DELETE FROM bans WHERE until IS NOT NULL AND until <= ?", (now,))
+        return [row[0] for row in rows]
+
+    def get_setting(self, key, default=None):
+        row = self.conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_setting(self, key, value):
+        self.conn.execute(
+            "INSERT INTO settings (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value, ensure_ascii=False))
+        )
+
+    def settings(self):
+        return {key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM settings")}
+
+    def reload_settings(self):
+        version = self._read_data_version()
+        if version == self._data_version:
+            return None
+        self._data_version = version
+        return self.settings()
+
+    # 一次性迁移：把 config.json 中的可修改配置和 blacklist.json 中的禁言记录导入数据库
+    # 已迁移过（meta 表有记录）时直接跳过，返回是否执行了迁移
+    def migrate_from_json(self, config, blacklist):
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone():
+            return False
+        with self.conn:
+            self.conn.execute("BEGIN")
+            for key in SETTING_KEYS:
+                if key in config:
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO settings (key, value) VALUES (?, ?)",
+                        (key, json.dumps(config[key], ensure_ascii=False))
+                    )
+            now = time.time()
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO bans (user_id, until, banned_at, info) VALUES (?, ?, ?, ?)",
+                [
+                    (str(uid), info.get("until"), info.get("banned_at") or now, json.dumps(info, ensure_ascii=False))
+                    for uid, info in ((uid, normalize_ban(dict(info))) for uid, info in blacklist.items())
+                ]
+            )
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('migrated_from_json', ?)", (str(now),))
+        logging.info(f"✅ 已将 {len(blacklist)} 条禁言记录和配置从 JSON 文件迁移到数据库")
+        return True
+
+    async def close(self):
+        self.conn.close()
+
+
+# 按配置创建存储后端
+def create_storage(config, config_path, blacklist_path, blacklist, db_path):
+    if config.get("storage", "json") == "sqlite":
+        storage = SqliteStorage(db_path)
+        storage.migrate_from_json(config, blacklist)
+        return storage
+    return JsonStorage(config_path, blacklist_path, config, blacklist)
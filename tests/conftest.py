@@ -0,0 +1,39 @@
+# ✅ tests/conftest.py
+# --- 测试公共设置：虚拟时钟，并让测试可以直接导入项目根目录下的模块 ---
+
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class VirtualClock:
+    """
+    虚拟时钟：
+    - 调用实例返回当前时间，advance() 手动前进
+    - sleep() 可替换 asyncio.sleep：先让出一次事件循环（其他就绪的任务照常运行），再把时间拨到醒来的时刻，不真正等待
+    """
+
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []  # 每次 sleep 的秒数
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    async def sleep(self, seconds):
+        self.slept.append(seconds)
+        wake_at = self.now + seconds
+        await asyncio.sleep(0)
+        self.now = max(self.now, wake_at)
+
+
+@pytest.fixture
+def clock():
+    return VirtualClock()
@@ -0,0 +1,136 @@
+# ✅ tests/test_outbound_limiter.py
+# --- 出站限流：令牌桶、按到达顺序排队、媒体组按条数计费（虚拟时钟，不真正等待）---
+
+import asyncio
+
+import pytest
+
+import safe_send
+from outbound_limiter import OutboundLimiter, TokenBucket
+from safe_send import ErrorNotifier
+
+
+def test_token_bucket_refills_at_rate():
+    bucket = TokenBucket(rate=2, capacity=4, now=0.0)
+    assert bucket.delay_for(4, 0.0) == 0.0
+    bucket.consume(4, 0.0)
+    assert bucket.delay_for(1, 0.0) == pytest.approx(0.5)
+    assert bucket.delay_for(1, 0.5) == 0.0
+    # 补充不超过容量
+    assert bucket.is_idle(100.0)
+    assert bucket.tokens == 4
+
+
+def test_token_bucket_clock_going_backwards_is_ignored():
+    bucket = TokenBucket(rate=1, capacity=1, now=10.0)
+    bucket.consume(1, 10.0)
+    assert bucket.delay_for(1, 5.0) == pytest.approx(1.0)
+
+
+def test_chat_bucket_spaces_sends(clock):
+    limiter = OutboundLimiter(chat_rate=1, chat_burst=3, clock=clock, sleep=clock.sleep)
+
+    async def send_all():
+        started = clock()
+        for _ in range(5):
+            await limiter.acquire(42)
+        return clock() - started
+
+    # 前 3 条立即放行，之后每秒 1 条
+    assert asyncio.run(send_all()) == pytest.approx(2.0)
+    stats = limiter.stats()
+    assert stats["acquired"] == 5
+    assert stats["delayed"] == 2
+    assert stats["max_wait"] == pytest.approx(1.0)
+
+
+def test_global_bucket_limits_all_chats(clock):
+    limiter = OutboundLimiter(global_rate=10, global_burst=2, clock=clock, sleep=clock.sleep)
+
+    async def send_all():
+        await asyncio.gather(*(limiter.acquire(chat_id) for chat_id in range(4)))
+
+    asyncio.run(send_all())
+    # 不同聊天各自的令牌桶都未用尽，只受全局 10 条/秒限制
+    assert clock() - 1000.0 == pytest.approx(0.2)
+    assert limiter.stats()["chats"] == 4
+
+
+def test_same_chat_is_served_in_arrival_order(clock):
+    limiter = OutboundLimiter(chat_rate=1, chat_burst=1, clock=clock, sleep=clock.sleep)
+    served = []
+
+    async def send(i):
+        await limiter.acquire(42)
+        served.append(i)
+
+    async def send_all():
+        await asyncio.gather(*(send(i) for i in range(5)))
+
+    asyncio.run(send_all())
+    assert served == [0, 1, 2, 3, 4]
+    assert clock() - 1000.0 == pytest.approx(4.0)
+
+
+def test_backlogged_chat_does_not_block_others(clock):
+    limiter = OutboundLimiter(chat_rate=1, chat_burst=1, clock=clock, sleep=clock.sleep)
+    served = {}
+
+    async def send(chat_id, i):
+        await limiter.acquire(chat_id)
+        served[(chat_id, i)] = clock() - 1000.0
+
+    async def send_all():
+        await asyncio.gather(*(send(1, i) for i in range(5)), send(2, 0))
+
+    asyncio.run(send_all())
+    # 聊天 1 积压 4 秒，聊天 2 的发送不需要等待
+    assert served[(2, 0)] == 0.0
+    assert served[(1, 4)] == pytest.approx(4.0)
+
+
+class FakeBot:
+    token = "1:test"
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_media_group(self, chat_id, media):
+        self.sent.append((chat_id, len(media)))
+
+
+@pytest.fixture
+def bot(clock):
+    bot = FakeBot()
+    limiter = OutboundLimiter(global_burst=100, chat_rate=1, chat_burst=10, clock=clock, sleep=clock.sleep)
+    safe_send.register_bot(bot, 999, limiter, ErrorNotifier())
+    yield bot
+    safe_send.BOT_CONTEXTS.pop(bot.token, None)
+
+
+def test_media_group_costs_one_token_per_item(bot, clock):
+    async def send_all():
+        for _ in range(3):
+            await safe_send.safe_send(bot, bot.send_media_group, chat_id=42, media=["a", "b", "c", "d"])
+
+    asyncio.run(send_all())
+    # 聊天令牌桶 10 个：前两组用掉 8 个，第三组还差 2 个，按每秒 1 个补充需要等待 2 秒
+    assert bot.sent == [(42, 4)] * 3
+    assert sum(clock.slept) == pytest.approx(2.0)
+    assert safe_send.send_context(bot)[1].stats()["acquired"] == 3
+
+
+def test_media_group_cost_is_capped_by_capacity(clock):
+    limiter = OutboundLimiter(chat_rate=1, chat_burst=3, clock=clock, sleep=clock.sleep)
+    # 超过容量的消耗按容量计算，不会永远等待
+    asyncio.run(limiter.acquire(42, cost=10))
+    assert clock.slept == []
+
+
+def test_cleanup_drops_idle_chat_buckets(clock):
+    limiter = OutboundLimiter(chat_rate=1, chat_burst=3, clock=clock, sleep=clock.sleep)
+    asyncio.run(limiter.acquire(1))
+    assert limiter.cleanup() == 0
+    clock.advance(1)
+    assert limiter.cleanup() == 1
+    assert limiter.stats()["chats"] == 0
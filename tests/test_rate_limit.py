@@ -0,0 +1,130 @@
+# ✅ tests/test_rate_limit.py
+# --- 投稿频率限制：滑动窗口的边界、清理与重启恢复；多进程共享版本的超限撤销与窗口滑动 ---
+
+import pytest
+
+from rate_limit import SharedWindowLimiter, SlidingWindowLimiter
+from shared_state import MemorySharedState
+
+
+def test_sliding_window_boundary(clock):
+    limiter = SlidingWindowLimiter(window=60, clock=clock)
+    limits = {"all": 2}
+    assert limiter.hit(1, limits)[0]
+    clock.advance(30)
+    assert limiter.hit(1, limits)[0]
+    assert limiter.hit(1, limits) == (False, "all", 2)
+    # 第一条记录恰好满 60 秒时移出窗口
+    clock.advance(29.9)
+    assert not limiter.hit(1, limits)[0]
+    clock.advance(0.1)
+    assert limiter.hit(1, limits)[0]
+    assert (limiter.allowed, limiter.denied) == (3, 2)
+
+
+def test_sliding_window_checks_every_kind(clock):
+    limiter = SlidingWindowLimiter(window=60, clock=clock)
+    assert limiter.hit(1, {"all": 5, "photo": 1})[0]
+    assert limiter.hit(1, {"all": 5, "photo": 1}) == (False, "photo", 1)
+    # 被拒绝的投稿不计入任何类别
+    assert limiter.hit(1, {"all": 2, "text": 1})[0]
+    assert limiter.hit(1, {"all": 2, "text": 5}) == (False, "all", 2)
+
+
+def test_sliding_window_evicts_idle_users(clock):
+    limiter = SlidingWindowLimiter(window=60, clock=clock)
+    limiter.hit(1, {"all": 5})
+    clock.advance(30)
+    limiter.hit(2, {"all": 5})
+    assert limiter.evict_idle() == 0
+    clock.advance(30)
+    assert limiter.evict_idle() == 1
+    assert limiter.stats()["users"] == 1
+    clock.advance(30)
+    assert limiter.evict_idle() == 1
+    assert limiter.stats()["buckets"] == 0
+
+
+def test_sliding_window_restore_after_restart(clock):
+    limiter = SlidingWindowLimiter(window=60, clock=clock)
+    limits = {"all": 2}
+    limiter.hit(1, limits)
+    clock.advance(40)
+    limiter.hit(1, limits)
+    limiter.hit(2, limits)
+    rows = limiter.snapshot()
+    assert sorted(row[0] for row in rows) == [1, 2]
+
+    # 重启耗时 30 秒：用户 1 的第一条记录已过期，其余记录仍在窗口内
+    clock.advance(30)
+    restored = SlidingWindowLimiter(window=60, clock=clock)
+    assert restored.restore(rows) == 2
+    assert restored.stats()["timestamps"] == 2
+    assert restored.hit(1, limits)[0]
+    assert not restored.hit(1, limits)[0]
+
+
+def test_sliding_window_restore_drops_expired_rows(clock):
+    limiter = SlidingWindowLimiter(window=60, clock=clock)
+    limiter.hit(1, {"all": 2})
+    rows = limiter.snapshot()
+    clock.advance(60)
+    restored = SlidingWindowLimiter(window=60, clock=clock)
+    assert restored.restore(rows) == 0
+    assert restored.snapshot() == []
+
+
+@pytest.fixture
+def store():
+    return {}
+
+
+def make_limiter(store, clock, owner="a"):
+    return SharedWindowLimiter(MemorySharedState(owner, clock, store), window=60, slots=6)
+
+
+def counted(limiter, user_id, kind):
+    return sum(limiter.shared.get(key, 0) for key in limiter.shared.keys(f"{limiter.prefix}{user_id}:{kind}:"))
+
+
+def test_denied_hit_is_rolled_back(store, clock):
+    limiter = make_limiter(store, clock)
+    limits = {"all": 2}
+    assert limiter.hit(1, limits) == (True, None, None)
+    assert limiter.hit(1, limits) == (True, None, None)
+    for _ in range(5):
+        assert limiter.hit(1, limits) == (False, "all", 2)
+    # 被拒绝的投稿不占用计数
+    assert counted(limiter, 1, "all") == 2
+    assert (limiter.allowed, limiter.denied) == (2, 5)
+
+
+def test_rollback_covers_earlier_kinds(store, clock):
+    limiter = make_limiter(store, clock)
+    assert limiter.hit(1, {"all": 5, "photo": 1})[0]
+    # 第二个类别超限时，第一个类别本次已加的计数也要撤销
+    assert limiter.hit(1, {"all": 5, "photo": 1}) == (False, "photo", 1)
+    assert counted(limiter, 1, "all") == 1
+    assert counted(limiter, 1, "photo") == 1
+
+
+def test_limit_is_shared_between_processes(store, clock):
+    a = make_limiter(store, clock, "a")
+    b = make_limiter(store, clock, "b")
+    limits = {"all": 3}
+    results = [limiter.hit(1, limits)[0] for limiter in (a, b, a, b, a)]
+    assert results == [True, True, True, False, False]
+    assert counted(a, 1, "all") == 3
+    # 其他用户不受影响
+    assert b.hit(2, limits)[0]
+
+
+def test_window_slides(store, clock):
+    limiter = make_limiter(store, clock)
+    limits = {"all": 1}
+    assert limiter.hit(1, limits)[0]
+    clock.advance(30)
+    assert not limiter.hit(1, limits)[0]
+    # 统计最近 slots + 1 段，最多比窗口多等一段
+    clock.advance(40)
+    assert limiter.hit(1, limits)[0]
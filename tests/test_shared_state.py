@@ -0,0 +1,88 @@
+# ✅ tests/test_shared_state.py
+# --- 共享状态：过期时间与租约（内存实现与 SQLite 实现行为相同）---
+
+import pytest
+
+from shared_state import MemorySharedState, SqliteSharedState
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_state(request, clock, tmp_path):
+    store = {}
+    opened = []
+
+    # 同一个 store / 数据库文件上创建多个实例，模拟多个进程
+    def make(owner):
+        if request.param == "memory":
+            state = MemorySharedState(owner, clock, store)
+        else:
+            state = SqliteSharedState(str(tmp_path / "shared.db"), owner, clock)
+        opened.append(state)
+        return state
+
+    yield make
+    for state in opened:
+        state.close()
+
+
+def test_ttl_expires_keys(make_state, clock):
+    state = make_state("a")
+    state.set("k", "v", ttl=10)
+    state.set("forever", 1)
+    clock.advance(9.9)
+    assert state.get("k") == "v"
+    clock.advance(0.1)
+    assert state.get("k") is None
+    assert state.keys() == ["forever"]
+
+
+def test_incr_keeps_first_expiry(make_state, clock):
+    state = make_state("a")
+    assert state.incr("n", ttl=10) == 1
+    clock.advance(5)
+    # 后续加一不延长过期时间
+    assert state.incr("n", ttl=10) == 2
+    clock.advance(5)
+    assert state.get("n") is None
+    assert state.incr("n", ttl=10) == 1
+
+
+def test_add_only_when_missing_or_expired(make_state, clock):
+    state = make_state("a")
+    assert state.add("once", 1, ttl=10)
+    assert not state.add("once", 2, ttl=10)
+    clock.advance(10)
+    assert state.add("once", 3, ttl=10)
+    assert state.get("once") == 3
+
+
+def test_purge_removes_only_expired(make_state, clock):
+    state = make_state("a")
+    state.set("short", 1, ttl=1)
+    state.set("long", 1, ttl=100)
+    clock.advance(1)
+    assert state.purge() == 1
+    assert state.get("long") == 1
+
+
+def test_lease_is_exclusive_until_released(make_state, clock):
+    a, b = make_state("a"), make_state("b")
+    assert a.acquire("group", ttl=30)
+    assert not b.acquire("group", ttl=30)
+    # 持有者可以续租
+    assert a.acquire("group", ttl=30)
+    # 非持有者释放无效
+    b.release("group")
+    assert not b.acquire("group", ttl=30)
+    a.release("group")
+    assert b.acquire("group", ttl=30)
+
+
+def test_expired_lease_can_be_taken_over(make_state, clock):
+    a, b = make_state("a"), make_state("b")
+    assert a.acquire("group", ttl=30)
+    clock.advance(29)
+    assert not b.acquire("group", ttl=30)
+    clock.advance(1)
+    assert b.acquire("group", ttl=30)
+    assert not a.acquire("group", ttl=30)
@@ -0,0 +1,58 @@
+# ✅ tests/test_storage.py
+# --- 存储后端：JSON 与 SQLite 的禁言列表行为一致 ---
+
+import pytest
+
+from storage import JsonStorage, SqliteStorage
+
+BANS = {
+    "1001": {"name": "Alice", "username": "alice", "banned_at": 100, "until": None},
+    "1002": {"name": "Bob", "username": "bob", "banned_at": 300, "until": 500},
+    "1003": {"name": "Carol", "username": "", "banned_at": 200, "until": 400},
+    "2001": {"name": "Дмитрий", "username": "dima", "banned_at": 150, "until": None},
+    "2002": {"name": "ΣΟΦΊΑ", "username": "", "banned_at": 250, "until": None},
+    "2003": {"name": "Straße", "username": "Groß_Mann", "banned_at": 350, "until": None},
+}
+
+
+@pytest.fixture
+def json_storage(tmp_path):
+    return JsonStorage(str(tmp_path / "config.json"), str(tmp_path / "blacklist.json"), {}, {uid: dict(info) for uid, info in BANS.items()})
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    storage = SqliteStorage(str(tmp_path / "imneko.db"))
+    storage.migrate_from_json({}, BANS)
+    yield storage
+    storage.conn.close()
+
+
+def user_ids(page):
+    return [user_id for user_id, _ in page[1]]
+
+
+@pytest.mark.parametrize("order", ["time", "until"])
+def test_migrated_bans_keep_order(json_storage, sqlite_storage, order):
+    # 迁移时保留原来的禁言时间，按禁言时间排序与 JSON 后端一致
+    assert user_ids(sqlite_storage.page_bans(order)) == user_ids(json_storage.page_bans(order))
+
+
+def test_reload_does_not_replace_settings_until_accepted(tmp_path):
+    path = tmp_path / "config.json"
+    path.write_text('{"auto_reply": "old"}', encoding="utf-8")
+    storage = JsonStorage(str(path), str(tmp_path / "blacklist.json"), {"auto_reply": "old"}, {})
+    path.write_text('{"auto_reply": "new", "post_limit": "invalid"}', encoding="utf-8")
+    settings = storage.reload_settings()
+    assert settings["auto_reply"] == "new"
+    # 校验前仍使用原配置，之后保存时也不会写出未采用的内容
+    assert storage.get_setting("auto_reply") == "old"
+    assert storage.reload_settings() is None
+    storage.accept_settings({"auto_reply": "new"})
+    assert storage.get_setting("auto_reply") == "new"
+
+
+@pytest.mark.parametrize("query", ["ДМИТ", "дмит", "σοφ", "STRASSE", "@ALI", "10", "2", "_m", "%", "nobody"])
+def test_search_matches_json_backend(json_storage, sqlite_storage, query):
+    # SQLite 的 LIKE 只对 ASCII 不区分大小写，两个后端的搜索结果必须一致
+    assert user_ids(sqlite_storage.page_bans("time", query=query)) == user_ids(json_storage.page_bans("time", query=query))
@@ -0,0 +1,64 @@
+# ✅ update_processor.py
+# --- 并发处理更新，同时保证同一用户的更新按顺序执行 ---
+
+import asyncio
+from telegram.ext import BaseUpdateProcessor
+
+
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """
+    按用户分组的并发更新处理器：
+    - 不同用户的更新并发处理，最多同时运行 max_concurrent_updates 个处理函数
+    - 同一用户（按 effective_user / effective_chat 区分）的更新按到达顺序逐个处理
+      管理员的所有指令来自同一用户，因此修改黑名单、配置、按钮、等待状态的操作天然串行
+    - 排队等待同一用户锁的更新不占用运行名额，单个用户刷屏不会拖慢其他用户
+    - max_pending_updates: 同时在处理或等待用户锁的更新总数上限（BaseUpdateProcessor 的信号量），超出的更新在信号量上等待；
+      PTB 对每个更新都会先创建任务再交给处理器，因此这里只限制并发，不会让 getUpdates / webhook 暂停接收新更新
+    """
+
+    def __init__(self, max_concurrent_updates, max_pending_updates=None):
+        super().__init__(max_pending_updates or max_concurrent_updates * 8)
+        self._running_slots = asyncio.Semaphore(max_concurrent_updates)
+        self._key_locks = {}  # {key: [asyncio.Lock, 引用计数]}，没有更新排队时立即删除
+
+    # 获取更新的串行化键，无法识别来源的更新不做串行化
+    @staticmethod
+    def get_key(update):
+        user = getattr(update, "effective_user", None)
+        if user is not None:
+            return f"user:{user.id}"
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return f"chat:{chat.id}"
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.get_key(update)
+        if key is None:
+            async with self._running_slots:
+                await coroutine
+            return
+        entry = self._key_locks.get(key)
+        if entry is None:
+            entry = self._key_locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            # asyncio.Lock 按等待顺序唤醒，同一用户的更新保持到达顺序
+            async with entry[0]:
+                async with self._running_slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._key_locks.pop(key, None)
+
+    # 当前持有或等待锁的用户数
+    @property
+    def active_keys(self):
+        return len(self._key_locks)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass